@@ -1,12 +1,20 @@
 import os.path
 import threading
-from typing import Optional
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
 
 from langchain_core.embeddings import Embeddings
 from langchain_huggingface import HuggingFaceEmbeddings
 from pydantic import BaseModel
+from sqlalchemy import update
+from sqlalchemy.orm import Session
 
 from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
@@ -25,14 +33,56 @@ _lock = threading.Lock()
 locks = {}
 
 _embedding_model: dict[str, Optional[Embeddings]] = {}
+# startup warm-up of the default model: idle (not requested), loading, ready or failed
+_warm_up: dict[str, Any] = {'status': 'idle', 'error': None, 'seconds': None, 'failed_time': None}
+_ready = threading.Event()
+
+
+class EmbeddingNotReadyError(Exception):
+    pass
+
+
+def _onnx_model_path(config: EmbeddingModelInfo, quantization: str) -> tuple[str, Optional[str]]:
+    """Export the model to ONNX once, into a folder next to the original, and return it with the file to load."""
+    from sentence_transformers import SentenceTransformer
+
+    path = f"{config.name}_onnx"
+    if not os.path.exists(os.path.join(path, 'onnx', 'model.onnx')):
+        SQLBotLogUtil.info(f"Exporting embedding model {config.name} to ONNX at {path}")
+        SentenceTransformer(config.name, cache_folder=config.folder, device=config.device,
+                            backend='onnx').save_pretrained(path)
+    if not quantization:
+        return path, None
+
+    file_name = f"model_qint8_{quantization}.onnx"
+    if not os.path.exists(os.path.join(path, 'onnx', file_name)):
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        SQLBotLogUtil.info(f"Quantizing ONNX embedding model to int8 ({quantization})")
+        export_dynamic_quantized_onnx_model(SentenceTransformer(path, device=config.device, backend='onnx'),
+                                            quantization, path)
+    return path, os.path.join('onnx', file_name)
 
 
 class EmbeddingModelCache:
 
     @staticmethod
-    def _new_instance(config: EmbeddingModelInfo = local_embedding_model):
-        return HuggingFaceEmbeddings(model_name=config.name, cache_folder=config.folder,
-                                     model_kwargs={'device': config.device},
+    def _new_instance(config: EmbeddingModelInfo = local_embedding_model, backend: str = settings.EMBEDDING_BACKEND,
+                      quantization: str = settings.EMBEDDING_ONNX_QUANTIZATION):
+        model_name = config.name
+        model_kwargs: dict[str, Any] = {'device': config.device}
+        if backend == 'onnx':
+            # needs sentence-transformers[onnx]; without it, or if the export fails, stay on PyTorch
+            try:
+                model_name, file_name = _onnx_model_path(config, quantization)
+                model_kwargs['backend'] = 'onnx'
+                if file_name:
+                    model_kwargs['model_kwargs'] = {'file_name': file_name}
+            except Exception as e:
+                SQLBotLogUtil.warning(f"ONNX embedding backend unavailable, using PyTorch: {e}")
+                model_name = config.name
+        return HuggingFaceEmbeddings(model_name=model_name, cache_folder=config.folder,
+                                     model_kwargs=model_kwargs,
                                      encode_kwargs={'normalize_embeddings': True}
                                      )
 
@@ -61,3 +111,158 @@ class EmbeddingModelCache:
                     _embedding_model[key] = model_instance
 
         return model_instance
+
+    @staticmethod
+    def warm_up(key: str = settings.DEFAULT_EMBEDDING_MODEL):
+        """Load the model and run one encode, so neither is paid for by the first chat. Blocks until done."""
+        _warm_up.update(status='loading', error=None)
+        start_time = time.time()
+        try:
+            EmbeddingModelCache.get_model(key).embed_query("warm up")
+            _warm_up.update(status='ready', seconds=round(time.time() - start_time, 3))
+            _ready.set()
+            SQLBotLogUtil.info(f"Embedding model ready in {time.time() - start_time:.3f}s")
+        except Exception as e:
+            _warm_up.update(status='failed', error=str(e), failed_time=time.time())
+            SQLBotLogUtil.error(f"Embedding model warm-up failed: {e}")
+
+    @staticmethod
+    def start_warm_up():
+        with _lock:
+            if not settings.EMBEDDING_ENABLED or _warm_up['status'] in ('loading', 'ready'):
+                return
+            _warm_up['status'] = 'loading'
+        threading.Thread(target=EmbeddingModelCache.warm_up, name="embedding-warm-up", daemon=True).start()
+
+    @staticmethod
+    def get_ready_model(key: str = settings.DEFAULT_EMBEDDING_MODEL) -> Embeddings:
+        """
+        get_model for request paths: while the startup warm-up is still loading, wait at most
+        EMBEDDING_NOT_READY_WAIT seconds and then raise EmbeddingNotReadyError instead of blocking the request.
+        After a failed warm-up it raises as well, and starts a background retry at most once per
+        EMBEDDING_WARM_UP_RETRY_DELAY. Without a warm-up the model is loaded lazily as before.
+        """
+        status = _warm_up['status']
+        if status == 'failed':
+            if time.time() - (_warm_up['failed_time'] or 0) >= settings.EMBEDDING_WARM_UP_RETRY_DELAY:
+                EmbeddingModelCache.start_warm_up()
+            raise EmbeddingNotReadyError("embedding model failed to load")
+        if status == 'loading' and not _ready.wait(settings.EMBEDDING_NOT_READY_WAIT):
+            raise EmbeddingNotReadyError("embedding model is still loading")
+        return EmbeddingModelCache.get_model(key)
+
+    @staticmethod
+    def health() -> dict:
+        # for the unauthenticated health check, no error text
+        return {'enabled': settings.EMBEDDING_ENABLED, 'status': _warm_up['status'], 'ready': _ready.is_set()}
+
+    @staticmethod
+    def status() -> dict:
+        return {'enabled': settings.EMBEDDING_ENABLED, 'backend': settings.EMBEDDING_BACKEND,
+                'ready': _ready.is_set(), **_warm_up}
+
+
+_query_lock = threading.Lock()
+_query_embeddings: OrderedDict[tuple[str, str], list[float]] = OrderedDict()
+_in_flight: dict[tuple[str, str], Future] = {}
+# question -> embedding of the chat turn being processed, set by QueryEmbeddingCache.scope
+_request_memo: ContextVar[Optional[dict[str, list[float]]]] = ContextVar('query_embedding_memo', default=None)
+
+
+class QueryEmbeddingCache:
+    """
+    Embeddings of questions, shared by terminology, data training, table and datasource retrieval. A
+    process wide LRU keyed on model and text, plus a memo per chat turn so a question is embedded at most
+    once per turn even when the LRU is disabled or evicts it.
+    """
+
+    @staticmethod
+    def embed(text: str, key: str = settings.DEFAULT_EMBEDDING_MODEL) -> list[float]:
+        memo = _request_memo.get()
+        if memo is not None and text in memo:
+            return memo[text]
+
+        cache_key = (key, text)
+        with _query_lock:
+            embedding = _query_embeddings.get(cache_key)
+            if embedding is not None:
+                _query_embeddings.move_to_end(cache_key)
+                flight = None
+            else:
+                # concurrent callers of the same text, e.g. parallel retrieval stages, share one encode
+                flight = _in_flight.get(cache_key)
+                owner = flight is None
+                if owner:
+                    flight = _in_flight[cache_key] = Future()
+        if flight is not None and not owner:
+            embedding = flight.result()
+        elif flight is not None:
+            try:
+                embedding = EmbeddingModelCache.get_ready_model(key).embed_query(text)
+                flight.set_result(embedding)
+            except Exception as e:
+                flight.set_exception(e)
+                raise
+            finally:
+                with _query_lock:
+                    _in_flight.pop(cache_key, None)
+                    if embedding is not None and settings.QUERY_EMBEDDING_CACHE_SIZE > 0:
+                        _query_embeddings[cache_key] = embedding
+                        while len(_query_embeddings) > settings.QUERY_EMBEDDING_CACHE_SIZE:
+                            _query_embeddings.popitem(last=False)
+
+        if memo is not None:
+            memo[text] = embedding
+        return embedding
+
+    @staticmethod
+    @contextmanager
+    def scope(memo: dict[str, list[float]]):
+        # the memo dict is owned by the caller, e.g. one per LLMService, and may span several scopes
+        token = _request_memo.set(memo)
+        try:
+            yield memo
+        finally:
+            _request_memo.reset(token)
+
+    @staticmethod
+    def run_scoped(memo: dict[str, list[float]], func: Callable, *args, **kwargs):
+        with QueryEmbeddingCache.scope(memo):
+            return func(*args, **kwargs)
+
+    @staticmethod
+    def clear():
+        with _query_lock:
+            _query_embeddings.clear()
+
+
+def save_embeddings_in_batches(session: Session, model_cls: Any, rows: list[tuple[int, str]], label: str,
+                               on_saved: Optional[Callable[[list[tuple[int, list[float]]]], None]] = None):
+    """
+    Embed the text of each (id, text) row and write it to model_cls.embedding. Identical texts are embedded
+    once; every EMBEDDING_BATCH_SIZE distinct texts cost one embed call, one executemany UPDATE and one commit.
+    """
+    ids_by_text: dict[str, list[int]] = {}
+    for _id, text in rows:
+        ids_by_text.setdefault(text, []).append(_id)
+    texts = list(ids_by_text.keys())
+    if not texts:
+        return
+
+    model = EmbeddingModelCache.get_model()
+    batch_size = max(1, settings.EMBEDDING_BATCH_SIZE)
+    start_time = time.time()
+    for offset in range(0, len(texts), batch_size):
+        chunk = texts[offset:offset + batch_size]
+        vectors = model.embed_documents(chunk)
+        saved = [(_id, vector) for text, vector in zip(chunk, vectors) for _id in ids_by_text[text]]
+        # ORM bulk UPDATE by primary key, executed as a single executemany
+        session.execute(update(model_cls), [{'id': _id, 'embedding': vector} for _id, vector in saved])
+        session.commit()
+        if on_saved:
+            on_saved(saved)
+        if len(texts) > batch_size:
+            SQLBotLogUtil.info(f"{label} embeddings: {min(offset + batch_size, len(texts))}/{len(texts)} texts, "
+                               f"{time.time() - start_time:.1f}s")
+    SQLBotLogUtil.info(f"Saved {len(rows)} {label} embeddings from {len(texts)} distinct texts, "
+                       f"{time.time() - start_time:.3f}s")
@@ -0,0 +1,88 @@
+"""
+Compare the ONNX embedding backend with PyTorch for the local embedding model, before switching
+EMBEDDING_BACKEND on a node. tests/test_embedding_parity.py runs the same check under pytest; from the shell:
+
+    python -m apps.ai_model.embedding_parity --quantization avx2 --min-cosine 0.99
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from apps.ai_model.embedding import EmbeddingModelCache, local_embedding_model
+
+SAMPLE_TEXTS = [
+    "上个月各地区的销售额是多少",
+    "统计每个部门的员工人数和平均工资",
+    "近一年手术类型分布",
+    "Top 10 customers by order amount in 2024",
+    "# Table: orders, 订单表\n[\n(id:bigint, 主键),\n(customer_id:bigint, 客户ID),\n(amount:numeric, 订单金额)\n]",
+]
+
+
+def _embed(backend: str, quantization: str, texts: list[str]) -> tuple[np.ndarray, float, float]:
+    start_time = time.time()
+    model = EmbeddingModelCache._new_instance(local_embedding_model, backend=backend, quantization=quantization)
+    load_time = time.time() - start_time
+    loaded = getattr(getattr(model, '_client', None), 'backend', 'torch')
+    if loaded != backend:
+        # _new_instance falls back to PyTorch when ONNX cannot be loaded, that would compare torch with itself
+        raise RuntimeError(f"requested the {backend} backend, loaded {loaded}, see the log for the cause")
+    model.embed_documents(texts[:1])  # warm up
+    start_time = time.time()
+    vectors = np.asarray(model.embed_documents(texts), dtype=np.float32)
+    return vectors, load_time, time.time() - start_time
+
+
+def check_parity(texts: list[str], quantization: str = '') -> dict:
+    reference, torch_load, torch_time = _embed('torch', '', texts)
+    candidate, onnx_load, onnx_time = _embed('onnx', quantization, texts)
+    # both sides are normalized by the model wrapper, the row-wise dot product is the cosine
+    cosine = np.sum(reference * candidate, axis=1)
+    # the ranking retrieval sees: does each text still find the same nearest neighbour among the others
+    same_neighbour = np.argsort(-(reference @ reference.T), axis=1)[:, 1] == \
+                     np.argsort(-(candidate @ candidate.T), axis=1)[:, 1]
+    return {
+        "texts": len(texts),
+        "quantization": quantization or None,
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "neighbour_agreement": float(same_neighbour.mean()),
+        "torch_load_seconds": round(torch_load, 3),
+        "onnx_load_seconds": round(onnx_load, 3),
+        "torch_embed_seconds": round(torch_time, 3),
+        "onnx_embed_seconds": round(onnx_time, 3),
+    }
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check ONNX embedding output against PyTorch")
+    parser.add_argument("--quantization", default='', help="int8 quantization config, e.g. avx2, avx512_vnni, arm64")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="lowest acceptable per-text cosine")
+    parser.add_argument("--file", help="file with one text per line, instead of the built-in samples")
+    parser.add_argument("texts", nargs="*", help="texts to embed, instead of the built-in samples")
+    args = parser.parse_args(argv)
+
+    texts = args.texts
+    if args.file:
+        with open(args.file, encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+    if len(texts) < 2:
+        texts = SAMPLE_TEXTS
+
+    result = check_parity(texts, args.quantization)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+    if result["min_cosine"] < args.min_cosine:
+        print(f"FAIL: min cosine {result['min_cosine']:.4f} < {args.min_cosine}")
+        return 1
+    if result["neighbour_agreement"] < 1:
+        print(f"FAIL: nearest neighbour changed for {1 - result['neighbour_agreement']:.0%} of the texts")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
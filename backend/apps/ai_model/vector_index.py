@@ -0,0 +1,235 @@
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional, Sequence
+
+import numpy as np
+
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+try:
+    import hnswlib
+
+    HNSW_AVAILABLE = True
+except ImportError:
+    HNSW_AVAILABLE = False
+
+# (id, vector, payload)
+IndexItem = tuple[int, Sequence[float], dict]
+# (id, score, payload)
+SearchHit = tuple[int, float, dict]
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms != 0)
+
+
+class ExactIndex:
+    """Brute force cosine index, one matrix product per query. Exact, and fast enough for tens of thousands of rows."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ids: list[int] = []
+        self._payloads: list[dict] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def upsert(self, items: Iterable[IndexItem]):
+        items = [item for item in items if item[1] is not None]
+        if not items:
+            return
+        with self._lock:
+            self.remove([item[0] for item in items])
+            rows = _normalize(np.asarray([item[1] for item in items], dtype=np.float32))
+            self._matrix = rows if self._matrix is None else np.vstack([self._matrix, rows])
+            self._ids.extend(item[0] for item in items)
+            self._payloads.extend(item[2] or {} for item in items)
+
+    def remove(self, ids: Iterable[int]):
+        ids = set(ids)
+        self.remove_where(lambda _id, payload: _id in ids)
+
+    def remove_where(self, predicate: Callable[[int, dict], bool]):
+        with self._lock:
+            keep = [i for i, (_id, payload) in enumerate(zip(self._ids, self._payloads)) if not predicate(_id, payload)]
+            if len(keep) == len(self._ids):
+                return
+            self._ids = [self._ids[i] for i in keep]
+            self._payloads = [self._payloads[i] for i in keep]
+            self._matrix = self._matrix[keep] if keep else None
+
+    def get(self, ids: Iterable[int]) -> dict[int, tuple[np.ndarray, dict]]:
+        ids = set(ids)
+        with self._lock:
+            return {_id: (self._matrix[i], self._payloads[i]) for i, _id in enumerate(self._ids) if _id in ids}
+
+    def search(self, query: Sequence[float], k: int, min_score: Optional[float] = None,
+               predicate: Optional[Callable[[int, dict], bool]] = None) -> list[SearchHit]:
+        with self._lock:
+            ids, payloads, matrix = self._ids, self._payloads, self._matrix
+        if matrix is None or k <= 0:
+            return []
+        scores = matrix @ _normalize(np.asarray(query, dtype=np.float32))
+        if predicate is not None:
+            mask = np.fromiter((predicate(_id, payload) for _id, payload in zip(ids, payloads)), dtype=bool,
+                               count=len(ids))
+            scores = np.where(mask, scores, -np.inf)
+        if min_score is not None:
+            scores = np.where(scores > min_score, scores, -np.inf)
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(ids[i], float(scores[i]), payloads[i]) for i in top if np.isfinite(scores[i])]
+
+
+class HnswIndex(ExactIndex):
+    """
+    Approximate index on hnswlib. Vectors are kept in the exact store as well, for get() and as the fallback when
+    filtering leaves fewer than k approximate hits.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._hnsw = None
+
+    def _ensure_hnsw(self, dim: int, capacity: int):
+        if self._hnsw is None:
+            self._hnsw = hnswlib.Index(space='cosine', dim=dim)
+            self._hnsw.init_index(max_elements=max(capacity, 1024), ef_construction=settings.VECTOR_INDEX_HNSW_EF,
+                                  M=settings.VECTOR_INDEX_HNSW_M, allow_replace_deleted=True)
+            self._hnsw.set_ef(settings.VECTOR_INDEX_HNSW_EF)
+        elif self._hnsw.get_current_count() + capacity > self._hnsw.get_max_elements():
+            self._hnsw.resize_index((self._hnsw.get_current_count() + capacity) * 2)
+
+    def upsert(self, items: Iterable[IndexItem]):
+        items = [item for item in items if item[1] is not None]
+        if not items:
+            return
+        with self._lock:
+            super().upsert(items)
+            vectors = np.asarray([item[1] for item in items], dtype=np.float32)
+            self._ensure_hnsw(vectors.shape[1], len(items))
+            self._hnsw.add_items(vectors, [item[0] for item in items], replace_deleted=True)
+
+    def remove_where(self, predicate: Callable[[int, dict], bool]):
+        with self._lock:
+            removed = [_id for _id, payload in zip(self._ids, self._payloads) if predicate(_id, payload)]
+            super().remove_where(predicate)
+            if self._hnsw is not None:
+                for _id in removed:
+                    try:
+                        self._hnsw.mark_deleted(_id)
+                    except RuntimeError:
+                        pass
+
+    def search(self, query: Sequence[float], k: int, min_score: Optional[float] = None,
+               predicate: Optional[Callable[[int, dict], bool]] = None) -> list[SearchHit]:
+        with self._lock:
+            count = len(self._ids)
+            if self._hnsw is None or count == 0 or k <= 0:
+                return []
+            payloads = dict(zip(self._ids, self._payloads))
+            fetch = min(count, k if predicate is None else k * settings.VECTOR_INDEX_HNSW_OVERFETCH)
+            labels, distances = self._hnsw.knn_query(np.asarray(query, dtype=np.float32), k=fetch)
+        hits = []
+        for label, distance in zip(labels[0], distances[0]):
+            _id = int(label)
+            payload = payloads.get(_id)
+            score = 1.0 - float(distance)
+            if payload is None or (min_score is not None and score <= min_score):
+                continue
+            if predicate is not None and not predicate(_id, payload):
+                continue
+            hits.append((_id, score, payload))
+            if len(hits) == k:
+                return hits
+        if fetch < count and len(hits) < k:
+            # the filter is more selective than the over-fetch allowed for, answer exactly instead
+            return super().search(query, k, min_score, predicate)
+        return hits
+
+
+def _new_index() -> ExactIndex:
+    if settings.VECTOR_INDEX_BACKEND == 'hnsw':
+        if HNSW_AVAILABLE:
+            return HnswIndex()
+        SQLBotLogUtil.warning("VECTOR_INDEX_BACKEND=hnsw but hnswlib is not installed, using the exact index")
+    return ExactIndex()
+
+
+_lock = threading.Lock()
+_load_locks: dict[tuple[str, Any], threading.Lock] = {}
+_indexes: dict[tuple[str, Any], tuple[ExactIndex, float]] = {}
+
+
+class VectorIndexCache:
+    """
+    In-process vector indexes for embedding retrieval, one per (namespace, key), e.g. ('terminology', oid).
+    Used instead of pgvector queries when VECTOR_INDEX_BACKEND is 'exact' or 'hnsw'. An index is loaded lazily
+    from the metadata database, kept current by the save/delete paths of this process and reloaded after
+    VECTOR_INDEX_TTL so writes made by other workers show up.
+    """
+
+    @staticmethod
+    def enabled() -> bool:
+        return settings.VECTOR_INDEX_BACKEND != 'pgvector'
+
+    @staticmethod
+    def get(namespace: str, key: Any, loader: Callable[[], Iterable[IndexItem]]) -> ExactIndex:
+        index_key = (namespace, key)
+        entry = _indexes.get(index_key)
+        if entry is not None and time.time() - entry[1] < settings.VECTOR_INDEX_TTL:
+            return entry[0]
+        with _lock:
+            load_lock = _load_locks.setdefault(index_key, threading.Lock())
+        with load_lock:
+            entry = _indexes.get(index_key)
+            if entry is not None and time.time() - entry[1] < settings.VECTOR_INDEX_TTL:
+                return entry[0]
+            start = time.time()
+            index = _new_index()
+            index.upsert(loader())
+            with _lock:
+                _indexes[index_key] = (index, time.time())
+            SQLBotLogUtil.info(f"Loaded vector index {namespace}:{key}, {len(index)} vectors, "
+                               f"{time.time() - start:.3f}s")
+            return index
+
+    @staticmethod
+    def _loaded(namespace: str, key: Any = None) -> list[ExactIndex]:
+        # key None addresses every loaded index of the namespace, for deletes where the owner is unknown
+        with _lock:
+            return [v[0] for k, v in _indexes.items() if k[0] == namespace and (key is None or k[1] == key)]
+
+    @staticmethod
+    def upsert(namespace: str, key: Any, items: Iterable[IndexItem]):
+        # an index that is not loaded yet reads the saved rows when it is first used
+        items = list(items)
+        for index in VectorIndexCache._loaded(namespace, key):
+            index.upsert(items)
+
+    @staticmethod
+    def remove(namespace: str, key: Any, ids: Iterable[int]):
+        ids = set(ids)
+        for index in VectorIndexCache._loaded(namespace, key):
+            index.remove(ids)
+
+    @staticmethod
+    def remove_where(namespace: str, key: Any, predicate: Callable[[int, dict], bool]):
+        for index in VectorIndexCache._loaded(namespace, key):
+            index.remove_where(predicate)
+
+    @staticmethod
+    def invalidate(namespace: str, key: Any = None):
+        with _lock:
+            for index_key in [k for k in _indexes.keys() if k[0] == namespace and (key is None or k[1] == key)]:
+                _indexes.pop(index_key, None)
+
+    @staticmethod
+    def stats() -> list[dict]:
+        with _lock:
+            return [{"namespace": k[0], "key": k[1], "size": len(v[0]), "type": type(v[0]).__name__,
+                     "age": int(time.time() - v[1])} for k, v in _indexes.items()]
@@ -2,7 +2,6 @@ import asyncio
 import io
 import traceback
 
-import numpy as np
 import orjson
 import pandas as pd
 from fastapi import APIRouter, HTTPException
@@ -13,6 +12,7 @@ from apps.chat.curd.chat import list_chats, get_chat_with_records, create_chat,
     delete_chat, get_chat_chart_data, get_chat_predict_data, get_chat_with_records_with_data, get_chat_record_by_id
 from apps.chat.models.chat_model import CreateChat, ChatRecord, RenameChat, ChatQuestion, ExcelData, SmartMatchRequest
 from apps.chat.task.llm import LLMService
+from apps.db.result_set import columns_to_dataframe
 from common.core.deps import CurrentAssistant, SessionDep, CurrentUser, Trans
 
 router = APIRouter(tags=["Data Q&A"], prefix="/chat")
@@ -196,7 +196,7 @@ async def recommend_questions(session: SessionDep, current_user: CurrentUser, ch
 
         return StreamingResponse(_err(e), media_type="text/event-stream")
 
-    return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
+    return StreamingResponse(llm_service.async_await_result(), media_type="text/event-stream")
 
 
 @router.post("/question")
@@ -225,7 +225,7 @@ async def stream_sql(session: SessionDep, current_user: CurrentUser, request_que
 
         return StreamingResponse(_err(e), media_type="text/event-stream")
 
-    return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
+    return StreamingResponse(llm_service.async_await_result(), media_type="text/event-stream")
 
 
 @router.post("/record/{chat_record_id}/{action_type}")
@@ -266,28 +266,20 @@ async def analysis_or_predict(session: SessionDep, current_user: CurrentUser, ch
 
         return StreamingResponse(_err(e), media_type="text/event-stream")
 
-    return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
+    return StreamingResponse(llm_service.async_await_result(), media_type="text/event-stream")
 
 
 @router.post("/excel/export")
 async def export_excel(excel_data: ExcelData, trans: Trans):
     def inner():
-        _fields_list = []
-        data = []
         if not excel_data.data:
             raise HTTPException(
                 status_code=500,
                 detail=trans("i18n_excel_export.data_is_empty")
             )
 
-        for _data in excel_data.data:
-            _row = []
-            for field in excel_data.axis:
-                _row.append(_data.get(field.value))
-            data.append(_row)
-        for field in excel_data.axis:
-            _fields_list.append(field.name)
-        df = pd.DataFrame(np.array(data), columns=_fields_list)
+        columns = [[_data.get(field.value) for _data in excel_data.data] for field in excel_data.axis]
+        df = columns_to_dataframe(columns, [field.name for field in excel_data.axis])
 
         buffer = io.BytesIO()
 
@@ -15,7 +15,7 @@ from apps.template.generate_chart.generator import get_chart_template
 from apps.template.generate_dynamic.generator import get_dynamic_template
 from apps.template.generate_guess_question.generator import get_guess_question_template
 from apps.template.generate_predict.generator import get_predict_template
-from apps.template.generate_sql.generator import get_sql_template
+from apps.template.generate_sql.generator import get_sql_template, get_sql_chart_template
 from apps.template.select_datasource.generator import get_datasource_template
 
 
@@ -195,6 +195,9 @@ class AiModelQuestion(BaseModel):
         return get_sql_template()['user'].format(engine=self.engine, schema=self.db_schema, question=self.question,
                                                  rule=self.rule, current_time=current_time, error_msg=self.error_msg)
 
+    def sql_chart_user_question(self):
+        return get_sql_chart_template()['user'].format(lang=self.lang)
+
     def chart_sys_question(self):
         return get_chart_template()['system'].format(sql=self.sql, question=self.question, lang=self.lang)
 
@@ -0,0 +1,163 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from apps.ai_model.embedding import QueryEmbeddingCache
+from apps.chat.models.chat_model import ChatQuestion
+from apps.datasource.models.datasource import CoreDatasource
+from apps.system.schemas.system_schema import AssistantOutDsSchema
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+
+class CachedAnswer:
+    def __init__(self, question: str, sql_answer: str, chart_answer: Optional[str] = None,
+                 embedding: Optional[list[float]] = None):
+        self.question = question
+        self.sql_answer = sql_answer
+        self.chart_answer = chart_answer
+        self.embedding = embedding
+        self.create_time = time.time()
+
+
+_lock = threading.Lock()
+# bucket key -> normalized question -> answer, buckets ordered by last use
+_buckets: OrderedDict[str, OrderedDict[str, CachedAnswer]] = OrderedDict()
+_count = 0
+
+
+def normalize_question(question: str) -> str:
+    question = re.sub(r'\s+', ' ', (question or '').strip().lower())
+    return question.rstrip('?？。.!！ ')
+
+
+def _ds_key(ds: CoreDatasource | AssistantOutDsSchema) -> str:
+    return f"ds:{ds.id}" if isinstance(ds, CoreDatasource) else f"assistant:{ds.id}"
+
+
+class AnswerCache:
+    """
+    Replays the LLM's SQL (and chart) answer for a question already answered against the same datasource
+    and prompt context; only the query is executed again. The bucket key covers the organization, the
+    datasource and a fingerprint of everything in the SQL prompt besides the question itself, so a changed
+    schema, terminology, training data or custom prompt starts a fresh bucket.
+    """
+
+    @staticmethod
+    def enabled() -> bool:
+        return settings.ANSWER_CACHE_ENABLED
+
+    @staticmethod
+    def build_bucket_key(oid: int, ds: CoreDatasource | AssistantOutDsSchema, chat_question: ChatQuestion) -> str:
+        raw = '|'.join(str(p or '') for p in (oid, _ds_key(ds), chat_question.engine, chat_question.lang,
+                                                chat_question.db_schema, chat_question.terminologies,
+                                                chat_question.data_training, chat_question.custom_prompt))
+        return f"{_ds_key(ds)}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+    @staticmethod
+    def lookup(bucket_key: str, question: str) -> tuple[Optional[CachedAnswer], Optional[list[float]]]:
+        """Returns the cached answer if any, and the question embedding when one was computed, for put()."""
+        normalized = normalize_question(question)
+        with _lock:
+            bucket = _buckets.get(bucket_key)
+            if bucket is not None:
+                AnswerCache._evict_expired(bucket_key, bucket)
+                bucket = _buckets.get(bucket_key)
+            if bucket:
+                _buckets.move_to_end(bucket_key)
+                answer = bucket.get(normalized)
+                if answer is not None:
+                    return answer, None
+                candidates = [a for a in bucket.values() if a.embedding is not None]
+            else:
+                candidates = []
+
+        if not AnswerCache._embedding_enabled():
+            return None, None
+        embedding = AnswerCache._embed(question)
+        if embedding is None or not candidates:
+            return None, embedding
+        # embeddings are normalized by the model, so the dot product is the cosine similarity
+        scores = np.asarray([a.embedding for a in candidates], dtype=np.float32) @ np.asarray(embedding,
+                                                                                                dtype=np.float32)
+        best = int(np.argmax(scores))
+        if float(scores[best]) >= settings.ANSWER_CACHE_SIMILARITY:
+            SQLBotLogUtil.info(f"Answer cache similar hit ({float(scores[best]):.3f}): "
+                               f"'{question}' -> '{candidates[best].question}'")
+            return candidates[best], embedding
+        return None, embedding
+
+    @staticmethod
+    def put(bucket_key: str, question: str, sql_answer: str, chart_answer: Optional[str] = None,
+            embedding: Optional[list[float]] = None):
+        global _count
+        normalized = normalize_question(question)
+        if not normalized or not sql_answer:
+            return
+        if embedding is None and AnswerCache._embedding_enabled():
+            embedding = AnswerCache._embed(question)
+        with _lock:
+            bucket = _buckets.setdefault(bucket_key, OrderedDict())
+            _buckets.move_to_end(bucket_key)
+            previous = bucket.pop(normalized, None)
+            if previous is None:
+                _count += 1
+            elif chart_answer is None and previous.sql_answer == sql_answer:
+                chart_answer = previous.chart_answer
+            bucket[normalized] = CachedAnswer(question, sql_answer, chart_answer, embedding)
+            AnswerCache._evict_overflow()
+
+    @staticmethod
+    def invalidate_ds(ds_id: Optional[int]):
+        global _count
+        if ds_id is None:
+            return
+        prefix = f"ds:{ds_id}:"
+        with _lock:
+            for key in [k for k in _buckets.keys() if k.startswith(prefix)]:
+                _count -= len(_buckets.pop(key))
+
+    @staticmethod
+    def clear():
+        global _count
+        with _lock:
+            _buckets.clear()
+            _count = 0
+
+    @staticmethod
+    def _embedding_enabled() -> bool:
+        return settings.ANSWER_CACHE_EMBEDDING_ENABLED and settings.EMBEDDING_ENABLED
+
+    @staticmethod
+    def _embed(question: str) -> Optional[list[float]]:
+        try:
+            return QueryEmbeddingCache.embed(question)
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Embed question for answer cache failed: {e}")
+            return None
+
+    @staticmethod
+    def _evict_expired(bucket_key: str, bucket: OrderedDict[str, CachedAnswer]):
+        global _count
+        deadline = time.time() - settings.ANSWER_CACHE_TTL
+        for key in [k for k, a in bucket.items() if a.create_time < deadline]:
+            bucket.pop(key)
+            _count -= 1
+        if not bucket:
+            _buckets.pop(bucket_key, None)
+
+    @staticmethod
+    def _evict_overflow():
+        global _count
+        # oldest answers of the least recently used bucket go first
+        while _count > settings.ANSWER_CACHE_MAX_ENTRIES and _buckets:
+            key, bucket = next(iter(_buckets.items()))
+            bucket.popitem(last=False)
+            _count -= 1
+            if not bucket:
+                _buckets.pop(key)
@@ -0,0 +1,65 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Any, AsyncIterator
+
+_EMPTY = object()
+
+
+class ChunkChannel:
+    """
+    Single producer (the executor thread or asyncio task running a chat task) to consumer bridge. Chunks
+    are pushed as they are produced, and the async iterator serves SSE and MCP responses without holding
+    a threadpool thread while waiting.
+    """
+
+    def __init__(self):
+        self._chunks: deque = deque()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    def put(self, chunk: Any):
+        with self._lock:
+            self._chunks.append(chunk)
+            self._notify()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._notify()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.append(waiter)
+        try:
+            while True:
+                with self._lock:
+                    if self._chunks:
+                        chunk = self._chunks.popleft()
+                    elif self._closed:
+                        return
+                    else:
+                        # cleared under the lock, a put after this point sets it again
+                        waiter[1].clear()
+                        chunk = _EMPTY
+                if chunk is _EMPTY:
+                    await waiter[1].wait()
+                    continue
+                yield chunk
+        finally:
+            with self._lock:
+                self._waiters.remove(waiter)
+
+    def _notify(self):
+        for loop, event in self._waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # loop already closed, its consumer is gone
+                pass
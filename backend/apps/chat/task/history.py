@@ -0,0 +1,124 @@
+import re
+import threading
+from functools import lru_cache
+from typing import Any, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+try:
+    # installed with langchain-openai
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_CJK = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]')
+_encoding = None
+_encoding_failed = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is not None or _encoding_failed or tiktoken is None:
+        return _encoding
+    with _encoding_lock:
+        if _encoding is None and not _encoding_failed:
+            try:
+                _encoding = tiktoken.get_encoding(settings.CHAT_HISTORY_TOKENIZER)
+            except Exception as e:
+                # the encoding file is downloaded on first use, offline nodes estimate instead
+                _encoding_failed = True
+                SQLBotLogUtil.warning(
+                    f"Cannot load tokenizer {settings.CHAT_HISTORY_TOKENIZER}, estimating tokens: {e}")
+    return _encoding
+
+
+def start_tokenizer_load():
+    """Load the tokenizer in the background at startup, so no chat pays for the download."""
+    if tiktoken is not None:
+        threading.Thread(target=_get_encoding, name="chat-history-tokenizer", daemon=True).start()
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """Tokens of a message, with tiktoken when available; otherwise one per CJK character and four characters
+    per token for the rest, close enough for a budget."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _to_message(message: dict[str, Any]) -> Optional[BaseMessage]:
+    if message.get('type') == 'human':
+        return HumanMessage(content=message.get('content'))
+    if message.get('type') == 'ai':
+        return AIMessage(content=message.get('content'))
+    return None
+
+
+def _split_turns(messages: list[dict[str, Any]]) -> list[list[BaseMessage]]:
+    # a turn is a human message and the answers that follow it, the logged system prompt is rebuilt by the caller
+    turns: list[list[BaseMessage]] = []
+    for message in messages or []:
+        msg = _to_message(message)
+        if msg is None:
+            continue
+        if isinstance(msg, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(msg)
+    return turns
+
+
+def _summarize(turns: list[list[BaseMessage]], budget: int) -> str:
+    # the answers of the dropped turns, newest first, cut to what fits; no extra llm call on the request path
+    lines: list[str] = []
+    used = 0
+    for turn in reversed(turns):
+        for msg in turn:
+            if not isinstance(msg, AIMessage) or not msg.content:
+                continue
+            line = ' '.join(str(msg.content).split())[:settings.CHAT_HISTORY_SUMMARY_ANSWER_CHARS]
+            tokens = count_tokens(line)
+            if used + tokens > budget:
+                return '\n'.join(reversed(lines))
+            lines.append(line)
+            used += tokens
+    return '\n'.join(reversed(lines))
+
+
+def build_history(system_prompt: str, messages: list[dict[str, Any]], max_messages: Optional[int] = None) -> \
+        list[BaseMessage]:
+    """
+    The system prompt followed by the most recent whole turns of a logged conversation that fit into
+    CHAT_HISTORY_TOKEN_BUDGET, and at most max_messages messages. With CHAT_HISTORY_SUMMARY_ENABLED the answers of
+    the dropped turns are appended to the system prompt in a short block, within CHAT_HISTORY_SUMMARY_TOKENS.
+    """
+    turns = _split_turns(messages)
+    budget = settings.CHAT_HISTORY_TOKEN_BUDGET
+    kept: list[list[BaseMessage]] = []
+    used = 0
+    count = 0
+    for turn in reversed(turns):
+        tokens = sum(count_tokens(str(msg.content or '')) for msg in turn)
+        if (budget > 0 and used + tokens > budget) or (max_messages is not None and count + len(turn) > max_messages):
+            break
+        kept.append(turn)
+        used += tokens
+        count += len(turn)
+    kept.reverse()
+    dropped = turns[:len(turns) - len(kept)]
+
+    if dropped and settings.CHAT_HISTORY_SUMMARY_ENABLED:
+        summary = _summarize(dropped, settings.CHAT_HISTORY_SUMMARY_TOKENS)
+        if summary:
+            system_prompt = f'{system_prompt}\n\n<earlier-answers>\n{summary}\n</earlier-answers>'
+    if dropped:
+        SQLBotLogUtil.info(f"Chat history: kept {len(kept)} of {len(turns)} turns, {used} tokens")
+    return [SystemMessage(content=system_prompt)] + [msg for turn in kept for msg in turn]
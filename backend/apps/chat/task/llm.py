@@ -1,4 +1,4 @@
-import concurrent
+import asyncio
 import json
 import os
 import traceback
@@ -6,11 +6,10 @@ import urllib.parse
 import warnings
 from concurrent.futures import ThreadPoolExecutor, Future
 from datetime import datetime
-from typing import Any, List, Optional, Union, Dict, Iterator
+from functools import partial
+from typing import Any, List, Optional, Union, Dict, Iterator, AsyncIterator, Callable
 
-import numpy as np
 import orjson
-import pandas as pd
 import requests
 import sqlparse
 from langchain.chat_models.base import BaseChatModel
@@ -20,6 +19,7 @@ from sqlalchemy import and_, select
 from sqlalchemy.orm import sessionmaker
 from sqlmodel import Session
 
+from apps.ai_model.embedding import QueryEmbeddingCache
 from apps.ai_model.model_factory import LLMConfig, LLMFactory, get_default_config
 from apps.chat.curd.chat import save_question, save_sql_answer, save_sql, \
     save_error_message, save_sql_exec_data, save_chart_answer, save_chart, \
@@ -30,6 +30,9 @@ from apps.chat.curd.chat import save_question, save_sql_answer, save_sql, \
     get_last_execute_sql_error
 from apps.chat.models.chat_model import ChatQuestion, ChatRecord, Chat, RenameChat, ChatLog, OperationEnum, \
     ChatFinishStep
+from apps.chat.task.answer_cache import AnswerCache, CachedAnswer
+from apps.chat.task.chunk_channel import ChunkChannel
+from apps.chat.task.history import build_history
 
 # 开源版本：优雅降级处理企业版许可证和自定义提示词
 try:
@@ -62,15 +65,22 @@ from apps.datasource.crud.datasource import get_table_schema
 from apps.datasource.crud.permission import get_row_permission_filters, is_normal_user
 from apps.datasource.embedding.ds_embedding import get_ds_embedding
 from apps.datasource.models.datasource import CoreDatasource
-from apps.db.db import exec_sql, get_version, check_connection
+from apps.db.db import exec_sql
+from apps.db.query_control import QueryCancelToken
+from apps.db.result_cache import SqlResultCache
+from apps.db.result_set import ColumnarResult
+from apps.db.sql_limit import wrap_limit
+from apps.db.sql_row_filter import apply_row_filters
+from apps.db.status_cache import DatasourceStatusCache
 from apps.system.crud.assistant import AssistantOutDs, AssistantOutDsFactory, get_assistant_ds
 from apps.system.schemas.system_schema import AssistantOutDsSchema
 from apps.terminology.curd.terminology import get_terminology_template
 from common.core.config import settings, TABLE_EMBEDDING_ENABLED
 from common.core.db import engine
 from common.core.deps import CurrentAssistant, CurrentUser
-from common.error import SingleMessageError, SQLBotDBError, ParseSQLResultError, SQLBotDBConnectionError
-from common.utils.utils import SQLBotLogUtil, extract_nested_json, prepare_for_orjson
+from common.error import SingleMessageError, SQLBotDBError, ParseSQLResultError, SQLBotDBConnectionError, \
+    SQLBotDBTimeoutError, SQLBotDBCancelledError
+from common.utils.utils import SQLBotLogUtil, extract_nested_json
 
 warnings.filterwarnings("ignore")
 
@@ -105,15 +115,27 @@ class LLMService:
 
     current_logs: dict[OperationEnum, ChatLog] = {}
 
-    chunk_list: List[str] = []
+    channel: ChunkChannel
     future: Future
 
     last_execute_sql_error: str = None
 
+    cancel_token: QueryCancelToken
+
+    run_on_loop: bool = False
+    task: Optional[asyncio.Task] = None
+
+    answer_cache_key: Optional[str] = None
+    answer_cache_hit: Optional[CachedAnswer] = None
+    question_embedding: Optional[List[float]] = None
+
     def __init__(self, current_user: CurrentUser, chat_question: ChatQuestion,
                  current_assistant: Optional[CurrentAssistant] = None, no_reasoning: bool = False,
                  embedding: bool = False, config: LLMConfig = None):
-        self.chunk_list = []
+        self.channel = ChunkChannel()
+        self.cancel_token = QueryCancelToken()
+        # the question is embedded once per chat turn, whichever retrieval step asks first
+        self.query_embeddings: dict[str, List[float]] = {}
         # engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
         # session_maker = sessionmaker(bind=engine)
         # self.session = session_maker()
@@ -134,15 +156,18 @@ class LLMService:
                 ds = self.out_ds_instance.get_ds(chat.datasource)
                 if not ds:
                     raise SingleMessageError("No available datasource configuration found")
-                chat_question.engine = ds.type + get_version(ds)
+                chat_question.engine = ds.type + DatasourceStatusCache.get_version(ds)
                 chat_question.db_schema = self.out_ds_instance.get_db_schema(ds.id)
             else:
                 ds = self.session.get(CoreDatasource, chat.datasource)
                 if not ds:
                     raise SingleMessageError("No available datasource configuration found")
-                chat_question.engine = (ds.type_name if ds.type != 'excel' else 'PostgreSQL') + get_version(ds)
-                chat_question.db_schema = get_table_schema(session=self.session, current_user=current_user, ds=ds,
-                                                           question=chat_question.question, embedding=embedding)
+                chat_question.engine = (ds.type_name if ds.type != 'excel' else 'PostgreSQL') + \
+                                       DatasourceStatusCache.get_version(ds)
+                with QueryEmbeddingCache.scope(self.query_embeddings):
+                    chat_question.db_schema = get_table_schema(session=self.session, current_user=current_user,
+                                                               ds=ds, question=chat_question.question,
+                                                               embedding=embedding)
 
         self.generate_sql_logs = list_generate_sql_logs(session=self.session, chart_id=chat_id)
         self.generate_chart_logs = list_generate_chart_logs(session=self.session, chart_id=chat_id)
@@ -183,54 +208,16 @@ class LLMService:
         instance = cls(*args, **kwargs, config=config)
         return instance
 
-    def is_running(self, timeout=0.5):
-        try:
-            r = concurrent.futures.wait([self.future], timeout)
-            if len(r.not_done) > 0:
-                return True
-            else:
-                return False
-        except Exception as e:
-            return True
-
     def init_messages(self):
         last_sql_messages: List[dict[str, Any]] = self.generate_sql_logs[-1].messages if len(
             self.generate_sql_logs) > 0 else []
-
-        # todo maybe can configure
-        count_limit = 0 - base_message_count_limit
-
-        self.sql_message = []
-        # add sys prompt
-        self.sql_message.append(SystemMessage(content=self.chat_question.sql_sys_question()))
-        if last_sql_messages is not None and len(last_sql_messages) > 0:
-            # limit count
-            for last_sql_message in last_sql_messages[count_limit:]:
-                _msg: BaseMessage
-                if last_sql_message['type'] == 'human':
-                    _msg = HumanMessage(content=last_sql_message['content'])
-                    self.sql_message.append(_msg)
-                elif last_sql_message['type'] == 'ai':
-                    _msg = AIMessage(content=last_sql_message['content'])
-                    self.sql_message.append(_msg)
+        # sys prompt plus the recent turns within the token budget
+        self.sql_message = build_history(self.chat_question.sql_sys_question(), last_sql_messages,
+                                         max_messages=base_message_count_limit)
 
         last_chart_messages: List[dict[str, Any]] = self.generate_chart_logs[-1].messages if len(
             self.generate_chart_logs) > 0 else []
-
-        self.chart_message = []
-        # add sys prompt
-        self.chart_message.append(SystemMessage(content=self.chat_question.chart_sys_question()))
-
-        if last_chart_messages is not None and len(last_chart_messages) > 0:
-            # limit count
-            for last_chart_message in last_chart_messages:
-                _msg: BaseMessage
-                if last_chart_message.get('type') == 'human':
-                    _msg = HumanMessage(content=last_chart_message.get('content'))
-                    self.chart_message.append(_msg)
-                elif last_chart_message.get('type') == 'ai':
-                    _msg = AIMessage(content=last_chart_message.get('content'))
-                    self.chart_message.append(_msg)
+        self.chart_message = build_history(self.chat_question.chart_sys_question(), last_chart_messages)
 
     def init_record(self) -> ChatRecord:
         self.record = save_question(session=self.session, current_user=self.current_user, question=self.chat_question)
@@ -261,38 +248,39 @@ class LLMService:
                     fields.append(column_str)
         return fields
 
-    def generate_analysis(self):
-        fields = self.get_fields_from_chart()
+    async def generate_analysis(self):
+        fields = await self._blocking(self.get_fields_from_chart)
         self.chat_question.fields = orjson.dumps(fields).decode()
-        data = get_chat_chart_data(self.session, self.record.id)
+        data = await self._blocking(get_chat_chart_data, self.session, self.record.id)
         self.chat_question.data = orjson.dumps(data.get('data')).decode()
         analysis_msg: List[Union[BaseMessage, dict[str, Any]]] = []
 
         ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
-        self.chat_question.terminologies = get_terminology_template(self.session, self.chat_question.question,
-                                                                    self.current_user.oid, ds_id)
+        self.chat_question.terminologies = await self._blocking(get_terminology_template, self.session,
+                                                                self.chat_question.question,
+                                                                self.current_user.oid, ds_id)
         if SQLBotLicenseUtil.valid():
-            self.chat_question.custom_prompt = find_custom_prompts(self.session, CustomPromptTypeEnum.ANALYSIS,
-                                                               self.current_user.oid, ds_id)
+            self.chat_question.custom_prompt = await self._blocking(find_custom_prompts, self.session,
+                                                                    CustomPromptTypeEnum.ANALYSIS,
+                                                                    self.current_user.oid, ds_id)
 
         analysis_msg.append(SystemMessage(content=self.chat_question.analysis_sys_question()))
         analysis_msg.append(HumanMessage(content=self.chat_question.analysis_user_question()))
 
-        self.current_logs[OperationEnum.ANALYSIS] = start_log(session=self.session,
-                                                              ai_modal_id=self.chat_question.ai_modal_id,
-                                                              ai_modal_name=self.chat_question.ai_modal_name,
-                                                              operate=OperationEnum.ANALYSIS,
-                                                              record_id=self.record.id,
-                                                              full_message=[
-                                                                  {'type': msg.type,
-                                                                   'content': msg.content} for
-                                                                  msg
-                                                                  in analysis_msg])
+        self.current_logs[OperationEnum.ANALYSIS] = await self._blocking(start_log, session=self.session,
+                                                                         ai_modal_id=self.chat_question.ai_modal_id,
+                                                                         ai_modal_name=self.chat_question.ai_modal_name,
+                                                                         operate=OperationEnum.ANALYSIS,
+                                                                         record_id=self.record.id,
+                                                                         full_message=[
+                                                                             {'type': msg.type,
+                                                                              'content': msg.content} for
+                                                                             msg
+                                                                             in analysis_msg])
         full_thinking_text = ''
         full_analysis_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(analysis_msg), token_usage)
-        for chunk in res:
+        async for chunk in self._llm_stream(analysis_msg, token_usage):
             if chunk.get('content'):
                 full_analysis_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -301,48 +289,48 @@ class LLMService:
 
         analysis_msg.append(AIMessage(full_analysis_text))
 
-        self.current_logs[OperationEnum.ANALYSIS] = end_log(session=self.session,
-                                                            log=self.current_logs[
-                                                                OperationEnum.ANALYSIS],
-                                                            full_message=[
-                                                                {'type': msg.type,
-                                                                 'content': msg.content}
-                                                                for msg in analysis_msg],
-                                                            reasoning_content=full_thinking_text,
-                                                            token_usage=token_usage)
-        self.record = save_analysis_answer(session=self.session, record_id=self.record.id,
+        self.current_logs[OperationEnum.ANALYSIS] = await self._blocking(end_log, session=self.session,
+                                                                         log=self.current_logs[
+                                                                             OperationEnum.ANALYSIS],
+                                                                         full_message=[
+                                                                             {'type': msg.type,
+                                                                              'content': msg.content}
+                                                                             for msg in analysis_msg],
+                                                                         reasoning_content=full_thinking_text,
+                                                                         token_usage=token_usage)
+        self.record = await self._blocking(save_analysis_answer, session=self.session, record_id=self.record.id,
                                            answer=orjson.dumps({'content': full_analysis_text}).decode())
 
-    def generate_predict(self):
-        fields = self.get_fields_from_chart()
+    async def generate_predict(self):
+        fields = await self._blocking(self.get_fields_from_chart)
         self.chat_question.fields = orjson.dumps(fields).decode()
-        data = get_chat_chart_data(self.session, self.record.id)
+        data = await self._blocking(get_chat_chart_data, self.session, self.record.id)
         self.chat_question.data = orjson.dumps(data.get('data')).decode()
 
         if SQLBotLicenseUtil.valid():
             ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
-            self.chat_question.custom_prompt = find_custom_prompts(self.session, CustomPromptTypeEnum.PREDICT_DATA,
-                                                               self.current_user.oid, ds_id)
+            self.chat_question.custom_prompt = await self._blocking(find_custom_prompts, self.session,
+                                                                    CustomPromptTypeEnum.PREDICT_DATA,
+                                                                    self.current_user.oid, ds_id)
 
         predict_msg: List[Union[BaseMessage, dict[str, Any]]] = []
         predict_msg.append(SystemMessage(content=self.chat_question.predict_sys_question()))
         predict_msg.append(HumanMessage(content=self.chat_question.predict_user_question()))
 
-        self.current_logs[OperationEnum.PREDICT_DATA] = start_log(session=self.session,
-                                                                  ai_modal_id=self.chat_question.ai_modal_id,
-                                                                  ai_modal_name=self.chat_question.ai_modal_name,
-                                                                  operate=OperationEnum.PREDICT_DATA,
-                                                                  record_id=self.record.id,
-                                                                  full_message=[
-                                                                      {'type': msg.type,
-                                                                       'content': msg.content} for
-                                                                      msg
-                                                                      in predict_msg])
+        self.current_logs[OperationEnum.PREDICT_DATA] = await self._blocking(start_log, session=self.session,
+                                                                             ai_modal_id=self.chat_question.ai_modal_id,
+                                                                             ai_modal_name=self.chat_question.ai_modal_name,
+                                                                             operate=OperationEnum.PREDICT_DATA,
+                                                                             record_id=self.record.id,
+                                                                             full_message=[
+                                                                                 {'type': msg.type,
+                                                                                  'content': msg.content} for
+                                                                                 msg
+                                                                                 in predict_msg])
         full_thinking_text = ''
         full_predict_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(predict_msg), token_usage)
-        for chunk in res:
+        async for chunk in self._llm_stream(predict_msg, token_usage):
             if chunk.get('content'):
                 full_predict_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -350,50 +338,49 @@ class LLMService:
             yield chunk
 
         predict_msg.append(AIMessage(full_predict_text))
-        self.record = save_predict_answer(session=self.session, record_id=self.record.id,
-                                          answer=orjson.dumps({'content': full_predict_text}).decode())
-        self.current_logs[OperationEnum.PREDICT_DATA] = end_log(session=self.session,
-                                                                log=self.current_logs[
-                                                                    OperationEnum.PREDICT_DATA],
-                                                                full_message=[
-                                                                    {'type': msg.type,
-                                                                     'content': msg.content}
-                                                                    for msg in predict_msg],
-                                                                reasoning_content=full_thinking_text,
-                                                                token_usage=token_usage)
-
-    def generate_recommend_questions_task(self):
+        self.record = await self._blocking(save_predict_answer, session=self.session, record_id=self.record.id,
+                                           answer=orjson.dumps({'content': full_predict_text}).decode())
+        self.current_logs[OperationEnum.PREDICT_DATA] = await self._blocking(end_log, session=self.session,
+                                                                             log=self.current_logs[
+                                                                                 OperationEnum.PREDICT_DATA],
+                                                                             full_message=[
+                                                                                 {'type': msg.type,
+                                                                                  'content': msg.content}
+                                                                                 for msg in predict_msg],
+                                                                             reasoning_content=full_thinking_text,
+                                                                             token_usage=token_usage)
+
+    async def generate_recommend_questions_task(self):
 
         # get schema
         if self.ds and not self.chat_question.db_schema:
-            self.chat_question.db_schema = self.out_ds_instance.get_db_schema(
-                self.ds.id) if self.out_ds_instance else get_table_schema(session=self.session,
-                                                                          current_user=self.current_user, ds=self.ds,
-                                                                          question=self.chat_question.question,
-                                                                          embedding=False)
+            if self.out_ds_instance:
+                self.chat_question.db_schema = await self._blocking(self.out_ds_instance.get_db_schema, self.ds.id)
+            else:
+                self.chat_question.db_schema = await self._blocking(get_table_schema, session=self.session,
+                                                                    current_user=self.current_user, ds=self.ds,
+                                                                    question=self.chat_question.question,
+                                                                    embedding=False)
 
         guess_msg: List[Union[BaseMessage, dict[str, Any]]] = []
         guess_msg.append(SystemMessage(content=self.chat_question.guess_sys_question()))
 
-        old_questions = list(map(lambda q: q.strip(), get_old_questions(self.session, self.record.datasource)))
+        old_questions = list(map(lambda q: q.strip(),
+                                 await self._blocking(get_old_questions, self.session, self.record.datasource)))
         guess_msg.append(
             HumanMessage(content=self.chat_question.guess_user_question(orjson.dumps(old_questions).decode())))
 
-        self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS] = start_log(session=self.session,
-                                                                                    ai_modal_id=self.chat_question.ai_modal_id,
-                                                                                    ai_modal_name=self.chat_question.ai_modal_name,
-                                                                                    operate=OperationEnum.GENERATE_RECOMMENDED_QUESTIONS,
-                                                                                    record_id=self.record.id,
-                                                                                    full_message=[
-                                                                                        {'type': msg.type,
-                                                                                         'content': msg.content} for
-                                                                                        msg
-                                                                                        in guess_msg])
+        self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS] = await self._blocking(
+            start_log, session=self.session,
+            ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name,
+            operate=OperationEnum.GENERATE_RECOMMENDED_QUESTIONS,
+            record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in guess_msg])
         full_thinking_text = ''
         full_guess_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(guess_msg), token_usage)
-        for chunk in res:
+        async for chunk in self._llm_stream(guess_msg, token_usage):
             if chunk.get('content'):
                 full_guess_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -402,67 +389,67 @@ class LLMService:
 
         guess_msg.append(AIMessage(full_guess_text))
 
-        self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS] = end_log(session=self.session,
-                                                                                  log=self.current_logs[
-                                                                                      OperationEnum.GENERATE_RECOMMENDED_QUESTIONS],
-                                                                                  full_message=[
-                                                                                      {'type': msg.type,
-                                                                                       'content': msg.content}
-                                                                                      for msg in guess_msg],
-                                                                                  reasoning_content=full_thinking_text,
-                                                                                  token_usage=token_usage)
-        self.record = save_recommend_question_answer(session=self.session, record_id=self.record.id,
-                                                     answer={'content': full_guess_text})
+        self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS] = await self._blocking(
+            end_log, session=self.session,
+            log=self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in guess_msg],
+            reasoning_content=full_thinking_text,
+            token_usage=token_usage)
+        self.record = await self._blocking(save_recommend_question_answer, session=self.session,
+                                           record_id=self.record.id, answer={'content': full_guess_text})
 
         yield {'recommended_question': self.record.recommended_question}
 
-    def select_datasource(self):
-        datasource_msg: List[Union[BaseMessage, dict[str, Any]]] = []
-        datasource_msg.append(SystemMessage(self.chat_question.datasource_sys_question()))
+    def get_ds_list(self) -> list:
         if self.current_assistant and self.current_assistant.type != 4:
-            _ds_list = get_assistant_ds(session=self.session, llm_service=self)
-        else:
-            # 获取详细的数据源信息，包括表信息
-            stmt = select(CoreDatasource.id, CoreDatasource.name, CoreDatasource.description).where(
-                and_(CoreDatasource.oid == self.current_user.oid))
-            _ds_list = []
-            for ds in self.session.exec(stmt):
-                # 获取每个数据源的表信息
-                from apps.datasource.crud.table import get_tables_by_ds_id
-                tables = get_tables_by_ds_id(self.session, ds.id)
-                
-                # 构建详细的数据源信息
-                ds_info = {
-                    "id": ds.id,
-                    "name": ds.name,
-                    "description": ds.description,
-                    "tables": []
+            return get_assistant_ds(session=self.session, llm_service=self)
+        # 获取详细的数据源信息，包括表信息
+        stmt = select(CoreDatasource.id, CoreDatasource.name, CoreDatasource.description).where(
+            and_(CoreDatasource.oid == self.current_user.oid))
+        _ds_list = []
+        for ds in self.session.exec(stmt):
+            # 获取每个数据源的表信息
+            from apps.datasource.crud.table import get_tables_by_ds_id
+            tables = get_tables_by_ds_id(self.session, ds.id)
+
+            # 构建详细的数据源信息
+            ds_info = {
+                "id": ds.id,
+                "name": ds.name,
+                "description": ds.description,
+                "tables": []
+            }
+
+            # 为每个表添加详细信息
+            for table in tables:
+                table_info = {
+                    "table_name": table.table_name,
+                    "table_comment": table.table_comment or "",
+                    "fields": []
                 }
-                
-                # 为每个表添加详细信息
-                for table in tables:
-                    table_info = {
-                        "table_name": table.table_name,
-                        "table_comment": table.table_comment or "",
-                        "fields": []
+
+                # 获取表的字段信息
+                from apps.datasource.crud.field import get_fields_by_table_id
+                fields = get_fields_by_table_id(self.session, table.id)
+                for field in fields:
+                    field_info = {
+                        "field_name": field.field_name,
+                        "field_type": field.field_type,
+                        "field_comment": field.field_comment or ""
                     }
-                    
-                    # 获取表的字段信息
-                    from apps.datasource.crud.field import get_fields_by_table_id
-                    fields = get_fields_by_table_id(self.session, table.id)
-                    for field in fields:
-                        field_info = {
-                            "field_name": field.field_name,
-                            "field_type": field.field_type,
-                            "field_comment": field.field_comment or ""
-                        }
-                        table_info["fields"].append(field_info)
-                    
-                    ds_info["tables"].append(table_info)
-                
-                _ds_list.append(ds_info)
-            """ _ds_list = self.session.exec(select(CoreDatasource).options(
-                load_only(CoreDatasource.id, CoreDatasource.name, CoreDatasource.description))).all() """
+                    table_info["fields"].append(field_info)
+
+                ds_info["tables"].append(table_info)
+
+            _ds_list.append(ds_info)
+        """ _ds_list = self.session.exec(select(CoreDatasource).options(
+            load_only(CoreDatasource.id, CoreDatasource.name, CoreDatasource.description))).all() """
+        return _ds_list
+
+    async def select_datasource(self):
+        datasource_msg: List[Union[BaseMessage, dict[str, Any]]] = []
+        datasource_msg.append(SystemMessage(self.chat_question.datasource_sys_question()))
+        _ds_list = await self._blocking(self.get_ds_list)
         if not _ds_list:
             raise SingleMessageError('No available datasource configuration found')
         # 总是使用LLM选择数据源，不使用自动选择
@@ -471,6 +458,7 @@ class LLMService:
         full_thinking_text = ''
         full_text = ''
         use_llm_selection = False  # Flag to track if LLM selection is needed
+        ds = None
 
         if not ignore_auto_select:
             # 优先尝试embedding选择
@@ -480,9 +468,9 @@ class LLMService:
                 SQLBotLogUtil.info(f"用户问题: {self.chat_question.question}")
                 SQLBotLogUtil.info(f"数据源数量: {len(_ds_list)}")
 
-                embedding_result = get_ds_embedding(self.session, self.current_user, _ds_list, self.out_ds_instance,
-                                      self.chat_question.question, self.current_assistant)
-
+                embedding_result = await self._blocking(get_ds_embedding, self.session, self.current_user, _ds_list,
+                                                        self.out_ds_instance, self.chat_question.question,
+                                                        self.current_assistant)
                 if embedding_result and embedding_result.get('cosine_similarity') is not None:
                     max_score = embedding_result.get('cosine_similarity')
                     selected_ds = embedding_result
@@ -568,20 +556,17 @@ class LLMService:
                 datasource_msg.append(
                     HumanMessage(self.chat_question.datasource_user_question(formatted_data)))
 
-                self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = start_log(session=self.session,
-                                                                               ai_modal_id=self.chat_question.ai_modal_id,
-                                                                               ai_modal_name=self.chat_question.ai_modal_name,
-                                                                               operate=OperationEnum.CHOOSE_DATASOURCE,
-                                                                               record_id=self.record.id,
-                                                                               full_message=[{'type': msg.type,
-                                                                                              'content': msg.content}
-                                                                                             for
-                                                                                             msg in datasource_msg])
+                self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = await self._blocking(
+                    start_log, session=self.session,
+                    ai_modal_id=self.chat_question.ai_modal_id,
+                    ai_modal_name=self.chat_question.ai_modal_name,
+                    operate=OperationEnum.CHOOSE_DATASOURCE,
+                    record_id=self.record.id,
+                    full_message=[{'type': msg.type, 'content': msg.content} for msg in datasource_msg])
 
                 SQLBotLogUtil.info("调用LLM进行数据源选择...")
                 token_usage = {}
-                res = process_stream(self.llm.stream(datasource_msg), token_usage)
-                for chunk in res:
+                async for chunk in self._llm_stream(datasource_msg, token_usage):
                     if chunk.get('content'):
                         full_text += chunk.get('content')
                     if chunk.get('reasoning_content'):
@@ -589,15 +574,12 @@ class LLMService:
                     yield chunk
                 datasource_msg.append(AIMessage(full_text))
 
-                self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = end_log(session=self.session,
-                                                                             log=self.current_logs[
-                                                                                 OperationEnum.CHOOSE_DATASOURCE],
-                                                                             full_message=[
-                                                                                 {'type': msg.type,
-                                                                                  'content': msg.content}
-                                                                                 for msg in datasource_msg],
-                                                                             reasoning_content=full_thinking_text,
-                                                                             token_usage=token_usage)
+                self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = await self._blocking(
+                    end_log, session=self.session,
+                    log=self.current_logs[OperationEnum.CHOOSE_DATASOURCE],
+                    full_message=[{'type': msg.type, 'content': msg.content} for msg in datasource_msg],
+                    reasoning_content=full_thinking_text,
+                    token_usage=token_usage)
 
                 SQLBotLogUtil.info(f"LLM返回结果: {full_text}")
                 json_str = extract_nested_json(full_text)
@@ -607,12 +589,16 @@ class LLMService:
                 SQLBotLogUtil.info(f"✓ LLM选择的数据源: {ds}")
                 SQLBotLogUtil.info("=" * 80)
 
+        data: dict = _ds_list[0] if ignore_auto_select else ds
+        # 只有当使用LLM选择时才保存datasource选择的answer
+        await self._blocking(self.set_selected_datasource, data,
+                             full_text if not ignore_auto_select and use_llm_selection else None)
+
+    def set_selected_datasource(self, data: dict, answer_text: Optional[str] = None):
         _error: Exception | None = None
         _datasource: int | None = None
         _engine_type: str | None = None
         try:
-            data: dict = _ds_list[0] if ignore_auto_select else ds
-
             if data.get('id') and data.get('id') != 0:
                 _datasource = data['id']
                 _chat = self.session.get(Chat, self.record.chat_id)
@@ -620,7 +606,7 @@ class LLMService:
                 if self.current_assistant and self.current_assistant.type in dynamic_ds_types:
                     _ds = self.out_ds_instance.get_ds(data['id'])
                     self.ds = _ds
-                    self.chat_question.engine = _ds.type + get_version(self.ds)
+                    self.chat_question.engine = _ds.type + DatasourceStatusCache.get_version(self.ds)
                     self.chat_question.db_schema = self.out_ds_instance.get_db_schema(self.ds.id)
                     _engine_type = self.chat_question.engine
                     _chat.engine_type = _ds.type
@@ -630,8 +616,8 @@ class LLMService:
                         _datasource = None
                         raise SingleMessageError(f"Datasource configuration with id {_datasource} not found")
                     self.ds = CoreDatasource(**_ds.model_dump())
-                    self.chat_question.engine = (_ds.type_name if _ds.type != 'excel' else 'PostgreSQL') + get_version(
-                        self.ds)
+                    self.chat_question.engine = (_ds.type_name if _ds.type != 'excel' else 'PostgreSQL') + \
+                                                DatasourceStatusCache.get_version(self.ds)
                     self.chat_question.db_schema = get_table_schema(session=self.session,
                                                                     current_user=self.current_user, ds=self.ds,
                                                                     question=self.chat_question.question)
@@ -657,10 +643,9 @@ class LLMService:
         except Exception as e:
             _error = e
 
-        # 只有当使用LLM选择时才保存datasource选择的answer
-        if not ignore_auto_select and use_llm_selection:
+        if answer_text is not None:
             self.record = save_select_datasource_answer(session=self.session, record_id=self.record.id,
-                                                        answer=orjson.dumps({'content': full_text}).decode(),
+                                                        answer=orjson.dumps({'content': answer_text}).decode(),
                                                         datasource=_datasource,
                                                         engine_type=_engine_type)
         if self.ds:
@@ -680,24 +665,32 @@ class LLMService:
         if _error:
             raise _error
 
-    def generate_sql(self):
+    async def generate_sql(self, with_chart: bool = False):
         # append current question
-        self.sql_message.append(HumanMessage(
-            self.chat_question.sql_user_question(current_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))))
-
-        self.current_logs[OperationEnum.GENERATE_SQL] = start_log(session=self.session,
-                                                                  ai_modal_id=self.chat_question.ai_modal_id,
-                                                                  ai_modal_name=self.chat_question.ai_modal_name,
-                                                                  operate=OperationEnum.GENERATE_SQL,
-                                                                  record_id=self.record.id,
-                                                                  full_message=[
-                                                                      {'type': msg.type, 'content': msg.content} for msg
-                                                                      in self.sql_message])
+        question = self.chat_question.sql_user_question(current_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        if with_chart:
+            # single call mode, the chart config is requested along with the sql, see get_chart_from_sql_answer
+            question += self.chat_question.sql_chart_user_question()
+        self.sql_message.append(HumanMessage(question))
+
+        self.current_logs[OperationEnum.GENERATE_SQL] = await self._blocking(start_log, session=self.session,
+                                                                             ai_modal_id=self.chat_question.ai_modal_id,
+                                                                             ai_modal_name=self.chat_question.ai_modal_name,
+                                                                             operate=OperationEnum.GENERATE_SQL,
+                                                                             record_id=self.record.id,
+                                                                             full_message=[
+                                                                                 {'type': msg.type,
+                                                                                  'content': msg.content} for msg
+                                                                                 in self.sql_message])
         full_thinking_text = ''
         full_sql_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(self.sql_message), token_usage)
-        for chunk in res:
+        if self.answer_cache_hit is not None:
+            # replay the answer given to the same question earlier, the query itself still runs
+            res = _replay(self.answer_cache_hit.sql_answer)
+        else:
+            res = self._llm_stream(self.sql_message, token_usage)
+        async for chunk in res:
             if chunk.get('content'):
                 full_sql_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -706,16 +699,19 @@ class LLMService:
 
         self.sql_message.append(AIMessage(full_sql_text))
 
-        self.current_logs[OperationEnum.GENERATE_SQL] = end_log(session=self.session,
-                                                                log=self.current_logs[OperationEnum.GENERATE_SQL],
-                                                                full_message=[{'type': msg.type, 'content': msg.content}
-                                                                              for msg in self.sql_message],
-                                                                reasoning_content=full_thinking_text,
-                                                                token_usage=token_usage)
-        self.record = save_sql_answer(session=self.session, record_id=self.record.id,
-                                      answer=orjson.dumps({'content': full_sql_text}).decode())
-
-    def generate_with_sub_sql(self, sql, sub_mappings: list):
+        self.current_logs[OperationEnum.GENERATE_SQL] = await self._blocking(end_log, session=self.session,
+                                                                           log=self.current_logs[
+                                                                               OperationEnum.GENERATE_SQL],
+                                                                           full_message=[
+                                                                               {'type': msg.type,
+                                                                                'content': msg.content}
+                                                                               for msg in self.sql_message],
+                                                                           reasoning_content=full_thinking_text,
+                                                                           token_usage=token_usage)
+        self.record = await self._blocking(save_sql_answer, session=self.session, record_id=self.record.id,
+                                           answer=orjson.dumps({'content': full_sql_text}).decode())
+
+    async def generate_with_sub_sql(self, sql, sub_mappings: list):
         sub_query = json.dumps(sub_mappings, ensure_ascii=False)
         self.chat_question.sql = sql
         self.chat_question.sub_query = sub_query
@@ -723,43 +719,36 @@ class LLMService:
         dynamic_sql_msg.append(SystemMessage(content=self.chat_question.dynamic_sys_question()))
         dynamic_sql_msg.append(HumanMessage(content=self.chat_question.dynamic_user_question()))
 
-        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = start_log(session=self.session,
-                                                                          ai_modal_id=self.chat_question.ai_modal_id,
-                                                                          ai_modal_name=self.chat_question.ai_modal_name,
-                                                                          operate=OperationEnum.GENERATE_DYNAMIC_SQL,
-                                                                          record_id=self.record.id,
-                                                                          full_message=[{'type': msg.type,
-                                                                                         'content': msg.content}
-                                                                                        for
-                                                                                        msg in dynamic_sql_msg])
+        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = await self._blocking(
+            start_log, session=self.session,
+            ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name,
+            operate=OperationEnum.GENERATE_DYNAMIC_SQL,
+            record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in dynamic_sql_msg])
 
         full_thinking_text = ''
         full_dynamic_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(dynamic_sql_msg), token_usage)
-        for chunk in res:
+        async for chunk in self._llm_stream(dynamic_sql_msg, token_usage):
             if chunk.get('content'):
                 full_dynamic_text += chunk.get('content')
             if chunk.get('reasoning_content'):
                 full_thinking_text += chunk.get('reasoning_content')
-            yield chunk
 
         dynamic_sql_msg.append(AIMessage(full_dynamic_text))
 
-        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = end_log(session=self.session,
-                                                                        log=self.current_logs[
-                                                                            OperationEnum.GENERATE_DYNAMIC_SQL],
-                                                                        full_message=[
-                                                                            {'type': msg.type,
-                                                                             'content': msg.content}
-                                                                            for msg in dynamic_sql_msg],
-                                                                        reasoning_content=full_thinking_text,
-                                                                        token_usage=token_usage)
+        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = await self._blocking(
+            end_log, session=self.session,
+            log=self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in dynamic_sql_msg],
+            reasoning_content=full_thinking_text,
+            token_usage=token_usage)
 
         SQLBotLogUtil.info(full_dynamic_text)
         return full_dynamic_text
 
-    def generate_assistant_dynamic_sql(self, sql, tables: List):
+    async def generate_assistant_dynamic_sql(self, sql, tables: List):
         ds: AssistantOutDsSchema = self.ds
         sub_query = []
         result_dict = {}
@@ -770,11 +759,21 @@ class LLMService:
                 sub_query.append({"table": table.name, "query": f'{dynamic_subsql_prefix}{table.name}'})
         if not sub_query:
             return None
-        temp_sql_text = self.generate_with_sub_sql(sql=sql, sub_mappings=sub_query)
+        temp_sql_text = await self.generate_with_sub_sql(sql=sql, sub_mappings=sub_query)
         result_dict['sqlbot_temp_sql_text'] = temp_sql_text
         return result_dict
 
-    def build_table_filter(self, sql: str, filters: list):
+    async def build_table_filter(self, sql: str, filters: list):
+        if settings.ROW_FILTER_REWRITE_ENABLED:
+            # wrap the filtered tables locally, the llm is only asked when the sql is beyond the rewriter
+            try:
+                filtered_sql = apply_row_filters(sql, self.ds.type, filters)
+            except Exception as e:
+                SQLBotLogUtil.warning(f"Row permission rewrite failed, falling back to the llm: {e}")
+                filtered_sql = None
+            if filtered_sql is not None:
+                SQLBotLogUtil.info("Row permission filters applied without the llm")
+                return orjson.dumps({'success': True, 'sql': filtered_sql}).decode()
         filter = json.dumps(filters, ensure_ascii=False)
         self.chat_question.sql = sql
         self.chat_question.filter = filter
@@ -782,21 +781,17 @@ class LLMService:
         permission_sql_msg.append(SystemMessage(content=self.chat_question.filter_sys_question()))
         permission_sql_msg.append(HumanMessage(content=self.chat_question.filter_user_question()))
 
-        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = start_log(session=self.session,
-                                                                                   ai_modal_id=self.chat_question.ai_modal_id,
-                                                                                   ai_modal_name=self.chat_question.ai_modal_name,
-                                                                                   operate=OperationEnum.GENERATE_SQL_WITH_PERMISSIONS,
-                                                                                   record_id=self.record.id,
-                                                                                   full_message=[
-                                                                                       {'type': msg.type,
-                                                                                        'content': msg.content} for
-                                                                                       msg
-                                                                                       in permission_sql_msg])
+        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = await self._blocking(
+            start_log, session=self.session,
+            ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name,
+            operate=OperationEnum.GENERATE_SQL_WITH_PERMISSIONS,
+            record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in permission_sql_msg])
         full_thinking_text = ''
         full_filter_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(permission_sql_msg), token_usage)
-        for chunk in res:
+        async for chunk in self._llm_stream(permission_sql_msg, token_usage):
             if chunk.get('content'):
                 full_filter_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -804,27 +799,24 @@ class LLMService:
 
         permission_sql_msg.append(AIMessage(full_filter_text))
 
-        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = end_log(session=self.session,
-                                                                                 log=self.current_logs[
-                                                                                     OperationEnum.GENERATE_SQL_WITH_PERMISSIONS],
-                                                                                 full_message=[
-                                                                                     {'type': msg.type,
-                                                                                      'content': msg.content}
-                                                                                     for msg in permission_sql_msg],
-                                                                                 reasoning_content=full_thinking_text,
-                                                                                 token_usage=token_usage)
+        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = await self._blocking(
+            end_log, session=self.session,
+            log=self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in permission_sql_msg],
+            reasoning_content=full_thinking_text,
+            token_usage=token_usage)
 
         SQLBotLogUtil.info(full_filter_text)
         return full_filter_text
 
-    def generate_filter(self, sql: str, tables: List):
-        filters = get_row_permission_filters(session=self.session, current_user=self.current_user, ds=self.ds,
-                                             tables=tables)
+    async def generate_filter(self, sql: str, tables: List):
+        filters = await self._blocking(get_row_permission_filters, session=self.session,
+                                       current_user=self.current_user, ds=self.ds, tables=tables)
         if not filters:
             return None
-        return self.build_table_filter(sql=sql, filters=filters)
+        return await self.build_table_filter(sql=sql, filters=filters)
 
-    def generate_assistant_filter(self, sql, tables: List):
+    async def generate_assistant_filter(self, sql, tables: List):
         ds: AssistantOutDsSchema = self.ds
         filters = []
         for table in ds.tables:
@@ -832,26 +824,49 @@ class LLMService:
                 filters.append({"table": table.name, "filter": table.rule})
         if not filters:
             return None
-        return self.build_table_filter(sql=sql, filters=filters)
+        return await self.build_table_filter(sql=sql, filters=filters)
+
+    def can_speculate_chart(self) -> bool:
+        # needs the event loop to overlap with the query; a cached chart answer is replayed at once anyway
+        cached_chart = self.answer_cache_hit is not None and self.answer_cache_hit.chart_answer
+        return settings.CHART_PIPELINE_ENABLED and self.run_on_loop and not cached_chart
+
+    async def speculate_chart(self, chart_type: Optional[str] = '') -> tuple[list[dict], Dict[str, Any]]:
+        """
+        The LLM part of generate_chart, started while the sql runs. It only needs the sql and the question, and
+        writes nothing, so the buffered answer is simply dropped when the query fails.
+        """
+        messages = self.chart_message + [HumanMessage(self.chat_question.chart_user_question(chart_type))]
+        token_usage: Dict[str, Any] = {}
+        chunks = [chunk async for chunk in self._llm_stream(messages, token_usage)]
+        return chunks, token_usage
 
-    def generate_chart(self, chart_type: Optional[str] = ''):
+    async def generate_chart(self, chart_type: Optional[str] = '', speculative: Optional[asyncio.Future] = None,
+                             answer: Optional[str] = None):
         # append current question
         self.chart_message.append(HumanMessage(self.chat_question.chart_user_question(chart_type)))
 
-        self.current_logs[OperationEnum.GENERATE_CHART] = start_log(session=self.session,
-                                                                    ai_modal_id=self.chat_question.ai_modal_id,
-                                                                    ai_modal_name=self.chat_question.ai_modal_name,
-                                                                    operate=OperationEnum.GENERATE_CHART,
-                                                                    record_id=self.record.id,
-                                                                    full_message=[
-                                                                        {'type': msg.type, 'content': msg.content} for
-                                                                        msg
-                                                                        in self.chart_message])
+        self.current_logs[OperationEnum.GENERATE_CHART] = await self._blocking(
+            start_log, session=self.session,
+            ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name,
+            operate=OperationEnum.GENERATE_CHART,
+            record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in self.chart_message])
         full_thinking_text = ''
         full_chart_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(self.chart_message), token_usage)
-        for chunk in res:
+        if speculative is not None:
+            chunks, token_usage = await speculative
+            res = _replay_chunks(chunks)
+        elif answer is not None:
+            # already given by the sql answer in single call mode
+            res = _replay(answer)
+        elif self.answer_cache_hit is not None and self.answer_cache_hit.chart_answer:
+            res = _replay(self.answer_cache_hit.chart_answer)
+        else:
+            res = self._llm_stream(self.chart_message, token_usage)
+        async for chunk in res:
             if chunk.get('content'):
                 full_chart_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -860,15 +875,14 @@ class LLMService:
 
         self.chart_message.append(AIMessage(full_chart_text))
 
-        self.record = save_chart_answer(session=self.session, record_id=self.record.id,
-                                        answer=orjson.dumps({'content': full_chart_text}).decode())
-        self.current_logs[OperationEnum.GENERATE_CHART] = end_log(session=self.session,
-                                                                  log=self.current_logs[OperationEnum.GENERATE_CHART],
-                                                                  full_message=[
-                                                                      {'type': msg.type, 'content': msg.content}
-                                                                      for msg in self.chart_message],
-                                                                  reasoning_content=full_thinking_text,
-                                                                  token_usage=token_usage)
+        self.record = await self._blocking(save_chart_answer, session=self.session, record_id=self.record.id,
+                                           answer=orjson.dumps({'content': full_chart_text}).decode())
+        self.current_logs[OperationEnum.GENERATE_CHART] = await self._blocking(
+            end_log, session=self.session,
+            log=self.current_logs[OperationEnum.GENERATE_CHART],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in self.chart_message],
+            reasoning_content=full_thinking_text,
+            token_usage=token_usage)
 
     @staticmethod
     def check_sql(res: str) -> tuple[str, Optional[list]]:
@@ -896,6 +910,25 @@ class LLMService:
             raise SingleMessageError("SQL query is empty")
         return sql, data.get('tables')
 
+    @staticmethod
+    def get_chart_from_sql_answer(res: str) -> Optional[Dict[str, Any]]:
+        """The chart config of a single call answer, None when it is missing or unusable so the chart call runs."""
+        json_str = extract_nested_json(res)
+        if json_str is None:
+            return None
+        try:
+            chart = orjson.loads(json_str).get('chart')
+        except Exception:
+            return None
+        if not isinstance(chart, dict):
+            return None
+        if chart.get('type') == 'table':
+            return chart if isinstance(chart.get('columns'), list) and chart.get('columns') else None
+        if chart.get('type') in ('column', 'bar', 'line', 'pie'):
+            axis = chart.get('axis')
+            return chart if isinstance(axis, dict) and isinstance(axis.get('y'), dict) else None
+        return None
+
     @staticmethod
     def get_chart_type_from_sql_answer(res: str) -> Optional[str]:
         json_str = extract_nested_json(res)
@@ -991,26 +1024,17 @@ class LLMService:
     def save_error(self, message: str):
         return save_error_message(session=self.session, record_id=self.record.id, message=message)
 
-    def save_sql_data(self, data_obj: Dict[str, Any]):
+    def save_sql_data(self, data_obj: ColumnarResult):
         try:
-            data_result = data_obj.get('data')
-            limit = 1000
-            if data_result:
-                data_result = prepare_for_orjson(data_result)
-                if data_result and len(data_result) > limit:
-                    data_obj['data'] = data_result[:limit]
-                    data_obj['limit'] = limit
-                else:
-                    data_obj['data'] = data_result
             return save_sql_exec_data(session=self.session, record_id=self.record.id,
-                                      data=orjson.dumps(data_obj).decode())
+                                      data=orjson.dumps(data_obj.to_dict(for_json=True)).decode())
         except Exception as e:
             raise e
 
     def finish(self):
         return finish_record(session=self.session, record_id=self.record.id)
 
-    def execute_sql(self, sql: str):
+    def execute_sql(self, sql: str) -> ColumnarResult:
         """Execute SQL query
 
         Args:
@@ -1018,66 +1042,174 @@ class LLMService:
             sql: SQL query statement
 
         Returns:
-            Query results
+            Query results in columnar form, capped at SQL_RESULT_MAX_ROWS
         """
+        max_rows = settings.SQL_RESULT_MAX_ROWS
+        if settings.SQL_LIMIT_WRAP_ENABLED:
+            # one row over the cap, so the fetch can still tell a truncated result from an exact fit
+            version = DatasourceStatusCache.get_version(self.ds) if self.ds.type == 'oracle' else None
+            sql = wrap_limit(sql, self.ds.type, max_rows + 1, version)
+        permission_filter = self.chat_question.filter if isinstance(self.chat_question.filter, str) else None
+        cached = SqlResultCache.get(self.ds, sql, permission_filter)
+        if cached is not None:
+            SQLBotLogUtil.info(f"Use cached result of SQL on ds_id {self.ds.id}: {sql}")
+            return cached
         SQLBotLogUtil.info(f"Executing SQL on ds_id {self.ds.id}: {sql}")
         try:
-            return exec_sql(ds=self.ds, sql=sql, origin_column=False)
+            result = exec_sql(ds=self.ds, sql=sql, origin_column=False, max_rows=max_rows, columnar=True,
+                              timeout=settings.SQL_STATEMENT_TIMEOUT, cancel_token=self.cancel_token)
+            SqlResultCache.put(self.ds, sql, permission_filter, result)
+            return result
         except Exception as e:
-            if isinstance(e, ParseSQLResultError):
+            if isinstance(e, (ParseSQLResultError, SQLBotDBTimeoutError, SQLBotDBCancelledError)):
                 raise e
             else:
                 err = traceback.format_exc(limit=1, chain=True)
+                # liveness is served from cache, re-probe only now that the real query failed
+                DatasourceStatusCache.invalidate(self.ds)
+                if not DatasourceStatusCache.is_connected(self.ds):
+                    raise SQLBotDBConnectionError('Connect DB failed')
                 raise SQLBotDBError(err)
 
-    def pop_chunk(self):
+    async def async_await_result(self):
+        """SSE consumer, chunks are pushed by the task as soon as they are produced."""
         try:
-            chunk = self.chunk_list.pop(0)
-            return chunk
-        except IndexError as e:
-            return None
+            async for chunk in self.channel:
+                yield chunk
+        except (GeneratorExit, asyncio.CancelledError):
+            # the SSE client went away before the task finished
+            self.cancel()
+            raise
+
+    def _pump(self, chunks: Iterator):
+        try:
+            for chunk in chunks:
+                self.channel.put(chunk)
+                if self.cancel_token.cancelled:
+                    break
+        finally:
+            self.channel.close()
+
+    async def _apump(self, chunks: AsyncIterator):
+        try:
+            async for chunk in chunks:
+                self.channel.put(chunk)
+                if self.cancel_token.cancelled:
+                    break
+        except Exception as e:
+            # nobody awaits the asyncio task, so an escaped error is only logged
+            SQLBotLogUtil.error(f"Chat task failed: {e}")
+        finally:
+            # run the task's own cleanup (finish, logs) before consumers see the end of the stream
+            await chunks.aclose()
+            self.channel.close()
+
+    def _iterate(self, chunks: AsyncIterator) -> Iterator:
+        """Drive an async task generator from a worker thread on a private event loop, blocking steps run inline."""
+        loop = asyncio.new_event_loop()
 
-    def await_result(self):
-        while self.is_running():
+        async def _next():
+            return await chunks.__anext__()
+
+        try:
             while True:
-                chunk = self.pop_chunk()
-                if chunk is not None:
-                    yield chunk
-                else:
+                try:
+                    chunk = loop.run_until_complete(_next())
+                except StopAsyncIteration:
                     break
-        while True:
-            chunk = self.pop_chunk()
-            if chunk is None:
-                break
-            yield chunk
+                yield chunk
+        finally:
+            loop.run_until_complete(chunks.aclose())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    def _submit(self, chunks: AsyncIterator, stream: bool = True):
+        """
+        Streamed tasks run as asyncio tasks on the request's event loop when LLM_ASYNC_STREAM_ENABLED, so waiting
+        on the model holds no thread. Non-stream tasks keep running on the executor, async callers still drain
+        them with async_await_result() so the loop is never blocked.
+        """
+        if stream and settings.LLM_ASYNC_STREAM_ENABLED:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop is not None:
+                self.run_on_loop = True
+                self.task = loop.create_task(self._apump(chunks))
+                return
+        self.future = executor.submit(self._pump, self._iterate(chunks))
+
+    async def _blocking(self, func: Callable, *args, **kwargs):
+        # DB, embedding and HTTP work must not run on the event loop
+        call = partial(QueryEmbeddingCache.run_scoped, self.query_embeddings, func, *args, **kwargs)
+        if self.run_on_loop:
+            return await asyncio.get_running_loop().run_in_executor(executor, call)
+        return call()
+
+    def _retrieve(self, func: Callable, *args):
+        # retrieval stages run concurrently, so each one gets its own session
+        with Session(engine) as session:
+            return QueryEmbeddingCache.run_scoped(self.query_embeddings, func, session, *args)
+
+    async def retrieve_context(self, oid: int, ds_id: Optional[int]):
+        """
+        Fetch terminologies, data training and custom prompts for the sql prompt concurrently. A stage that fails
+        or exceeds RETRIEVAL_STAGE_TIMEOUT adds no context instead of holding back SQL generation.
+        """
+        question = self.chat_question.question
+        stages: dict[str, tuple] = {'terminologies': (get_terminology_template, question, oid, ds_id),
+                                    'data_training': (get_training_template, question, ds_id, oid)}
+        if SQLBotLicenseUtil.valid():
+            stages['custom_prompt'] = (find_custom_prompts, CustomPromptTypeEnum.GENERATE_SQL, oid, ds_id)
+        loop = asyncio.get_running_loop()
+        timeout = settings.RETRIEVAL_STAGE_TIMEOUT or None
+
+        async def _stage(name: str, func: Callable, *args):
+            try:
+                return await asyncio.wait_for(loop.run_in_executor(executor, partial(self._retrieve, func, *args)),
+                                              timeout)
+            except asyncio.TimeoutError:
+                SQLBotLogUtil.warning(f"Retrieving {name} took over {timeout}s, continue without it")
+            except Exception as e:
+                SQLBotLogUtil.warning(f"Retrieving {name} failed, continue without it: {e}")
+            return ''
+
+        results = await asyncio.gather(*[_stage(name, *stage) for name, stage in stages.items()])
+        for name, result in zip(stages.keys(), results):
+            setattr(self.chat_question, name, result or '')
+
+    async def _llm_stream(self, messages: List[Union[BaseMessage, dict[str, Any]]], token_usage: Dict[str, Any]):
+        if self.run_on_loop:
+            async for chunk in aprocess_stream(self.llm.astream(messages), token_usage):
+                yield chunk
+        else:
+            for chunk in process_stream(self.llm.stream(messages), token_usage):
+                yield chunk
+
+    def cancel(self):
+        if not self.cancel_token.cancelled:
+            record = getattr(self, 'record', None)
+            SQLBotLogUtil.info(f"Cancel chat task of record {record.id if record else None}")
+        self.cancel_token.cancel()
 
     def run_task_async(self, in_chat: bool = True, stream: bool = True,
                        finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
         if in_chat:
             stream = True
-        self.future = executor.submit(self.run_task_cache, in_chat, stream, finish_step)
-
-    def run_task_cache(self, in_chat: bool = True, stream: bool = True,
-                       finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
-        for chunk in self.run_task(in_chat, stream, finish_step):
-            self.chunk_list.append(chunk)
+        self._submit(self.run_task(in_chat, stream, finish_step), stream)
 
-    def run_task(self, in_chat: bool = True, stream: bool = True,
+    async def run_task(self, in_chat: bool = True, stream: bool = True,
                  finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
         json_result: Dict[str, Any] = {'success': True}
+        retrieval: Optional[asyncio.Future] = None
+        speculative_chart: Optional[asyncio.Future] = None
         try:
             if self.ds:
                 oid = self.ds.oid if isinstance(self.ds, CoreDatasource) else 1
                 ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
-                self.chat_question.terminologies = get_terminology_template(self.session, self.chat_question.question,
-                                                                            oid, ds_id)
-                self.chat_question.data_training = get_training_template(self.session, self.chat_question.question,
-                                                                         ds_id, oid)
-                if SQLBotLicenseUtil.valid():
-                    self.chat_question.custom_prompt = find_custom_prompts(self.session, CustomPromptTypeEnum.GENERATE_SQL,
-                                                                       oid, ds_id)
-
-            self.init_messages()
+                # runs while the record id and the title are sent
+                retrieval = asyncio.ensure_future(self.retrieve_context(oid, ds_id))
 
             # return id
             if in_chat:
@@ -1088,19 +1220,24 @@ class LLMService:
             # return title
             if self.change_title:
                 if self.chat_question.question or self.chat_question.question.strip() != '':
-                    brief = rename_chat(session=self.session,
-                                        rename_object=RenameChat(id=self.get_record().chat_id,
-                                                                 brief=self.chat_question.question.strip()[:20]))
+                    brief = await self._blocking(rename_chat, session=self.session,
+                                                 rename_object=RenameChat(id=self.get_record().chat_id,
+                                                                          brief=self.chat_question.question.strip()[:20]))
                     if in_chat:
                         yield 'data:' + orjson.dumps({'type': 'brief', 'brief': brief}).decode() + '\n\n'
                     if not stream:
                         json_result['title'] = brief
 
+            if retrieval is not None:
+                await retrieval
+            # token counting may load the tokenizer, keep it off the event loop
+            await self._blocking(self.init_messages)
+
                 # select datasource if datasource is none
             if not self.ds:
                 ds_res = self.select_datasource()
 
-                for chunk in ds_res:
+                async for chunk in ds_res:
                     SQLBotLogUtil.info(chunk)
                     if in_chat:
                         yield 'data:' + orjson.dumps(
@@ -1111,23 +1248,39 @@ class LLMService:
                                                   'engine_type': self.ds.type_name or self.ds.type,
                                                   'type': 'datasource'}).decode() + '\n\n'
 
-                self.chat_question.db_schema = self.out_ds_instance.get_db_schema(
-                    self.ds.id) if self.out_ds_instance else get_table_schema(session=self.session,
-                                                                              current_user=self.current_user,
-                                                                              ds=self.ds,
-                                                                              question=self.chat_question.question)
+                if self.out_ds_instance:
+                    self.chat_question.db_schema = await self._blocking(self.out_ds_instance.get_db_schema,
+                                                                        self.ds.id)
+                else:
+                    self.chat_question.db_schema = await self._blocking(get_table_schema, session=self.session,
+                                                                        current_user=self.current_user,
+                                                                        ds=self.ds,
+                                                                        question=self.chat_question.question)
             else:
-                self.validate_history_ds()
+                await self._blocking(self.validate_history_ds)
 
             # check connection
-            connected = check_connection(ds=self.ds, trans=None)
+            connected = await self._blocking(DatasourceStatusCache.is_connected, self.ds)
             if not connected:
                 raise SQLBotDBConnectionError('Connect DB failed')
 
-            # generate sql
-            sql_res = self.generate_sql()
+            # reuse the answer of an identical question, only for the first question of a chat since
+            # follow-up questions depend on the conversation
+            if AnswerCache.enabled() and len(self.generate_sql_logs) == 0:
+                self.answer_cache_key = AnswerCache.build_bucket_key(self.current_user.oid, self.ds,
+                                                                     self.chat_question)
+                self.answer_cache_hit, self.question_embedding = await self._blocking(AnswerCache.lookup,
+                                                                                      self.answer_cache_key,
+                                                                                      self.chat_question.question)
+                if self.answer_cache_hit is not None and in_chat:
+                    yield 'data:' + orjson.dumps({'type': 'info', 'msg': 'answer cache hit'}).decode() + '\n\n'
+
+            # generate sql, in single call mode together with the chart config
+            single_call = settings.SQL_CHART_SINGLE_CALL_ENABLED and \
+                          finish_step.value > ChatFinishStep.QUERY_DATA.value
+            sql_res = self.generate_sql(with_chart=single_call)
             full_sql_text = ''
-            for chunk in sql_res:
+            async for chunk in sql_res:
                 full_sql_text += chunk.get('content')
                 if in_chat:
                     yield 'data:' + orjson.dumps(
@@ -1139,6 +1292,9 @@ class LLMService:
             SQLBotLogUtil.info(full_sql_text)
 
             chart_type = self.get_chart_type_from_sql_answer(full_sql_text)
+            sql_chart = self.get_chart_from_sql_answer(full_sql_text) if single_call else None
+            if single_call and sql_chart is None:
+                SQLBotLogUtil.info("No usable chart config in the sql answer, generating it separately")
 
             use_dynamic_ds: bool = self.current_assistant and self.current_assistant.type in dynamic_ds_types
             is_page_embedded: bool = self.current_assistant and self.current_assistant.type == 4
@@ -1152,22 +1308,22 @@ class LLMService:
                 sql_result = None
 
                 if use_dynamic_ds:
-                    dynamic_sql_result = self.generate_assistant_dynamic_sql(sql, tables)
+                    dynamic_sql_result = await self.generate_assistant_dynamic_sql(sql, tables)
                     sqlbot_temp_sql_text = dynamic_sql_result.get(
                         'sqlbot_temp_sql_text') if dynamic_sql_result else None
                     # sql_result = self.generate_assistant_filter(sql, tables)
                 else:
-                    sql_result = self.generate_filter(sql, tables)  # maybe no sql and tables
+                    sql_result = await self.generate_filter(sql, tables)  # maybe no sql and tables
 
                 if sql_result:
                     SQLBotLogUtil.info(sql_result)
-                    sql = self.check_save_sql(res=sql_result)
+                    sql = await self._blocking(self.check_save_sql, res=sql_result)
                 elif dynamic_sql_result and sqlbot_temp_sql_text:
-                    assistant_dynamic_sql = self.check_save_sql(res=sqlbot_temp_sql_text)
+                    assistant_dynamic_sql = await self._blocking(self.check_save_sql, res=sqlbot_temp_sql_text)
                 else:
-                    sql = self.check_save_sql(res=full_sql_text)
+                    sql = await self._blocking(self.check_save_sql, res=full_sql_text)
             else:
-                sql = self.check_save_sql(res=full_sql_text)
+                sql = await self._blocking(self.check_save_sql, res=full_sql_text)
 
             SQLBotLogUtil.info('sql: ' + sql)
 
@@ -1197,44 +1353,42 @@ class LLMService:
                     yield json_result
                 return
 
-            result = self.execute_sql(sql=real_execute_sql)
-            self.save_sql_data(data_obj=result)
+            if finish_step.value > ChatFinishStep.QUERY_DATA.value and sql_chart is None and \
+                    self.can_speculate_chart():
+                # the chart answer streams from the model while the query runs, a failed query discards it
+                speculative_chart = asyncio.ensure_future(self.speculate_chart(chart_type))
+
+            result = await self._blocking(self.execute_sql, sql=real_execute_sql)
+            await self._blocking(self.save_sql_data, data_obj=result)
+            if self.answer_cache_key:
+                await self._blocking(AnswerCache.put, self.answer_cache_key, self.chat_question.question,
+                                     full_sql_text, embedding=self.question_embedding)
             if in_chat:
-                yield 'data:' + orjson.dumps({'content': 'execute-success', 'type': 'sql-data'}).decode() + '\n\n'
+                yield 'data:' + orjson.dumps({'content': 'execute-success', 'type': 'sql-data',
+                                              'truncated': result.truncated}).decode() + '\n\n'
             if not stream:
-                json_result['data'] = result.get('data')
+                json_result['data'] = result.to_rows(for_json=True)
+                json_result['truncated'] = result.truncated
 
             if finish_step.value <= ChatFinishStep.QUERY_DATA.value:
                 if stream:
                     if in_chat:
                         yield 'data:' + orjson.dumps({'type': 'finish'}).decode() + '\n\n'
                     else:
-                        data = []
-                        _fields_list = []
-                        _fields_skip = False
-                        for _data in result.get('data'):
-                            _row = []
-                            for field in result.get('fields'):
-                                _row.append(_data.get(field))
-                                if not _fields_skip:
-                                    _fields_list.append(field)
-                            data.append(_row)
-                            _fields_skip = True
-
-                        if not data or not _fields_list:
+                        if not result.row_count or not result.fields:
                             yield 'The SQL execution result is empty.\n\n'
                         else:
-                            df = pd.DataFrame(np.array(data), columns=_fields_list)
-                            markdown_table = df.to_markdown(index=False)
+                            markdown_table = await self._blocking(result.to_dataframe().to_markdown, index=False)
                             yield markdown_table + '\n\n'
                 else:
                     yield json_result
                 return
 
             # generate chart
-            chart_res = self.generate_chart(chart_type)
+            chart_res = self.generate_chart(chart_type, speculative=speculative_chart,
+                                            answer=orjson.dumps(sql_chart).decode() if sql_chart else None)
             full_chart_text = ''
-            for chunk in chart_res:
+            async for chunk in chart_res:
                 full_chart_text += chunk.get('content')
                 if in_chat:
                     yield 'data:' + orjson.dumps(
@@ -1245,8 +1399,11 @@ class LLMService:
 
             # filter chart
             SQLBotLogUtil.info(full_chart_text)
-            chart = self.check_save_chart(res=full_chart_text)
+            chart = await self._blocking(self.check_save_chart, res=full_chart_text)
             SQLBotLogUtil.info(chart)
+            if self.answer_cache_key:
+                await self._blocking(AnswerCache.put, self.answer_cache_key, self.chat_question.question,
+                                     full_sql_text, full_chart_text, embedding=self.question_embedding)
 
             if not stream:
                 json_result['chart'] = chart
@@ -1256,7 +1413,6 @@ class LLMService:
                     {'content': orjson.dumps(chart).decode(), 'type': 'chart'}).decode() + '\n\n'
             else:
                 if stream:
-                    data = []
                     _fields = {}
                     if chart.get('columns'):
                         for _column in chart.get('columns'):
@@ -1270,22 +1426,14 @@ class LLMService:
                         if chart.get('axis').get('series'):
                             _fields[chart.get('axis').get('series').get('value')] = chart.get('axis').get('series').get(
                                 'name')
-                    _fields_list = []
-                    _fields_skip = False
-                    for _data in result.get('data'):
-                        _row = []
-                        for field in result.get('fields'):
-                            _row.append(_data.get(field))
-                            if not _fields_skip:
-                                _fields_list.append(field if not _fields.get(field) else _fields.get(field))
-                        data.append(_row)
-                        _fields_skip = True
-
-                    if not data or not _fields_list:
+                    _fields_list = [field if not _fields.get(field) else _fields.get(field) for field in
+                                    result.fields]
+
+                    if not result.row_count or not _fields_list:
                         yield 'The SQL execution result is empty.\n\n'
                     else:
-                        df = pd.DataFrame(np.array(data), columns=_fields_list)
-                        markdown_table = df.to_markdown(index=False)
+                        markdown_table = await self._blocking(result.to_dataframe(_fields_list).to_markdown,
+                                                              index=False)
                         yield markdown_table + '\n\n'
 
             if in_chat:
@@ -1294,7 +1442,8 @@ class LLMService:
                 # todo generate picture
                 if chart['type'] != 'table':
                     yield '### generated chart picture\n\n'
-                    image_url = request_picture(self.record.chat_id, self.record.id, chart, result)
+                    image_url = await self._blocking(request_picture, self.record.chat_id, self.record.id, chart,
+                                                     result.to_dict(for_json=True))
                     SQLBotLogUtil.info(image_url)
                     if stream:
                         yield f'![{chart["type"]}]({image_url})'
@@ -1312,12 +1461,18 @@ class LLMService:
             elif isinstance(e, SQLBotDBConnectionError):
                 error_msg = orjson.dumps(
                     {'message': str(e), 'type': 'db-connection-err'}).decode()
+            elif isinstance(e, SQLBotDBTimeoutError):
+                error_msg = orjson.dumps(
+                    {'message': 'Execute SQL Timeout', 'traceback': str(e), 'type': 'exec-sql-timeout'}).decode()
+            elif isinstance(e, SQLBotDBCancelledError):
+                error_msg = orjson.dumps(
+                    {'message': 'Execute SQL Cancelled', 'traceback': str(e), 'type': 'exec-sql-cancelled'}).decode()
             elif isinstance(e, SQLBotDBError):
                 error_msg = orjson.dumps(
                     {'message': 'Execute SQL Failed', 'traceback': str(e), 'type': 'exec-sql-err'}).decode()
             else:
                 error_msg = orjson.dumps({'message': str(e), 'traceback': traceback.format_exc(limit=1)}).decode()
-            self.save_error(message=error_msg)
+            await self._blocking(self.save_error, message=error_msg)
             if in_chat:
                 yield 'data:' + orjson.dumps({'content': error_msg, 'type': 'error'}).decode() + '\n\n'
             else:
@@ -1328,19 +1483,23 @@ class LLMService:
                     json_result['message'] = error_msg
                     yield json_result
         finally:
-            self.finish()
+            for pending in (retrieval, speculative_chart):
+                if pending is None:
+                    continue
+                if not pending.done():
+                    pending.cancel()
+                elif not pending.cancelled():
+                    # a speculative chart that failed after the query failed, the error is of no interest
+                    pending.exception()
+            await self._blocking(self.finish)
 
     def run_recommend_questions_task_async(self):
-        self.future = executor.submit(self.run_recommend_questions_task_cache)
+        self._submit(self.run_recommend_questions_task())
 
-    def run_recommend_questions_task_cache(self):
-        for chunk in self.run_recommend_questions_task():
-            self.chunk_list.append(chunk)
-
-    def run_recommend_questions_task(self):
+    async def run_recommend_questions_task(self):
         res = self.generate_recommend_questions_task()
 
-        for chunk in res:
+        async for chunk in res:
             if chunk.get('recommended_question'):
                 yield 'data:' + orjson.dumps(
                     {'content': chunk.get('recommended_question'), 'type': 'recommended_question'}).decode() + '\n\n'
@@ -1351,13 +1510,9 @@ class LLMService:
 
     def run_analysis_or_predict_task_async(self, action_type: str, base_record: ChatRecord):
         self.set_record(save_analysis_predict_record(self.session, base_record, action_type))
-        self.future = executor.submit(self.run_analysis_or_predict_task_cache, action_type)
-
-    def run_analysis_or_predict_task_cache(self, action_type: str):
-        for chunk in self.run_analysis_or_predict_task(action_type):
-            self.chunk_list.append(chunk)
+        self._submit(self.run_analysis_or_predict_task(action_type))
 
-    def run_analysis_or_predict_task(self, action_type: str):
+    async def run_analysis_or_predict_task(self, action_type: str):
         try:
 
             yield 'data:' + orjson.dumps({'type': 'id', 'id': self.get_record().id}).decode() + '\n\n'
@@ -1365,7 +1520,7 @@ class LLMService:
             if action_type == 'analysis':
                 # generate analysis
                 analysis_res = self.generate_analysis()
-                for chunk in analysis_res:
+                async for chunk in analysis_res:
                     yield 'data:' + orjson.dumps(
                         {'content': chunk.get('content'), 'reasoning_content': chunk.get('reasoning_content'),
                          'type': 'analysis-result'}).decode() + '\n\n'
@@ -1377,14 +1532,14 @@ class LLMService:
                 # generate predict
                 analysis_res = self.generate_predict()
                 full_text = ''
-                for chunk in analysis_res:
+                async for chunk in analysis_res:
                     yield 'data:' + orjson.dumps(
                         {'content': chunk.get('content'), 'reasoning_content': chunk.get('reasoning_content'),
                          'type': 'predict-result'}).decode() + '\n\n'
                     full_text += chunk.get('content')
                 yield 'data:' + orjson.dumps({'type': 'info', 'msg': 'predict generated'}).decode() + '\n\n'
 
-                _data = self.check_save_predict_data(res=full_text)
+                _data = await self._blocking(self.check_save_predict_data, res=full_text)
                 if _data:
                     yield 'data:' + orjson.dumps({'type': 'predict-success'}).decode() + '\n\n'
                 else:
@@ -1392,14 +1547,14 @@ class LLMService:
 
                 yield 'data:' + orjson.dumps({'type': 'predict_finish'}).decode() + '\n\n'
 
-            self.finish()
+            await self._blocking(self.finish)
         except Exception as e:
             error_msg: str
             if isinstance(e, SingleMessageError):
                 error_msg = str(e)
             else:
                 error_msg = orjson.dumps({'message': str(e), 'traceback': traceback.format_exc(limit=1)}).decode()
-            self.save_error(message=error_msg)
+            await self._blocking(self.save_error, message=error_msg)
             yield 'data:' + orjson.dumps({'content': error_msg, 'type': 'error'}).decode() + '\n\n'
         finally:
             # end
@@ -1426,6 +1581,15 @@ class LLMService:
                 raise SingleMessageError(f"ds is invalid [{str(e)}]")
 
 
+async def _replay(content: str):
+    yield {'content': content}
+
+
+async def _replay_chunks(chunks: list[dict]):
+    for chunk in chunks:
+        yield chunk
+
+
 def execute_sql_with_db(db: SQLDatabase, sql: str) -> str:
     """Execute SQL query using SQLDatabase
 
@@ -1505,23 +1669,32 @@ def get_token_usage(chunk: BaseMessageChunk, token_usage: dict = None):
         pass
 
 
-def process_stream(res: Iterator[BaseMessageChunk],
-                   token_usage: Dict[str, Any] = None,
-                   enable_tag_parsing: bool = settings.PARSE_REASONING_BLOCK_ENABLED,
-                   start_tag: str = settings.DEFAULT_REASONING_CONTENT_START,
-                   end_tag: str = settings.DEFAULT_REASONING_CONTENT_END
-                   ):
-    if token_usage is None:
-        token_usage = {}
-    in_thinking_block = False  # 标记是否在思考过程块中
-    current_thinking = ''  # 当前收集的思考过程内容
-    pending_start_tag = ''  # 用于缓存可能被截断的开始标签部分
+class ReasoningStreamParser:
+    """
+    Splits streamed LLM chunks into content and reasoning_content, keeping the tag state between chunks.
+    Shared by process_stream and aprocess_stream so the sync and asyncio paths parse identically.
+    """
 
-    for chunk in res:
+    def __init__(self, token_usage: Dict[str, Any] = None,
+                 enable_tag_parsing: bool = settings.PARSE_REASONING_BLOCK_ENABLED,
+                 start_tag: str = settings.DEFAULT_REASONING_CONTENT_START,
+                 end_tag: str = settings.DEFAULT_REASONING_CONTENT_END):
+        self.token_usage = token_usage if token_usage is not None else {}
+        self.enable_tag_parsing = enable_tag_parsing
+        self.start_tag = start_tag
+        self.end_tag = end_tag
+        self.in_thinking_block = False  # 标记是否在思考过程块中
+        self.current_thinking = ''  # 当前收集的思考过程内容
+        self.pending_start_tag = ''  # 用于缓存可能被截断的开始标签部分
+
+    def feed(self, chunk: BaseMessageChunk) -> Dict[str, str]:
         SQLBotLogUtil.info(chunk)
+        get_token_usage(chunk, self.token_usage)
         reasoning_content_chunk = ''
         content = chunk.content
         output_content = ''  # 实际要输出的内容
+        start_tag = self.start_tag
+        end_tag = self.end_tag
 
         # 检查additional_kwargs中的reasoning_content
         if 'reasoning_content' in chunk.additional_kwargs:
@@ -1530,27 +1703,24 @@ def process_stream(res: Iterator[BaseMessageChunk],
                 reasoning_content = ''
 
             # 累积additional_kwargs中的思考内容到current_thinking
-            current_thinking += reasoning_content
+            self.current_thinking += reasoning_content
             reasoning_content_chunk = reasoning_content
 
         # 只有当current_thinking不是空字符串时才跳过标签解析
-        if not in_thinking_block and current_thinking.strip() != '':
-            output_content = content  # 正常输出content
-            yield {
-                'content': output_content,
+        if not self.in_thinking_block and self.current_thinking.strip() != '':
+            return {
+                'content': content,
                 'reasoning_content': reasoning_content_chunk
             }
-            get_token_usage(chunk, token_usage)
-            continue  # 跳过后续的标签解析逻辑
 
         # 如果没有有效的思考内容，并且启用了标签解析，才执行标签解析逻辑
         # 如果有缓存的开始标签部分，先拼接当前内容
-        if pending_start_tag:
-            content = pending_start_tag + content
-            pending_start_tag = ''
+        if self.pending_start_tag:
+            content = self.pending_start_tag + content
+            self.pending_start_tag = ''
 
         # 检查是否开始思考过程块（处理可能被截断的开始标签）
-        if enable_tag_parsing and not in_thinking_block and start_tag:
+        if self.enable_tag_parsing and not self.in_thinking_block and start_tag:
             if start_tag in content:
                 start_idx = content.index(start_tag)
                 # 只有当开始标签前面没有其他文本时才认为是真正的思考块开始
@@ -1558,7 +1728,7 @@ def process_stream(res: Iterator[BaseMessageChunk],
                     # 完整标签存在且前面没有其他文本
                     output_content += content[:start_idx]  # 输出开始标签之前的内容
                     content = content[start_idx + len(start_tag):]  # 移除开始标签
-                    in_thinking_block = True
+                    self.in_thinking_block = True
                 else:
                     # 开始标签前面有其他文本，不认为是思考块开始
                     output_content += content
@@ -1569,26 +1739,26 @@ def process_stream(res: Iterator[BaseMessageChunk],
                     if content.endswith(start_tag[:i]):
                         # 只有当当前内容全是空白时才缓存部分标签
                         if content[:-i].strip() == '':
-                            pending_start_tag = start_tag[:i]
+                            self.pending_start_tag = start_tag[:i]
                             content = content[:-i]  # 移除可能的部分标签
                             output_content += content
                             content = ''
                         break
 
         # 处理思考块内容
-        if enable_tag_parsing and in_thinking_block and end_tag:
+        if self.enable_tag_parsing and self.in_thinking_block and end_tag:
             if end_tag in content:
                 # 找到结束标签
                 end_idx = content.index(end_tag)
-                current_thinking += content[:end_idx]  # 收集思考内容
-                reasoning_content_chunk += current_thinking  # 添加到当前块的思考内容
+                self.current_thinking += content[:end_idx]  # 收集思考内容
+                reasoning_content_chunk += self.current_thinking  # 添加到当前块的思考内容
                 content = content[end_idx + len(end_tag):]  # 移除结束标签后的内容
-                current_thinking = ''  # 重置当前思考内容
-                in_thinking_block = False
+                self.current_thinking = ''  # 重置当前思考内容
+                self.in_thinking_block = False
                 output_content += content  # 输出结束标签之后的内容
             else:
                 # 在遇到结束标签前，持续收集思考内容
-                current_thinking += content
+                self.current_thinking += content
                 reasoning_content_chunk += content
                 content = ''
 
@@ -1596,11 +1766,32 @@ def process_stream(res: Iterator[BaseMessageChunk],
             # 不在思考块中或标签解析未启用，正常输出
             output_content += content
 
-        yield {
+        return {
             'content': output_content,
             'reasoning_content': reasoning_content_chunk
         }
-        get_token_usage(chunk, token_usage)
+
+
+def process_stream(res: Iterator[BaseMessageChunk],
+                   token_usage: Dict[str, Any] = None,
+                   enable_tag_parsing: bool = settings.PARSE_REASONING_BLOCK_ENABLED,
+                   start_tag: str = settings.DEFAULT_REASONING_CONTENT_START,
+                   end_tag: str = settings.DEFAULT_REASONING_CONTENT_END
+                   ):
+    parser = ReasoningStreamParser(token_usage, enable_tag_parsing, start_tag, end_tag)
+    for chunk in res:
+        yield parser.feed(chunk)
+
+
+async def aprocess_stream(res: AsyncIterator[BaseMessageChunk],
+                          token_usage: Dict[str, Any] = None,
+                          enable_tag_parsing: bool = settings.PARSE_REASONING_BLOCK_ENABLED,
+                          start_tag: str = settings.DEFAULT_REASONING_CONTENT_START,
+                          end_tag: str = settings.DEFAULT_REASONING_CONTENT_END
+                          ):
+    parser = ReasoningStreamParser(token_usage, enable_tag_parsing, start_tag, end_tag)
+    async for chunk in res:
+        yield parser.feed(chunk)
 
 
 def get_lang_name(lang: str):
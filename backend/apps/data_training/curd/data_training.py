@@ -9,13 +9,15 @@ from sqlalchemy import and_, select, func, delete, update, or_
 from sqlalchemy import text
 from sqlalchemy.orm.session import Session
 
-from apps.ai_model.embedding import EmbeddingModelCache
+from apps.ai_model.embedding import EmbeddingNotReadyError, QueryEmbeddingCache, save_embeddings_in_batches
+from apps.ai_model.vector_index import VectorIndexCache
 from apps.data_training.models.data_training_model import DataTrainingInfo, DataTraining
 from apps.datasource.models.datasource import CoreDatasource
 from apps.template.generate_chart.generator import get_base_data_training_template
 from common.core.config import settings
 from common.core.deps import SessionDep, Trans
 from common.utils.embedding_threads import run_save_data_training_embeddings
+from common.utils.utils import SQLBotLogUtil
 
 
 def page_data_training(session: SessionDep, current_page: int = 1, page_size: int = 10, name: Optional[str] = None,
@@ -150,6 +152,7 @@ def delete_training(session: SessionDep, ids: list[int]):
     stmt = delete(DataTraining).where(and_(DataTraining.id.in_(ids)))
     session.execute(stmt)
     session.commit()
+    VectorIndexCache.remove('data_training', None, ids)
 
 
 # def run_save_embeddings(ids: List[int]):
@@ -177,23 +180,41 @@ def save_embeddings(session: Session, ids: List[int]):
     if not ids or len(ids) == 0:
         return
     try:
+        _list = session.query(DataTraining.id, DataTraining.question, DataTraining.oid,
+                              DataTraining.datasource).filter(and_(DataTraining.id.in_(ids))).all()
+        rows_by_id = {row.id: row for row in _list}
 
-        _list = session.query(DataTraining).filter(and_(DataTraining.id.in_(ids))).all()
+        def update_index(saved: list[tuple[int, list[float]]]):
+            for _id, vector in saved:
+                row = rows_by_id[_id]
+                VectorIndexCache.upsert('data_training', (row.oid, row.datasource),
+                                        [(row.id, vector, {'question': row.question})])
 
-        _question_list = [item.question for item in _list]
+        if VectorIndexCache.enabled():
+            # the datasource of an entry may have changed, drop it from every index before adding it again
+            VectorIndexCache.remove('data_training', None, ids)
 
-        model = EmbeddingModelCache.get_model()
+        save_embeddings_in_batches(session, DataTraining, [(row.id, row.question) for row in _list],
+                                   'data training', update_index if VectorIndexCache.enabled() else None)
 
-        results = model.embed_documents(_question_list)
+    except Exception:
+        session.rollback()
+        # the embedding job service logs and retries it
+        raise
 
-        for index in range(len(results)):
-            item = results[index]
-            stmt = update(DataTraining).where(and_(DataTraining.id == _list[index].id)).values(embedding=item)
-            session.execute(stmt)
-            session.commit()
 
-    except Exception:
-        traceback.print_exc()
+def load_training_index_items(session: Session, oid: int, datasource: int):
+    rows = session.query(DataTraining.id, DataTraining.question, DataTraining.embedding).filter(
+        and_(DataTraining.oid == oid, DataTraining.datasource == datasource,
+             DataTraining.embedding.isnot(None))).all()
+    return [(row.id, row.embedding, {'question': row.question}) for row in rows]
+
+
+def search_training_index(session: Session, embedding: List[float], oid: int, datasource: int):
+    index = VectorIndexCache.get('data_training', (oid, datasource),
+                                 lambda: load_training_index_items(session, oid, datasource))
+    return index.search(embedding, settings.EMBEDDING_DATA_TRAINING_TOP_COUNT,
+                        min_score=settings.EMBEDDING_DATA_TRAINING_SIMILARITY)
 
 
 embedding_sql = f"""
@@ -235,16 +256,20 @@ def select_training_by_question(session: SessionDep, question: str, oid: int, da
 
     if settings.EMBEDDING_ENABLED:
         try:
-            model = EmbeddingModelCache.get_model()
-
-            embedding = model.embed_query(question)
+            embedding = QueryEmbeddingCache.embed(question)
 
-            results = session.execute(text(embedding_sql),
-                                      {'embedding_array': str(embedding), 'oid': oid, 'datasource': datasource})
+            if VectorIndexCache.enabled():
+                results = [DataTraining(id=_id, question=payload['question'])
+                           for _id, _score, payload in search_training_index(session, embedding, oid, datasource)]
+            else:
+                results = session.execute(text(embedding_sql),
+                                          {'embedding_array': str(embedding), 'oid': oid, 'datasource': datasource})
 
             for row in results:
                 _list.append(DataTraining(id=row.id, question=row.question))
 
+        except EmbeddingNotReadyError as e:
+            SQLBotLogUtil.info(f"Data training embedding search skipped: {e}")
         except Exception:
             traceback.print_exc()
 
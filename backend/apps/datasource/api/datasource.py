@@ -10,8 +10,11 @@ import orjson
 import pandas as pd
 from fastapi import APIRouter, File, UploadFile, HTTPException
 
+from apps.ai_model.vector_index import VectorIndexCache
 from apps.db.db import get_schema
 from apps.db.engine import get_engine_conn
+from apps.db.engine_registry import DatasourceEngineCache
+from apps.db.result_cache import SqlResultCache
 from common.core.config import settings
 from common.core.deps import SessionDep, CurrentUser, Trans
 from common.utils.utils import SQLBotLogUtil
@@ -33,6 +36,34 @@ async def query_by_oid(session: SessionDep, user: CurrentUser, oid: int) -> List
     return get_datasource_list(session=session, user=user, oid=oid)
 
 
+@router.get("/pool/stats", include_in_schema=False)
+async def pool_stats(user: CurrentUser):
+    if not user.isAdmin:
+        raise Exception("no permission to execute")
+    return DatasourceEngineCache.stats()
+
+
+@router.get("/vectorIndex/stats", include_in_schema=False)
+async def vector_index_stats(user: CurrentUser):
+    if not user.isAdmin:
+        raise Exception("no permission to execute")
+    return VectorIndexCache.stats()
+
+
+@router.get("/resultCache/stats", include_in_schema=False)
+async def result_cache_stats(user: CurrentUser):
+    if not user.isAdmin:
+        raise Exception("no permission to execute")
+    return await asyncio.to_thread(SqlResultCache.stats)
+
+
+@router.post("/resultCache/clear/{id}", include_in_schema=False)
+async def result_cache_clear(user: CurrentUser, id: int):
+    if not user.isAdmin:
+        raise Exception("no permission to execute")
+    await asyncio.to_thread(SqlResultCache.invalidate_ds, id)
+
+
 @router.get("/list")
 async def datasource_list(session: SessionDep, user: CurrentUser):
     return get_datasource_list(session=session, user=user)
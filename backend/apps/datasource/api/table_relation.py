@@ -4,8 +4,10 @@ from typing import List
 
 from fastapi import APIRouter
 
+from apps.datasource.crud.schema_cache import SchemaCache
 from apps.datasource.models.datasource import CoreDatasource
 from common.core.deps import SessionDep
+from common.utils.embedding_threads import run_save_ds_embeddings
 
 router = APIRouter(tags=["table_relation"], prefix="/table_relation")
 
@@ -16,6 +18,8 @@ async def save_relation(session: SessionDep, ds_id: int, relation: List[dict]):
     if ds:
         ds.table_relation = relation
         session.commit()
+        SchemaCache.bump(ds_id)
+        run_save_ds_embeddings([ds_id])
     else:
         raise Exception("no datasource")
     return True
@@ -16,20 +16,27 @@ except ImportError:
 
 from sqlmodel import select
 
+from apps.ai_model.vector_index import VectorIndexCache
+from apps.chat.task.answer_cache import AnswerCache
 from apps.datasource.crud.permission import get_column_permission_fields, get_row_permission_filters, is_normal_user
 from apps.datasource.embedding.table_embedding import get_table_embedding
 from apps.datasource.utils.utils import aes_decrypt
 from apps.db.constant import DB
 from apps.db.db import get_tables, get_fields, exec_sql, check_connection
 from apps.db.engine import get_engine_config, get_engine_conn
+from apps.db.engine_registry import DatasourceEngineCache
+from apps.db.result_cache import SqlResultCache
+from apps.db.status_cache import DatasourceStatusCache
 from common.core.config import settings, TABLE_EMBEDDING_ENABLED
 from common.core.deps import SessionDep, CurrentUser, Trans
+from common.utils.embedding_threads import run_save_table_embeddings, run_save_ds_embeddings
 from common.utils.utils import deepcopy_ignore_extra
+from .schema_cache import SchemaCache, DatasourceSchema, CachedTable
 from .table import get_tables_by_ds_id
 from ..crud.field import delete_field_by_ds_id, update_field
 from ..crud.table import delete_table_by_ds_id, update_table
 from ..models.datasource import CoreDatasource, CreateDatasource, CoreTable, CoreField, ColumnSchema, TableObj, \
-    DatasourceConf, TableAndFields
+    DatasourceConf
 
 
 def get_datasource_list(session: SessionDep, user: CurrentUser, oid: Optional[int] = None) -> List[CoreDatasource]:
@@ -101,6 +108,7 @@ def create_ds(session: SessionDep, trans: Trans, user: CurrentUser, create_ds: C
             session.add(record)
             session.commit()
             ds.description = auto_description
+    run_save_ds_embeddings([ds.id])
 
     return ds
 
@@ -118,6 +126,7 @@ def chooseTables(session: SessionDep, trans: Trans, id: int, tables: List[CoreTa
             ds.description = auto_description
             session.add(ds)
             session.commit()
+    run_save_ds_embeddings([ds.id])
 
 
 def update_ds(session: SessionDep, trans: Trans, user: CurrentUser, ds: CoreDatasource):
@@ -131,6 +140,12 @@ def update_ds(session: SessionDep, trans: Trans, user: CurrentUser, ds: CoreData
         setattr(record, field, value)
     session.add(record)
     session.commit()
+    DatasourceEngineCache.invalidate_ds(ds.id)
+    DatasourceStatusCache.invalidate_ds(ds.id)
+    SqlResultCache.invalidate_ds(ds.id)
+    AnswerCache.invalidate_ds(ds.id)
+    SchemaCache.bump(ds.id)
+    run_save_ds_embeddings([ds.id])
     return ds
 
 
@@ -149,6 +164,13 @@ def delete_ds(session: SessionDep, id: int):
     session.commit()
     delete_table_by_ds_id(session, id)
     delete_field_by_ds_id(session, id)
+    DatasourceEngineCache.invalidate_ds(id)
+    DatasourceStatusCache.invalidate_ds(id)
+    SqlResultCache.invalidate_ds(id)
+    AnswerCache.invalidate_ds(id)
+    SchemaCache.bump(id)
+    VectorIndexCache.remove('datasource', None, [id])
+    VectorIndexCache.invalidate('table', id)
     return {
         "message": f"Datasource with ID {id} deleted successfully."
     }
@@ -220,6 +242,8 @@ def sync_table(session: SessionDep, ds: CoreDatasource, tables: List[CoreTable])
         session.query(CoreTable).filter(CoreTable.ds_id == ds.id).delete(synchronize_session=False)
         session.query(CoreField).filter(CoreField.ds_id == ds.id).delete(synchronize_session=False)
         session.commit()
+    SchemaCache.bump(ds.id)
+    run_save_table_embeddings([ds.id])
 
 
 def sync_fields(session: SessionDep, ds: CoreDatasource, table: CoreTable, fields: List[ColumnSchema]):
@@ -252,20 +276,33 @@ def sync_fields(session: SessionDep, ds: CoreDatasource, table: CoreTable, field
         session.query(CoreField).filter(and_(CoreField.table_id == table.id, CoreField.id.not_in(id_list))).delete(
             synchronize_session=False)
         session.commit()
+    SchemaCache.bump(ds.id)
 
 
 def update_table_and_fields(session: SessionDep, data: TableObj):
     update_table(session, data.table)
     for field in data.fields:
         update_field(session, field)
+    refresh_table_embeddings(session, data.table.id)
 
 
 def updateTable(session: SessionDep, table: CoreTable):
     update_table(session, table)
+    refresh_table_embeddings(session, table.id)
 
 
 def updateField(session: SessionDep, field: CoreField):
     update_field(session, field)
+    record = session.get(CoreField, field.id)
+    if record:
+        refresh_table_embeddings(session, record.table_id)
+
+
+def refresh_table_embeddings(session: SessionDep, table_id: int):
+    record = session.get(CoreTable, table_id)
+    if record:
+        run_save_table_embeddings([record.ds_id])
+        run_save_ds_embeddings([record.ds_id])
 
 
 def preview(session: SessionDep, current_user: CurrentUser, id: int, data: TableObj):
@@ -362,118 +399,89 @@ def updateNum(session: SessionDep, ds: CoreDatasource):
     session.commit()
 
 
-def get_table_obj_by_ds(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource) -> List[TableAndFields]:
-    from common.utils.utils import SQLBotLogUtil
-    SQLBotLogUtil.info(f"=== get_table_obj_by_ds START === ds_id={ds.id}, ds_type={ds.type}")
-
-    _list: List = []
+def load_ds_schema(session: SessionDep, ds: CoreDatasource) -> DatasourceSchema:
     tables = session.query(CoreTable).filter(CoreTable.ds_id == ds.id).all()
-    SQLBotLogUtil.info(f"=== Found {len(tables)} tables in CoreTable for ds_id={ds.id}")
-    for table in tables:
-        SQLBotLogUtil.info(f"  Table: id={table.id}, name={table.table_name}, checked={table.checked}, comment={table.table_comment}")
 
     conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if ds.type != "excel" else get_engine_config()
-    schema = conf.dbSchema if conf.dbSchema is not None and conf.dbSchema != "" else conf.database
-    SQLBotLogUtil.info(f"=== Schema: {schema}")
+    db_name = conf.dbSchema if conf.dbSchema is not None and conf.dbSchema != "" else conf.database
 
-    # get all field
+    # get all field, the unchecked ones are only kept for relation names
     table_ids = [table.id for table in tables]
-    all_fields = session.query(CoreField).filter(
-        and_(CoreField.table_id.in_(table_ids), CoreField.checked == True)).all()
+    all_fields = session.query(CoreField).filter(CoreField.table_id.in_(table_ids)).all()
     # build dict
     fields_dict = {}
     for field in all_fields:
-        if fields_dict.get(field.table_id):
-            fields_dict.get(field.table_id).append(field)
-        else:
-            fields_dict[field.table_id] = [field]
+        if field.checked:
+            fields_dict.setdefault(field.table_id, []).append(field)
 
-    # 开源版本：DsRules 是 Mock 类，不查询数据库
-    contain_rules = []
+    cached_tables = []
     for table in tables:
-        # fields = session.query(CoreField).filter(and_(CoreField.table_id == table.id, CoreField.checked == True)).all()
         fields = fields_dict.get(table.id)
-        SQLBotLogUtil.info(f"  Processing table {table.table_name}: found {len(fields) if fields else 0} checked fields")
-
-        # do column permissions, filter fields
-        fields = get_column_permission_fields(session=session, current_user=current_user, table=table, fields=fields,
-                                              contain_rules=contain_rules)
-        SQLBotLogUtil.info(f"  After permission filter: {len(fields) if fields else 0} fields")
-        if fields and len(fields) > 0:
-            _list.append(TableAndFields(schema=schema, table=table, fields=fields))
-            SQLBotLogUtil.info(f"  ✓ Table {table.table_name} added to result")
+        if not fields:
+            continue
+        header = f"# Table: {db_name}.{table.table_name}" if ds.type != "mysql" and ds.type != "es" else f"# Table: {table.table_name}"
+        table_comment = ''
+        if table.custom_comment:
+            table_comment = table.custom_comment.strip()
+        if table_comment == '':
+            header += '\n[\n'
         else:
-            SQLBotLogUtil.info(f"  ✗ Table {table.table_name} SKIPPED (no fields)")
+            header += f", {table_comment}\n[\n"
+
+        field_list = []
+        for field in fields:
+            field_comment = ''
+            if field.custom_comment:
+                field_comment = field.custom_comment.strip()
+            if field_comment == '':
+                fragment = f"({field.field_name}:{field.field_type})"
+            else:
+                fragment = f"({field.field_name}:{field.field_type}, {field_comment})"
+            field_list.append((CoreField(**field.model_dump()), fragment))
+        cached_tables.append(CachedTable(CoreTable(**table.model_dump()), header, field_list))
 
-    SQLBotLogUtil.info(f"=== get_table_obj_by_ds END: returning {len(_list)} tables ===")
-    return _list
+    return DatasourceSchema(db_name=db_name, tables=cached_tables,
+                            table_names={table.id: table.table_name for table in tables},
+                            field_names={field.id: field.field_name for field in all_fields})
 
 
 def get_table_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource, question: str,
                      embedding: bool = True) -> str:
     from common.utils.utils import SQLBotLogUtil
-    SQLBotLogUtil.info(f"=== get_table_schema START === ds_id={ds.id}, ds_name={ds.name}, ds_type={ds.type}, question={question}, embedding={embedding}")
 
     schema_str = ""
-    table_objs = get_table_obj_by_ds(session=session, current_user=current_user, ds=ds)
-    SQLBotLogUtil.info(f"=== get_table_obj_by_ds returned {len(table_objs)} tables")
-    for idx, obj in enumerate(table_objs):
-        SQLBotLogUtil.info(f"  Table {idx}: {obj.table.table_name}, comment={obj.table.custom_comment}, fields_count={len(obj.fields) if obj.fields else 0}")
-
-    if len(table_objs) == 0:
-        SQLBotLogUtil.info("=== get_table_schema END: No tables found ===")
-        return schema_str
-    db_name = table_objs[0].schema
-    schema_str += f"【DB_ID】 {db_name}\n【Schema】\n"
+    ds_schema = SchemaCache.get(ds, lambda: load_ds_schema(session, ds))
+    # 开源版本：DsRules 是 Mock 类，不查询数据库
+    contain_rules = []
     tables = []
     all_tables = []  # temp save all tables
-    for obj in table_objs:
-        schema_table = ''
-        schema_table += f"# Table: {db_name}.{obj.table.table_name}" if ds.type != "mysql" and ds.type != "es" else f"# Table: {obj.table.table_name}"
-        table_comment = ''
-        if obj.table.custom_comment:
-            table_comment = obj.table.custom_comment.strip()
-        if table_comment == '':
-            schema_table += '\n[\n'
-        else:
-            schema_table += f", {table_comment}\n[\n"
-
-        if obj.fields:
-            field_list = []
-            for field in obj.fields:
-                field_comment = ''
-                if field.custom_comment:
-                    field_comment = field.custom_comment.strip()
-                if field_comment == '':
-                    field_list.append(f"({field.field_name}:{field.field_type})")
-                else:
-                    field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
-            schema_table += ",\n".join(field_list)
-        schema_table += '\n]\n'
-
-        t_obj = {"id": obj.table.id, "schema_table": schema_table}
+    for cached in ds_schema.tables:
+        schema_table = cached.schema_table
+        if contain_rules:
+            # do column permissions, filter fields; without rules no permission can apply to this user
+            fields = get_column_permission_fields(session=session, current_user=current_user, table=cached.table,
+                                                  fields=[f for f, _ in cached.fields], contain_rules=contain_rules)
+            if not fields:
+                continue
+            schema_table = cached.render(fields)
+
+        t_obj = {"id": cached.table.id, "schema_table": schema_table}
         tables.append(t_obj)
         all_tables.append(t_obj)
 
+    if len(tables) == 0:
+        SQLBotLogUtil.info(f"=== get_table_schema: No tables found, ds_id={ds.id} ===")
+        return schema_str
+    schema_str += f"【DB_ID】 {ds_schema.db_name}\n【Schema】\n"
+
     # do table embedding
-    from common.utils.utils import SQLBotLogUtil
-    SQLBotLogUtil.info(f"=== Before table embedding: {len(tables)} tables, embedding={embedding}, TABLE_EMBEDDING_ENABLED={TABLE_EMBEDDING_ENABLED}")
     if embedding and tables and TABLE_EMBEDDING_ENABLED:
-        tables = get_table_embedding(session, current_user, tables, question)
-        SQLBotLogUtil.info(f"=== After table embedding: {len(tables)} tables selected")
-    else:
-        SQLBotLogUtil.info(f"=== Table embedding SKIPPED (embedding={embedding}, has_tables={len(tables)>0}, enabled={TABLE_EMBEDDING_ENABLED})")
+        tables = get_table_embedding(session, current_user, tables, question, ds.id)
+        SQLBotLogUtil.info(f"=== After table embedding: {len(tables)} of {len(all_tables)} tables selected")
 
     # splice schema
-    if tables:
-        SQLBotLogUtil.info(f"=== Final tables to use: {len(tables)}")
-        for idx, s in enumerate(tables):
-            SQLBotLogUtil.info(f"  Final Table {idx}: {s.get('id')}")
-            schema_str += s.get('schema_table')
-    else:
-        SQLBotLogUtil.info("=== No tables in final schema ===")
-
-    SQLBotLogUtil.info(f"=== get_table_schema END: schema_length={len(schema_str)} ===")
+    for s in tables:
+        schema_str += s.get('schema_table')
 
     # field relation
     if tables and ds.table_relation:
@@ -493,10 +501,7 @@ def get_table_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDat
                 relation_table_ids.append(r.get('target').get('cell'))
             relation_table_ids = list(set(relation_table_ids))
             # get table dict
-            table_records = session.query(CoreTable).filter(CoreTable.id.in_(list(map(int, relation_table_ids)))).all()
-            table_dict = {}
-            for ele in table_records:
-                table_dict[ele.id] = ele.table_name
+            table_dict = ds_schema.table_names
 
             # get lost table ids
             lost_table_ids = list(set(relation_table_ids) - set(embedding_table_ids))
@@ -507,15 +512,7 @@ def get_table_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDat
                     schema_str += s.get('schema_table')
 
             # get field dict
-            relation_field_ids = []
-            for relation in all_relations:
-                relation_field_ids.append(relation.get('source').get('port'))
-                relation_field_ids.append(relation.get('target').get('port'))
-            relation_field_ids = list(set(relation_field_ids))
-            field_records = session.query(CoreField).filter(CoreField.id.in_(list(map(int, relation_field_ids)))).all()
-            field_dict = {}
-            for ele in field_records:
-                field_dict[ele.id] = ele.field_name
+            field_dict = ds_schema.field_names
 
             if all_relations:
                 schema_str += '【Foreign keys】\n'
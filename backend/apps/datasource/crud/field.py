@@ -1,4 +1,5 @@
 from common.core.deps import SessionDep
+from .schema_cache import SchemaCache
 from ..models.datasource import CoreField
 
 
@@ -17,3 +18,4 @@ def update_field(session: SessionDep, item: CoreField):
     record.custom_comment = item.custom_comment
     session.add(record)
     session.commit()
+    SchemaCache.bump(record.ds_id)
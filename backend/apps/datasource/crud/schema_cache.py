@@ -0,0 +1,77 @@
+import threading
+import time
+from typing import Callable, Optional
+
+from apps.datasource.models.datasource import CoreDatasource, CoreField, CoreTable
+from apps.db.engine_registry import build_fingerprint
+from common.core.config import settings
+
+
+class CachedTable:
+    def __init__(self, table: CoreTable, header: str, fields: list[tuple[CoreField, str]]):
+        # detached copies, entries are shared between requests and threads
+        self.table = table
+        self.header = header
+        self.fields = fields
+        self.schema_table = self.render([f for f, _ in fields])
+
+    def render(self, fields: list[CoreField]) -> str:
+        if len(fields) == len(self.fields):
+            fragments = [fragment for _, fragment in self.fields]
+        else:
+            allowed = {f.id for f in fields}
+            fragments = [fragment for f, fragment in self.fields if f.id in allowed]
+        return self.header + ",\n".join(fragments) + '\n]\n'
+
+
+class DatasourceSchema:
+    """Rendered schema fragments of one datasource, plus the name lookups the relation section needs."""
+
+    def __init__(self, db_name: str, tables: list[CachedTable], table_names: dict[int, str],
+                 field_names: dict[int, str]):
+        self.db_name = db_name
+        self.tables = tables
+        self.table_names = table_names
+        self.field_names = field_names
+        self.version = 0
+        self.fingerprint = ''
+        self.create_time = time.time()
+
+
+_lock = threading.Lock()
+_versions: dict[int, int] = {}
+_schemas: dict[int, DatasourceSchema] = {}
+
+
+class SchemaCache:
+    """
+    Per datasource cache of the schema prompt fragments built by get_table_schema. Every write to the
+    datasource's tables, fields or relations bumps its version; an entry built from an older version, or
+    for a changed connection configuration, is rebuilt on the next read.
+    """
+
+    @staticmethod
+    def get(ds: CoreDatasource, loader: Callable[[], DatasourceSchema]) -> DatasourceSchema:
+        fingerprint = build_fingerprint(ds.type, ds.configuration)
+        with _lock:
+            version = _versions.get(ds.id, 0)
+            schema = _schemas.get(ds.id)
+        if schema is not None and schema.version == version and schema.fingerprint == fingerprint \
+                and time.time() - schema.create_time < settings.SCHEMA_CACHE_TTL:
+            return schema
+        schema = loader()
+        schema.version = version
+        schema.fingerprint = fingerprint
+        with _lock:
+            # a write during the load bumped the version, keep serving this result but do not cache it
+            if _versions.get(ds.id, 0) == version:
+                _schemas[ds.id] = schema
+        return schema
+
+    @staticmethod
+    def bump(ds_id: Optional[int]):
+        if ds_id is None:
+            return
+        with _lock:
+            _versions[ds_id] = _versions.get(ds_id, 0) + 1
+            _schemas.pop(ds_id, None)
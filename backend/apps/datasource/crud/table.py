@@ -1,4 +1,5 @@
 from common.core.deps import SessionDep
+from .schema_cache import SchemaCache
 from ..models.datasource import CoreDatasource, CreateDatasource, CoreTable, CoreField, ColumnSchema
 from sqlalchemy import and_
 
@@ -19,3 +20,4 @@ def update_table(session: SessionDep, item: CoreTable):
     record.custom_comment = item.custom_comment
     session.add(record)
     session.commit()
+    SchemaCache.bump(record.ds_id)
@@ -2,18 +2,38 @@
 # Date: 2025/9/18
 import json
 import traceback
-from typing import Optional
+from typing import List, Optional
 
-from apps.ai_model.embedding import EmbeddingModelCache
+import numpy as np
+from sqlalchemy import select, update
+from sqlalchemy.orm import defer
+from sqlmodel import Session
+
+from apps.ai_model.embedding import EmbeddingModelCache, EmbeddingNotReadyError, QueryEmbeddingCache
+from apps.ai_model.vector_index import VectorIndexCache
 from apps.datasource.crud.datasource import get_table_schema
-from apps.datasource.embedding.utils import cosine_similarity
+from apps.datasource.embedding.table_embedding import get_schema_hash
+from apps.datasource.embedding.utils import batch_cosine_similarity, top_k_indices
 from apps.datasource.models.datasource import CoreDatasource
 from apps.system.crud.assistant import AssistantOutDs
+from common.core.config import settings, TABLE_EMBEDDING_ENABLED
 from common.core.deps import CurrentAssistant
 from common.core.deps import SessionDep, CurrentUser
 from common.utils.utils import SQLBotLogUtil
 
 
+def get_ds_summary(session: SessionDep, current_user: Optional[CurrentUser], ds: CoreDatasource) -> str:
+    table_schema = get_table_schema(session, current_user, ds, '', embedding=False)
+    ds_info = f"{ds.name}, {ds.description}\n"
+    return ds_info + table_schema
+
+
+def load_ds_index_items(session: Session, oid: int):
+    rows = session.execute(select(CoreDatasource.id, CoreDatasource.embedding).where(
+        CoreDatasource.oid == oid, CoreDatasource.embedding.isnot(None))).all()
+    return [(row.id, row.embedding, {}) for row in rows]
+
+
 def get_ds_embedding(session: SessionDep, current_user: CurrentUser, _ds_list, out_ds: AssistantOutDs,
                      question: str,
                      current_assistant: Optional[CurrentAssistant] = None):
@@ -27,27 +47,62 @@ def get_ds_embedding(session: SessionDep, current_user: CurrentUser, _ds_list, o
                 ds_schema = ds_info + table_schema
                 _list.append({"id": ds.id, "ds_schema": ds_schema, "cosine_similarity": 0.0, "ds": ds})
     else:
-        for _ds in _ds_list:
-            if _ds.get('id'):
-                ds = session.get(CoreDatasource, _ds.get('id'))
-                table_schema = get_table_schema(session, current_user, ds, question, embedding=False)
-                ds_info = f"{ds.name}, {ds.description}\n"
-                ds_schema = ds_info + table_schema
-                _list.append({"id": ds.id, "ds_schema": ds_schema, "cosine_similarity": 0.0, "ds": ds})
+        ids = [_ds.get('id') for _ds in _ds_list if _ds.get('id')]
+        if ids:
+            records = session.execute(
+                select(CoreDatasource).where(CoreDatasource.id.in_(ids)).options(defer(CoreDatasource.embedding))
+            ).scalars().all()
+            for ds in records:
+                ds_schema = get_ds_summary(session, current_user, ds)
+                _list.append({"id": ds.id, "ds_schema": ds_schema, "cosine_similarity": 0.0, "ds": ds,
+                              "stored": ds.embedding_hash == get_schema_hash(ds_schema)})
 
     if _list:
         try:
-            text = [s.get('ds_schema') for s in _list]
-
-            model = EmbeddingModelCache.get_model()
-            results = model.embed_documents(text)
+            model = EmbeddingModelCache.get_ready_model()
+            q_embedding = QueryEmbeddingCache.embed(question)
 
-            q_embedding = model.embed_query(question)
-            for index in range(len(results)):
-                item = results[index]
-                _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, item)
+            # summaries persisted for the current text are ranked by pgvector (or the in-process index),
+            # the rest are embedded here
+            stored_ids = [s.get('id') for s in _list if s.get('stored')]
+            missing = [s for s in _list if not s.get('stored')]
+            scored = []
+            if stored_ids and VectorIndexCache.enabled():
+                by_id = {s.get('id'): s for s in _list}
+                allowed = set(stored_ids)
+                for oid in {by_id[_id].get('ds').oid for _id in stored_ids}:
+                    index = VectorIndexCache.get('datasource', oid,
+                                                 lambda oid=oid: load_ds_index_items(session, oid))
+                    # saved by another worker after this index was loaded, score it like an unsaved one
+                    in_index = index.get(allowed).keys()
+                    missing.extend(by_id[_id] for _id in stored_ids
+                                   if _id not in in_index and by_id[_id].get('ds').oid == oid)
+                    hits = index.search(q_embedding, settings.DATASOURCE_EMBEDDING_TOP_COUNT,
+                                        predicate=lambda _id, payload: _id in allowed)
+                    for _id, score, _ in hits:
+                        by_id[_id]['cosine_similarity'] = score
+                        scored.append(by_id[_id])
+            elif stored_ids:
+                distance = CoreDatasource.embedding.cosine_distance(q_embedding)
+                rows = session.execute(
+                    select(CoreDatasource.id, (1 - distance).label('similarity')).where(
+                        CoreDatasource.id.in_(stored_ids)).order_by(distance).limit(
+                        settings.DATASOURCE_EMBEDDING_TOP_COUNT)).all()
+                by_id = {s.get('id'): s for s in _list}
+                for row in rows:
+                    by_id[row.id]['cosine_similarity'] = float(row.similarity)
+                    scored.append(by_id[row.id])
+            if missing:
+                results = model.embed_documents([s.get('ds_schema') for s in missing])
+                scores = batch_cosine_similarity(q_embedding, results)
+                for item, score in zip(missing, scores):
+                    item['cosine_similarity'] = float(score)
+                    scored.append(item)
+            for item in scored:
+                item.pop('stored', None)
 
-            _list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
+            scores = np.asarray([item['cosine_similarity'] for item in scored], dtype=np.float32)
+            _list = [scored[index] for index in top_k_indices(scores, settings.DATASOURCE_EMBEDDING_TOP_COUNT)]
             # print(len(_list))
             SQLBotLogUtil.info(json.dumps(
                 [{"id": ele.get("id"), "name": ele.get("ds").name, "cosine_similarity": ele.get("cosine_similarity")}
@@ -61,6 +116,48 @@ def get_ds_embedding(session: SessionDep, current_user: CurrentUser, _ds_list, o
                 "cosine_similarity": max_score,
                 "all_scores": _list
             }
+        except EmbeddingNotReadyError as e:
+            SQLBotLogUtil.info(f"Datasource embedding skipped: {e}")
         except Exception:
             traceback.print_exc()
+            session.rollback()
     return None
+
+
+def run_fill_empty_ds_embeddings(session: Session):
+    if not settings.EMBEDDING_ENABLED or not TABLE_EMBEDDING_ENABLED:
+        return
+    ds_ids = session.execute(select(CoreDatasource.id)).scalars().all()
+    save_ds_embeddings(session, ds_ids)
+
+
+def save_ds_embeddings(session: Session, ds_ids: List[int]):
+    """Re-embed the summary of each datasource whose name, description or schema changed since the last run."""
+    if not settings.EMBEDDING_ENABLED or not TABLE_EMBEDDING_ENABLED:
+        return
+    try:
+        changed = []
+        for ds_id in ds_ids or []:
+            ds = session.get(CoreDatasource, ds_id)
+            if not ds:
+                continue
+            ds_schema = get_ds_summary(session, None, ds)
+            _hash = get_schema_hash(ds_schema)
+            if ds.embedding_hash != _hash:
+                changed.append((ds_id, ds_schema, _hash, ds.oid))
+        if not changed:
+            return
+
+        model = EmbeddingModelCache.get_model()
+        results = model.embed_documents([item[1] for item in changed])
+        for (ds_id, _, _hash, _), embedding in zip(changed, results):
+            stmt = update(CoreDatasource).where(CoreDatasource.id == ds_id).values(embedding=embedding,
+                                                                                  embedding_hash=_hash)
+            session.execute(stmt)
+        session.commit()
+        for (ds_id, _, _, oid), embedding in zip(changed, results):
+            VectorIndexCache.upsert('datasource', oid, [(ds_id, embedding, {})])
+        SQLBotLogUtil.info(f"Saved {len(changed)} datasource embeddings")
+    except Exception:
+        session.rollback()
+        raise
@@ -1,41 +1,140 @@
 # Author: Junjun
 # Date: 2025/9/23
+import hashlib
 import json
 import time
 import traceback
+from typing import List, Optional
 
-from apps.ai_model.embedding import EmbeddingModelCache
-from apps.datasource.embedding.utils import cosine_similarity
-from common.core.config import settings
+from sqlalchemy import select, update
+from sqlmodel import Session
+
+from apps.ai_model.embedding import EmbeddingModelCache, EmbeddingNotReadyError, QueryEmbeddingCache
+from apps.ai_model.vector_index import VectorIndexCache
+from apps.datasource.embedding.utils import batch_cosine_similarity, top_k_indices
+from apps.datasource.models.datasource import CoreDatasource, CoreTable
+from common.core.config import settings, TABLE_EMBEDDING_ENABLED
 from common.core.deps import SessionDep, CurrentUser
 from common.utils.utils import SQLBotLogUtil
 
 
-def get_table_embedding(session: SessionDep, current_user: CurrentUser, tables: list[dict], question: str):
+def get_schema_hash(schema_table: str) -> str:
+    # the model is part of the hash, switching models re-embeds everything
+    return hashlib.sha256(f"{settings.DEFAULT_EMBEDDING_MODEL}\n{schema_table}".encode('utf-8')).hexdigest()
+
+
+def load_table_index_items(session: Session, ds_id: int):
+    rows = session.execute(select(CoreTable.id, CoreTable.embedding, CoreTable.embedding_hash).where(
+        CoreTable.ds_id == ds_id, CoreTable.embedding.isnot(None))).all()
+    return [(row.id, row.embedding, {'hash': row.embedding_hash}) for row in rows]
+
+
+def get_table_embedding(session: SessionDep, current_user: CurrentUser, tables: list[dict], question: str,
+                        ds_id: Optional[int] = None):
     _list = []
     for table in tables:
         _list.append({"id": table.get('id'), "schema_table": table.get('schema_table'), "cosine_similarity": 0.0})
 
     if _list:
         try:
-            text = [s.get('schema_table') for s in _list]
+            # stored embeddings are only valid for the exact schema text they were computed from,
+            # tables trimmed by column permissions or edited since the last refresh are embedded here
+            stored = {}
+            table_ids = [s.get('id') for s in _list]
+            if VectorIndexCache.enabled() and ds_id is not None:
+                index = VectorIndexCache.get('table', ds_id, lambda: load_table_index_items(session, ds_id))
+                for table_id, (vector, payload) in index.get(table_ids).items():
+                    stored[table_id] = (payload.get('hash'), vector)
+            else:
+                rows = session.execute(select(CoreTable.id, CoreTable.embedding, CoreTable.embedding_hash).where(
+                    CoreTable.id.in_(table_ids))).all()
+                for row in rows:
+                    if row.embedding is not None:
+                        stored[row.id] = (row.embedding_hash, row.embedding)
 
-            model = EmbeddingModelCache.get_model()
+            embeddings = [None] * len(_list)
+            missing = []
+            for index, s in enumerate(_list):
+                entry = stored.get(s.get('id'))
+                if entry and entry[0] == get_schema_hash(s.get('schema_table')):
+                    embeddings[index] = entry[1]
+                else:
+                    missing.append(index)
+
+            model = EmbeddingModelCache.get_ready_model()
             start_time = time.time()
-            results = model.embed_documents(text)
+            if missing:
+                results = model.embed_documents([_list[index].get('schema_table') for index in missing])
+                for index, item in zip(missing, results):
+                    embeddings[index] = item
+            q_embedding = QueryEmbeddingCache.embed(question)
             end_time = time.time()
-            SQLBotLogUtil.info(str(end_time - start_time))
-
-            q_embedding = model.embed_query(question)
-            for index in range(len(results)):
-                item = results[index]
-                _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, item)
+            SQLBotLogUtil.info(f"table embedding: {len(_list) - len(missing)} stored, {len(missing)} computed, "
+                               f"{end_time - start_time:.3f}s")
 
-            _list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
-            _list = _list[:settings.TABLE_EMBEDDING_COUNT]
+            scores = batch_cosine_similarity(q_embedding, embeddings)
+            top = top_k_indices(scores, settings.TABLE_EMBEDDING_COUNT)
+            for index in top:
+                _list[index]['cosine_similarity'] = float(scores[index])
+            _list = [_list[index] for index in top]
             # print(len(_list))
             SQLBotLogUtil.info(json.dumps(_list))
             return _list
+        except EmbeddingNotReadyError as e:
+            SQLBotLogUtil.info(f"Table embedding skipped, all tables are sent: {e}")
         except Exception:
             traceback.print_exc()
+            session.rollback()
     return _list
+
+
+def run_fill_empty_table_embeddings(session: Session):
+    if not settings.EMBEDDING_ENABLED or not TABLE_EMBEDDING_ENABLED:
+        return
+    ds_ids = session.execute(select(CoreTable.ds_id).distinct()).scalars().all()
+    save_table_embeddings(session, ds_ids)
+
+
+def save_table_embeddings(session: Session, ds_ids: List[int]):
+    """Embed the schema text of every table whose rendered schema changed since it was last embedded."""
+    if not settings.EMBEDDING_ENABLED or not TABLE_EMBEDDING_ENABLED:
+        return
+
+    from apps.datasource.crud.datasource import load_ds_schema
+    from apps.datasource.crud.schema_cache import SchemaCache
+
+    failed = []
+    for ds_id in ds_ids or []:
+        try:
+            ds = session.get(CoreDatasource, ds_id)
+            if not ds:
+                continue
+            ds_schema = SchemaCache.get(ds, lambda ds=ds: load_ds_schema(session, ds))
+            stored = dict(session.execute(
+                select(CoreTable.id, CoreTable.embedding_hash).where(CoreTable.ds_id == ds_id)).all())
+
+            changed = []
+            for cached in ds_schema.tables:
+                _hash = get_schema_hash(cached.schema_table)
+                if stored.get(cached.table.id) != _hash:
+                    changed.append((cached.table.id, cached.schema_table, _hash))
+            if not changed:
+                continue
+
+            model = EmbeddingModelCache.get_model()
+            results = model.embed_documents([item[1] for item in changed])
+            for (table_id, _, _hash), embedding in zip(changed, results):
+                stmt = update(CoreTable).where(CoreTable.id == table_id).values(embedding=embedding,
+                                                                                embedding_hash=_hash)
+                session.execute(stmt)
+            session.commit()
+            VectorIndexCache.upsert('table', ds_id, [(table_id, embedding, {'hash': _hash}) for
+                                                     (table_id, _, _hash), embedding in zip(changed, results)])
+            SQLBotLogUtil.info(f"Saved {len(changed)} table embeddings of datasource {ds_id}")
+        except Exception:
+            traceback.print_exc()
+            session.rollback()
+            failed.append(ds_id)
+    if failed:
+        # one broken datasource does not hold back the others, the job is retried for all of them
+        raise RuntimeError(f"table embeddings failed for datasources {failed}")
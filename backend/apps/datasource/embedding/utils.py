@@ -1,18 +1,36 @@
 # Author: Junjun
 # Date: 2025/9/23
-import math
+from typing import Optional, Sequence
+
+import numpy as np
 
 
 def cosine_similarity(vec_a, vec_b):
     if len(vec_a) != len(vec_b):
         raise ValueError("The vector dimension must be the same")
+    return float(batch_cosine_similarity(vec_a, [vec_b])[0])
 
-    dot_product = sum(a * b for a, b in zip(vec_a, vec_b))
 
-    norm_a = math.sqrt(sum(a * a for a in vec_a))
-    norm_b = math.sqrt(sum(b * b for b in vec_b))
+def batch_cosine_similarity(query: Sequence[float], candidates: Sequence[Sequence[float]]) -> np.ndarray:
+    """Scores every candidate against the query with one matrix product."""
+    if len(candidates) == 0:
+        return np.zeros(0, dtype=np.float32)
+    matrix = np.asarray(candidates, dtype=np.float32)
+    q = np.asarray(query, dtype=np.float32)
+    if matrix.shape[1] != q.shape[0]:
+        raise ValueError("The vector dimension must be the same")
+    scores = matrix @ q
+    # the embedding model normalizes its output, the division only matters for vectors from elsewhere
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(q)
+    return np.divide(scores, norms, out=np.zeros_like(scores), where=norms != 0)
 
-    if norm_a == 0 or norm_b == 0:
-        return 0.0
 
-    return dot_product / (norm_a * norm_b)
+def top_k_indices(scores: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+    """Indices of the k highest scores, best first; argpartition keeps this linear in the candidate count."""
+    n = len(scores)
+    if k is None or k >= n:
+        return np.argsort(-scores, kind='stable')
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind='stable')]
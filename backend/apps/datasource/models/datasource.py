@@ -1,6 +1,7 @@
 from datetime import datetime
 from typing import List, Optional
 
+from pgvector.sqlalchemy import VECTOR
 from pydantic import BaseModel
 from sqlalchemy import Column, Text, BigInteger, DateTime, Identity
 from sqlalchemy.dialects.postgresql import JSONB
@@ -21,6 +22,9 @@ class CoreDatasource(SQLModel, table=True):
     num: str = Field(max_length=256, nullable=True)
     oid: int = Field(sa_column=Column(BigInteger()))
     table_relation: List = Field(sa_column=Column(JSONB, nullable=True))
+    # summary (name, description, schema) embedding for datasource auto-selection
+    embedding: Optional[List[float]] = Field(sa_column=Column(VECTOR(), nullable=True), exclude=True)
+    embedding_hash: Optional[str] = Field(max_length=64, nullable=True, exclude=True)
 
 
 class CoreTable(SQLModel, table=True):
@@ -31,6 +35,9 @@ class CoreTable(SQLModel, table=True):
     table_name: str = Field(sa_column=Column(Text))
     table_comment: str = Field(sa_column=Column(Text))
     custom_comment: str = Field(sa_column=Column(Text))
+    # schema text embedding, refreshed when embedding_hash no longer matches the rendered schema
+    embedding: Optional[List[float]] = Field(sa_column=Column(VECTOR(), nullable=True), exclude=True)
+    embedding_hash: Optional[str] = Field(max_length=64, nullable=True, exclude=True)
 
 
 class CoreField(SQLModel, table=True):
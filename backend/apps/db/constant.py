@@ -12,25 +12,35 @@ class ConnectType(Enum):
         self.type_name = type_name
 
 
+class LimitStyle(Enum):
+    limit = ('limit')  # ... LIMIT n
+    top = ('top')  # SELECT TOP n ...
+    fetch_first = ('fetch_first')  # ... FETCH FIRST n ROWS ONLY
+
+    def __init__(self, style_name):
+        self.style_name = style_name
+
+
 class DB(Enum):
-    mysql = ('mysql', 'MySQL', '`', '`', ConnectType.sqlalchemy)
-    sqlServer = ('sqlServer', 'Microsoft SQL Server', '[', ']', ConnectType.sqlalchemy)
-    pg = ('pg', 'PostgreSQL', '"', '"', ConnectType.sqlalchemy)
-    excel = ('excel', 'Excel/CSV', '"', '"', ConnectType.sqlalchemy)
-    oracle = ('oracle', 'Oracle', '"', '"', ConnectType.sqlalchemy)
-    ck = ('ck', 'ClickHouse', '"', '"', ConnectType.sqlalchemy)
-    dm = ('dm', '达梦', '"', '"', ConnectType.py_driver)
-    doris = ('doris', 'Apache Doris', '`', '`', ConnectType.py_driver)
-    redshift = ('redshift', 'AWS Redshift', '"', '"', ConnectType.py_driver)
-    es = ('es', 'Elasticsearch', '"', '"', ConnectType.py_driver)
-    kingbase = ('kingbase', 'Kingbase', '"', '"', ConnectType.py_driver)
-
-    def __init__(self, type, db_name, prefix, suffix, connect_type: ConnectType):
+    mysql = ('mysql', 'MySQL', '`', '`', ConnectType.sqlalchemy, LimitStyle.limit)
+    sqlServer = ('sqlServer', 'Microsoft SQL Server', '[', ']', ConnectType.sqlalchemy, LimitStyle.top)
+    pg = ('pg', 'PostgreSQL', '"', '"', ConnectType.sqlalchemy, LimitStyle.limit)
+    excel = ('excel', 'Excel/CSV', '"', '"', ConnectType.sqlalchemy, LimitStyle.limit)
+    oracle = ('oracle', 'Oracle', '"', '"', ConnectType.sqlalchemy, LimitStyle.fetch_first)
+    ck = ('ck', 'ClickHouse', '"', '"', ConnectType.sqlalchemy, LimitStyle.limit)
+    dm = ('dm', '达梦', '"', '"', ConnectType.py_driver, LimitStyle.limit)
+    doris = ('doris', 'Apache Doris', '`', '`', ConnectType.py_driver, LimitStyle.limit)
+    redshift = ('redshift', 'AWS Redshift', '"', '"', ConnectType.py_driver, LimitStyle.limit)
+    es = ('es', 'Elasticsearch', '"', '"', ConnectType.py_driver, LimitStyle.limit)
+    kingbase = ('kingbase', 'Kingbase', '"', '"', ConnectType.py_driver, LimitStyle.limit)
+
+    def __init__(self, type, db_name, prefix, suffix, connect_type: ConnectType, limit_style: LimitStyle):
         self.type = type
         self.db_name = db_name
         self.prefix = prefix
         self.suffix = suffix
         self.connect_type = connect_type
+        self.limit_style = limit_style
 
     @classmethod
     def get_db(cls, type):
@@ -1,8 +1,8 @@
-import base64
 import json
 import platform
+import time
 import urllib.parse
-from decimal import Decimal
+from contextlib import contextmanager
 from typing import Optional
 
 import psycopg2
@@ -26,8 +26,14 @@ from apps.datasource.models.datasource import DatasourceConf, CoreDatasource, Ta
 from apps.datasource.utils.utils import aes_decrypt
 from apps.db.constant import DB, ConnectType
 from apps.db.engine import get_engine_config
+from apps.db.driver_pool import DriverConnectionPool
+from apps.db.engine_registry import DatasourceEngineCache, build_fingerprint, pool_kwargs
+from apps.db.query_control import QueryCancelToken, apply_query_settings, cancel_connection, classify_query_error, \
+    get_statement_timeout_sql
+from apps.db.result_set import fetch_columnar, fetch_columnar_from_rows
 from apps.system.crud.assistant import get_ds_engine
 from apps.system.schemas.system_schema import AssistantOutDsSchema
+from common.core.config import settings
 from common.core.deps import Trans
 from common.utils.utils import SQLBotLogUtil
 from fastapi import HTTPException
@@ -107,6 +113,15 @@ def get_origin_connect(type: str, conf: DatasourceConf):
 
 # use sqlalchemy
 def get_engine(ds: CoreDatasource, timeout: int = 0) -> Engine:
+    # unsaved datasource (e.g. connection test from the edit form), do not register it
+    if ds.id is None:
+        return create_ds_engine(ds, timeout)
+    key = f"ds:{ds.id}" if timeout <= 0 else f"ds:{ds.id}:t{timeout}"
+    fingerprint = build_fingerprint(ds.type, ds.configuration)
+    return DatasourceEngineCache.get_engine(key, fingerprint, lambda: create_ds_engine(ds, timeout))
+
+
+def create_ds_engine(ds: CoreDatasource, timeout: int = 0) -> Engine:
     conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if ds.type != "excel" else get_engine_config()
     if conf.timeout is None:
         conf.timeout = timeout
@@ -117,19 +132,20 @@ def get_engine(ds: CoreDatasource, timeout: int = 0) -> Engine:
             engine = create_engine(get_uri(ds),
                                    connect_args={"options": f"-c search_path={urllib.parse.quote(conf.dbSchema)}",
                                                  "connect_timeout": conf.timeout},
-                                   pool_timeout=conf.timeout)
+                                   pool_timeout=conf.timeout, **pool_kwargs())
         else:
             engine = create_engine(get_uri(ds),
                                    connect_args={"connect_timeout": conf.timeout},
-                                   pool_timeout=conf.timeout)
+                                   pool_timeout=conf.timeout, **pool_kwargs())
     elif ds.type == 'sqlServer':
         engine = create_engine('mssql+pymssql://', creator=lambda: get_origin_connect(ds.type, conf),
-                               pool_timeout=conf.timeout)
+                               pool_timeout=conf.timeout, **pool_kwargs())
     elif ds.type == 'oracle':
         engine = create_engine(get_uri(ds),
-                               pool_timeout=conf.timeout)
+                               pool_timeout=conf.timeout, **pool_kwargs())
     else:  # mysql, ck
-        engine = create_engine(get_uri(ds), connect_args={"connect_timeout": conf.timeout}, pool_timeout=conf.timeout)
+        engine = create_engine(get_uri(ds), connect_args={"connect_timeout": conf.timeout}, pool_timeout=conf.timeout,
+                               **pool_kwargs())
     return engine
 
 
@@ -140,6 +156,55 @@ def get_session(ds: CoreDatasource | AssistantOutDsSchema):
     return session
 
 
+def get_driver_connect(type: str, conf: DatasourceConf):
+    extra_config_dict = get_extra_config(conf)
+    if type == 'dm':
+        return dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
+                                port=conf.port, **extra_config_dict)
+    elif type == 'doris':
+        return pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
+                               port=conf.port, db=conf.database, connect_timeout=conf.timeout,
+                               read_timeout=conf.timeout, **extra_config_dict)
+    elif type == 'redshift':
+        return redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
+                                          password=conf.password,
+                                          timeout=conf.timeout, **extra_config_dict)
+    elif type == 'kingbase':
+        return psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
+                                password=conf.password,
+                                connect_timeout=conf.timeout,
+                                options=f"-c statement_timeout={conf.timeout * 1000}",
+                                **extra_config_dict)
+    raise Exception(f'The datasource type {type} not support py_driver connection.')
+
+
+def get_driver_pool(ds: CoreDatasource | AssistantOutDsSchema, conf: DatasourceConf) -> DriverConnectionPool:
+    prefix = 'ds' if isinstance(ds, CoreDatasource) else 'assistant'
+    key = f"{prefix}:{ds.id}:driver"
+    fingerprint = build_fingerprint(ds.type, conf.host, conf.port, conf.username, conf.password, conf.database,
+                                    conf.dbSchema, conf.extraJdbc, conf.timeout)
+    return DatasourceEngineCache.get_engine(key, fingerprint, lambda: DriverConnectionPool(
+        key, lambda: get_driver_connect(ds.type, conf),
+        max_size=settings.DS_DRIVER_POOL_MAX_SIZE,
+        timeout=conf.timeout,
+        idle_timeout=settings.DS_DRIVER_IDLE_TIMEOUT,
+        pre_ping=settings.DS_POOL_PRE_PING))
+
+
+@contextmanager
+def get_driver_connection(ds: CoreDatasource | AssistantOutDsSchema, conf: DatasourceConf):
+    # unsaved datasource (e.g. connection test from the edit form), use a throwaway connection
+    if ds.id is None:
+        conn = get_driver_connect(ds.type, conf)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    else:
+        with get_driver_pool(ds, conf).connection() as conn:
+            yield conn
+
+
 def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDsSchema, is_raise: bool = False):
     if isinstance(ds, CoreDatasource):
         db = DB.get_db(ds.type)
@@ -156,61 +221,7 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                 return False
         else:
             conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
-            extra_config_dict = get_extra_config(conf)
-            if ds.type == 'dm':
-                with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                      port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
-                    try:
-                        cursor.execute('select 1', timeout=10).fetchall()
-                        SQLBotLogUtil.info("success")
-                        return True
-                    except Exception as e:
-                        SQLBotLogUtil.error(f"Datasource {ds.id} connection failed: {e}")
-                        if is_raise:
-                            raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
-                        return False
-            elif ds.type == 'doris':
-                with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                     port=conf.port, db=conf.database, connect_timeout=10,
-                                     read_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
-                    try:
-                        cursor.execute('select 1')
-                        SQLBotLogUtil.info("success")
-                        return True
-                    except Exception as e:
-                        SQLBotLogUtil.error(f"Datasource {ds.id} connection failed: {e}")
-                        if is_raise:
-                            raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
-                        return False
-            elif ds.type == 'redshift':
-                with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database,
-                                                user=conf.username,
-                                                password=conf.password,
-                                                timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
-                    try:
-                        cursor.execute('select 1')
-                        SQLBotLogUtil.info("success")
-                        return True
-                    except Exception as e:
-                        SQLBotLogUtil.error(f"Datasource {ds.id} connection failed: {e}")
-                        if is_raise:
-                            raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
-                        return False
-            elif ds.type == 'kingbase':
-                with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database,
-                                      user=conf.username,
-                                      password=conf.password,
-                                      connect_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
-                    try:
-                        cursor.execute('select 1')
-                        SQLBotLogUtil.info("success")
-                        return True
-                    except Exception as e:
-                        SQLBotLogUtil.error(f"Datasource {ds.id} connection failed: {e}")
-                        if is_raise:
-                            raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
-                        return False
-            elif ds.type == 'es':
+            if ds.type == 'es':
                 es_conn = get_es_connect(conf)
                 if es_conn.ping():
                     SQLBotLogUtil.info("success")
@@ -218,6 +229,19 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                 else:
                     SQLBotLogUtil.info("failed")
                     return False
+            try:
+                with get_driver_connection(ds, conf) as conn, conn.cursor() as cursor:
+                    if ds.type == 'dm':
+                        cursor.execute('select 1', timeout=10).fetchall()
+                    else:
+                        cursor.execute('select 1')
+                    SQLBotLogUtil.info("success")
+                    return True
+            except Exception as e:
+                SQLBotLogUtil.error(f"Datasource {ds.id} connection failed: {e}")
+                if is_raise:
+                    raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
+                return False
     else:
         conn = get_ds_engine(ds)
         try:
@@ -257,17 +281,13 @@ def get_version(ds: CoreDatasource | AssistantOutDsSchema):
                     res = result.fetchall()
                     version = res[0][0]
         else:
-            extra_config_dict = get_extra_config(conf)
             if ds.type == 'dm':
-                with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                      port=conf.port) as conn, conn.cursor() as cursor:
-                    cursor.execute(sql, timeout=10, **extra_config_dict)
+                with get_driver_connection(ds, conf) as conn, conn.cursor() as cursor:
+                    cursor.execute(sql, timeout=10)
                     res = cursor.fetchall()
                     version = res[0][0]
             elif ds.type == 'doris':
-                with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                     port=conf.port, db=conf.database, connect_timeout=10,
-                                     read_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+                with get_driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                     cursor.execute(sql)
                     res = cursor.fetchall()
                     version = res[0][0]
@@ -296,27 +316,14 @@ def get_schema(ds: CoreDatasource):
                 res_list = [item[0] for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
         if ds.type == 'dm':
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute("""select OBJECT_NAME from dba_objects where object_type='SCH'""", timeout=conf.timeout)
                 res = cursor.fetchall()
                 res_list = [item[0] for item in res]
                 return res_list
-        elif ds.type == 'redshift':
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute("""SELECT nspname FROM pg_namespace""")
-                res = cursor.fetchall()
-                res_list = [item[0] for item in res]
-                return res_list
-        elif ds.type == 'kingbase':
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+        elif ds.type == 'redshift' or ds.type == 'kingbase':
+            with get_driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute("""SELECT nspname FROM pg_namespace""")
                 res = cursor.fetchall()
                 res_list = [item[0] for item in res]
@@ -334,41 +341,18 @@ def get_tables(ds: CoreDatasource):
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
-        if ds.type == 'dm':
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+        if ds.type == 'es':
+            res = get_es_index(conf)
+            res_list = [TableSchema(*item) for item in res]
+            return res_list
+        with get_driver_connection(ds, conf) as conn, conn.cursor() as cursor:
+            if ds.type == 'dm':
                 cursor.execute(sql, {"param": sql_param}, timeout=conf.timeout)
-                res = cursor.fetchall()
-                res_list = [TableSchema(*item) for item in res]
-                return res_list
-        elif ds.type == 'doris':
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            elif ds.type == 'doris' or ds.type == 'redshift':
                 cursor.execute(sql, (sql_param,))
-                res = cursor.fetchall()
-                res_list = [TableSchema(*item) for item in res]
-                return res_list
-        elif ds.type == 'redshift':
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute(sql, (sql_param,))
-                res = cursor.fetchall()
-                res_list = [TableSchema(*item) for item in res]
-                return res_list
-        elif ds.type == 'kingbase':
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+            elif ds.type == 'kingbase':
                 cursor.execute(sql.format(sql_param))
-                res = cursor.fetchall()
-                res_list = [TableSchema(*item) for item in res]
-                return res_list
-        elif ds.type == 'es':
-            res = get_es_index(conf)
+            res = cursor.fetchall()
             res_list = [TableSchema(*item) for item in res]
             return res_list
 
@@ -384,46 +368,24 @@ def get_fields(ds: CoreDatasource, table_name: str = None):
                 res_list = [ColumnSchema(*item) for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
-        if ds.type == 'dm':
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+        if ds.type == 'es':
+            res = get_es_fields(conf, table_name)
+            res_list = [ColumnSchema(*item) for item in res]
+            return res_list
+        with get_driver_connection(ds, conf) as conn, conn.cursor() as cursor:
+            if ds.type == 'dm':
                 cursor.execute(sql, {"param1": p1, "param2": p2}, timeout=conf.timeout)
-                res = cursor.fetchall()
-                res_list = [ColumnSchema(*item) for item in res]
-                return res_list
-        elif ds.type == 'doris':
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute(sql, (p1, p2))
-                res = cursor.fetchall()
-                res_list = [ColumnSchema(*item) for item in res]
-                return res_list
-        elif ds.type == 'redshift':
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            elif ds.type == 'doris' or ds.type == 'redshift':
                 cursor.execute(sql, (p1, p2))
-                res = cursor.fetchall()
-                res_list = [ColumnSchema(*item) for item in res]
-                return res_list
-        elif ds.type == 'kingbase':
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+            elif ds.type == 'kingbase':
                 cursor.execute(sql.format(p1, p2))
-                res = cursor.fetchall()
-                res_list = [ColumnSchema(*item) for item in res]
-                return res_list
-        elif ds.type == 'es':
-            res = get_es_fields(conf, table_name)
+            res = cursor.fetchall()
             res_list = [ColumnSchema(*item) for item in res]
             return res_list
 
 
-def exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False):
+def exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False, max_rows: Optional[int] = None,
+             columnar: bool = False, timeout: Optional[int] = None, cancel_token: Optional[QueryCancelToken] = None):
     # 清理SQL语句
     sql = sql.strip()
     
@@ -448,113 +410,106 @@ def exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=
     if not sql.strip():
         raise ParseSQLResultError("SQL query is empty after cleaning")
 
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
     db = DB.get_db(ds.type)
+    batch_size = settings.SQL_FETCH_BATCH_SIZE
+    started = time.time()
+    sql = apply_query_settings(ds.type, sql, timeout)
     if db.connect_type == ConnectType.sqlalchemy:
         with get_session(ds) as session:
-            with session.execute(text(sql)) as result:
-                try:
-                    columns = result.keys()._keys if origin_column else [item.lower() for item in result.keys()._keys]
-                    res = result.fetchall()
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
+            dbapi_conn = session.connection().connection.driver_connection
+            kill = _get_kill_query(ds, dbapi_conn, session.get_bind())
+            try:
+                timeout_sql = get_statement_timeout_sql(ds.type, timeout)
+                if timeout_sql:
+                    session.execute(text(timeout_sql))
+                if ds.type == 'oracle' and timeout:
+                    dbapi_conn.call_timeout = timeout * 1000
+                if cancel_token is not None:
+                    cancel_token.bind(kill or (lambda: cancel_connection(dbapi_conn)))
+                statement = text(sql)
+                if max_rows is not None:
+                    # server side cursor where the dialect supports it, rows beyond the cap are never transferred
+                    statement = statement.execution_options(stream_results=True)
+                with session.execute(statement) as result:
+                    try:
+                        columns = result.keys()._keys if origin_column else [item.lower() for item in
+                                                                             result.keys()._keys]
+                        res = fetch_columnar(result.fetchmany, columns, sql, max_rows, batch_size)
+                        return res if columnar else res.to_dict()
+                    except Exception as ex:
+                        raise ParseSQLResultError(str(ex))
+            except Exception as ex:
+                raise classify_query_error(ex, timeout, started, cancel_token)
+            finally:
+                if cancel_token is not None:
+                    cancel_token.unbind()
+                if ds.type == 'oracle' and timeout:
+                    dbapi_conn.call_timeout = 0
     else:
         conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
-        extra_config_dict = get_extra_config(conf)
-        if ds.type == 'dm':
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute(sql, timeout=conf.timeout)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
-        elif ds.type == 'doris':
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute(sql)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
-        elif ds.type == 'redshift':
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute(sql)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
-        elif ds.type == 'kingbase':
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute(sql)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
-        elif ds.type == 'es':
+        if ds.type == 'es':
             try:
-                res, columns = get_es_data_by_http(conf, sql)
+                rows, columns = get_es_data_by_http(conf, sql, timeout)
                 columns = [field.get('name') for field in columns] if origin_column else [field.get('name').lower() for
                                                                                           field in
                                                                                           columns]
-                result_list = [
-                    {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                     enumerate(tuple(tuple_item))}
-                    for tuple_item in res
-                ]
-                return {"fields": columns, "data": result_list,
-                        "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                res = fetch_columnar_from_rows(rows, columns, sql, max_rows, batch_size)
+                return res if columnar else res.to_dict()
             except Exception as ex:
+                error = classify_query_error(ex, timeout, started, cancel_token)
+                if error is not ex:
+                    raise error
                 raise Exception(str(ex))
+        with get_driver_connection(ds, conf) as conn, conn.cursor() as cursor:
+            kill = _get_kill_query(ds, conn, conf=conf)
+            try:
+                timeout_sql = get_statement_timeout_sql(ds.type, timeout)
+                if timeout_sql:
+                    cursor.execute(timeout_sql)
+                if cancel_token is not None:
+                    cancel_token.bind(kill or (lambda: cancel_connection(conn)))
+                if ds.type == 'dm':
+                    cursor.execute(sql, timeout=timeout or conf.timeout)
+                else:
+                    cursor.execute(sql)
+                columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
+                                                                                            field in
+                                                                                            cursor.description]
+                res = fetch_columnar(cursor.fetchmany, columns, sql, max_rows, batch_size)
+                return res if columnar else res.to_dict()
+            except Exception as ex:
+                error = classify_query_error(ex, timeout, started, cancel_token)
+                if error is not ex:
+                    raise error
+                raise ParseSQLResultError(str(ex))
+            finally:
+                if cancel_token is not None:
+                    cancel_token.unbind()
+
+
+def _get_kill_query(ds: CoreDatasource | AssistantOutDsSchema, dbapi_conn, engine: Engine = None,
+                    conf: DatasourceConf = None):
+    """
+    mysql/doris can only stop a running statement from another connection, capture the thread id up front
+    so the canceller never touches the busy connection.
+    """
+    if ds.type not in ('mysql', 'doris'):
+        return None
+    thread_id = dbapi_conn.thread_id()
+
+    def kill():
+        if engine is not None:
+            with engine.connect() as kill_conn:
+                kill_conn.execute(text(f'KILL QUERY {thread_id}'))
+        else:
+            kill_conn = get_driver_connect(ds.type, conf)
+            try:
+                with kill_conn.cursor() as cursor:
+                    cursor.execute(f'KILL QUERY {thread_id}')
+            finally:
+                kill_conn.close()
+
+    return kill
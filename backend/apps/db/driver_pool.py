@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable
+
+from common.error import SQLBotDBConnectionError
+from common.utils.utils import SQLBotLogUtil
+
+
+class DriverConnectionPool:
+    """
+    Thread-safe pool of raw DB-API connections for py_driver datasources (dm, doris, redshift, kingbase).
+    Exposes the same status/size/checkedin/checkedout/overflow/dispose surface as a SQLAlchemy pool,
+    so it can live in DatasourceEngineCache next to the engines.
+    """
+
+    def __init__(self, key: str, creator: Callable[[], Any], max_size: int = 10, timeout: int = 30,
+                 idle_timeout: int = 300, pre_ping: bool = True, ping_sql: str = 'select 1'):
+        self.key = key
+        self._creator = creator
+        self._max_size = max(1, max_size)
+        self._timeout = timeout
+        self._idle_timeout = idle_timeout
+        self._pre_ping = pre_ping
+        self._ping_sql = ping_sql
+        self._idle: deque = deque()  # (connection, last_used)
+        self._opened = 0
+        self._checked_out = 0
+        self._disposed = False
+        self._cond = threading.Condition()
+
+    def status(self) -> str:
+        return (f"Pool size: {self._max_size}  Connections in pool: {len(self._idle)} "
+                f"Current checked out connections: {self._checked_out}")
+
+    def size(self) -> int:
+        return self._max_size
+
+    def checkedin(self) -> int:
+        return len(self._idle)
+
+    def checkedout(self) -> int:
+        return self._checked_out
+
+    def overflow(self) -> int:
+        return 0
+
+    def acquire(self):
+        deadline = time.time() + self._timeout if self._timeout and self._timeout > 0 else None
+        while True:
+            conn = None
+            create = False
+            with self._cond:
+                self._reap_idle()
+                while not self._idle and self._opened >= self._max_size:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise SQLBotDBConnectionError(f'Timeout waiting for a connection of {self.key}')
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, _ = self._idle.pop()
+                else:
+                    self._opened += 1
+                    create = True
+                self._checked_out += 1
+
+            if create:
+                try:
+                    return self._creator()
+                except Exception:
+                    self._forget()
+                    raise
+
+            if not self._pre_ping or self._is_alive(conn):
+                return conn
+            # stale connection, drop it and try again
+            self._close(conn)
+            self._forget()
+
+    def release(self, conn, discard: bool = False):
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            self._checked_out -= 1
+            if discard or self._disposed:
+                self._opened -= 1
+            else:
+                self._idle.append((conn, time.time()))
+            self._cond.notify()
+        if discard or self._disposed:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            # release rolls back, a broken connection fails there and is discarded
+            self.release(conn)
+
+    def dispose(self):
+        with self._cond:
+            self._disposed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._opened -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def _forget(self):
+        with self._cond:
+            self._opened -= 1
+            self._checked_out -= 1
+            self._cond.notify()
+
+    def _reap_idle(self):
+        if not self._idle_timeout or self._idle_timeout <= 0:
+            return
+        now = time.time()
+        # idle deque is LIFO on the right, the oldest connections are on the left
+        while self._idle and now - self._idle[0][1] > self._idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._opened -= 1
+            self._close(conn)
+
+    def _is_alive(self, conn) -> bool:
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(self._ping_sql)
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            return True
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Discard broken connection of {self.key}: {e}")
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
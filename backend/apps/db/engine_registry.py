@@ -0,0 +1,134 @@
+import hashlib
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from sqlalchemy import Engine
+
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+
+def pool_kwargs() -> dict:
+    return {
+        "pool_size": settings.DS_POOL_SIZE,
+        "max_overflow": settings.DS_MAX_OVERFLOW,
+        "pool_recycle": settings.DS_POOL_RECYCLE,
+        "pool_pre_ping": settings.DS_POOL_PRE_PING,
+    }
+
+
+def build_fingerprint(*parts) -> str:
+    raw = "|".join("" if p is None else str(p) for p in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class EngineHolder:
+    def __init__(self, key: str, fingerprint: str, engine: Engine | Any):
+        self.key = key
+        self.fingerprint = fingerprint
+        self.engine = engine
+        self.create_time = time.time()
+        self.last_used = self.create_time
+        self.hits = 0
+
+    def stats(self) -> dict:
+        # a DriverConnectionPool exposes the pool api itself
+        pool = self.engine.pool if isinstance(self.engine, Engine) else self.engine
+        info = {
+            "key": self.key,
+            "fingerprint": self.fingerprint[:12],
+            "create_time": int(self.create_time),
+            "last_used": int(self.last_used),
+            "idle_seconds": int(time.time() - self.last_used),
+            "hits": self.hits,
+            "status": pool.status(),
+        }
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            func = getattr(pool, name, None)
+            if callable(func):
+                info[name] = func()
+        return info
+
+
+_lock = threading.Lock()
+_engines: dict[str, EngineHolder] = {}
+
+
+class DatasourceEngineCache:
+    """
+    Process-wide registry of pooled SQLAlchemy engines (and py_driver connection pools) for user datasources.
+    An engine is reused while its fingerprint (configuration hash) matches; a changed
+    configuration, an idle timeout or an explicit invalidation disposes it.
+    """
+
+    @staticmethod
+    def get_engine(key: str, fingerprint: str, factory: Callable[[], Engine | Any]) -> Engine | Any:
+        with _lock:
+            DatasourceEngineCache._evict_idle()
+            holder = _engines.get(key)
+            if holder is not None and holder.fingerprint == fingerprint:
+                holder.last_used = time.time()
+                holder.hits += 1
+                return holder.engine
+            if holder is not None:
+                DatasourceEngineCache._dispose(_engines.pop(key))
+            holder = EngineHolder(key, fingerprint, factory())
+            _engines[key] = holder
+            DatasourceEngineCache._evict_overflow()
+            SQLBotLogUtil.info(f"Create pooled engine for {key}")
+            return holder.engine
+
+    @staticmethod
+    def invalidate(key: str):
+        with _lock:
+            holder = _engines.pop(key, None)
+            if holder is not None:
+                DatasourceEngineCache._dispose(holder)
+
+    @staticmethod
+    def invalidate_ds(ds_id: Optional[int]):
+        if ds_id is None:
+            return
+        key = f"ds:{ds_id}"
+        with _lock:
+            for k in [k for k in _engines.keys() if k == key or k.startswith(key + ":")]:
+                DatasourceEngineCache._dispose(_engines.pop(k))
+
+    @staticmethod
+    def clear():
+        with _lock:
+            for holder in list(_engines.values()):
+                DatasourceEngineCache._dispose(holder)
+            _engines.clear()
+
+    @staticmethod
+    def stats() -> list[dict]:
+        with _lock:
+            return [holder.stats() for holder in _engines.values()]
+
+    @staticmethod
+    def _evict_idle():
+        timeout = settings.DS_ENGINE_IDLE_TIMEOUT
+        if timeout <= 0:
+            return
+        now = time.time()
+        for key in [k for k, h in _engines.items() if now - h.last_used > timeout]:
+            DatasourceEngineCache._dispose(_engines.pop(key))
+
+    @staticmethod
+    def _evict_overflow():
+        max_count = settings.DS_ENGINE_MAX_COUNT
+        if max_count <= 0 or len(_engines) <= max_count:
+            return
+        holders = sorted(_engines.values(), key=lambda h: h.last_used)
+        for holder in holders[:len(_engines) - max_count]:
+            DatasourceEngineCache._dispose(_engines.pop(holder.key))
+
+    @staticmethod
+    def _dispose(holder: EngineHolder):
+        try:
+            holder.engine.dispose()
+            SQLBotLogUtil.info(f"Dispose pooled engine for {holder.key}")
+        except Exception as e:
+            SQLBotLogUtil.error(f"Dispose pooled engine for {holder.key} failed: {e}")
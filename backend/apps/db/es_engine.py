@@ -2,25 +2,69 @@
 # Date: 2025/9/9
 
 import json
+import threading
 from base64 import b64encode
+from collections import OrderedDict
+from typing import Optional
 
 import requests
 from elasticsearch import Elasticsearch
 
 from apps.datasource.models.datasource import DatasourceConf
+from apps.db.engine_registry import build_fingerprint
+from common.core.config import settings
 from common.error import SingleMessageError
 
 
+_lock = threading.Lock()
+_es_clients: OrderedDict[str, Elasticsearch] = OrderedDict()
+_http_sessions: OrderedDict[str, requests.Session] = OrderedDict()
+
+
+def _get_conf_key(conf: DatasourceConf) -> str:
+    return build_fingerprint(conf.host, conf.username, conf.password)
+
+
+def _cache_put(cache: OrderedDict, key: str, value):
+    cache[key] = value
+    while len(cache) > settings.DS_ENGINE_MAX_COUNT > 0:
+        _, old = cache.popitem(last=False)
+        try:
+            old.close()
+        except Exception:
+            pass
+
+
 def get_es_connect(conf: DatasourceConf):
-    es_client = Elasticsearch(
-        [conf.host],  # ES address
-        basic_auth=(conf.username, conf.password),
-        verify_certs=False,
-        compatibility_mode=True
-    )
+    # one client (and its connection pool) per datasource configuration
+    key = _get_conf_key(conf)
+    with _lock:
+        es_client = _es_clients.get(key)
+        if es_client is not None:
+            _es_clients.move_to_end(key)
+            return es_client
+        es_client = Elasticsearch(
+            [conf.host],  # ES address
+            basic_auth=(conf.username, conf.password),
+            verify_certs=False,
+            compatibility_mode=True
+        )
+        _cache_put(_es_clients, key, es_client)
     return es_client
 
 
+def get_es_http_session(conf: DatasourceConf) -> requests.Session:
+    key = _get_conf_key(conf)
+    with _lock:
+        http_session = _http_sessions.get(key)
+        if http_session is not None:
+            _http_sessions.move_to_end(key)
+            return http_session
+        http_session = requests.Session()
+        _cache_put(_http_sessions, key, http_session)
+    return http_session
+
+
 # get tables
 def get_es_index(conf: DatasourceConf):
     es_client = get_es_connect(conf)
@@ -89,7 +133,7 @@ def get_es_fields(conf: DatasourceConf, table_name: str):
 #     return res, fields
 
 
-def get_es_data_by_http(conf: DatasourceConf, sql: str):
+def get_es_data_by_http(conf: DatasourceConf, sql: str, timeout: Optional[int] = None):
     url = conf.host
     while url.endswith('/'):
         url = url[:-1]
@@ -106,7 +150,11 @@ def get_es_data_by_http(conf: DatasourceConf, sql: str):
         "Authorization": f"Basic {encoded_credentials}"
     }
 
-    response = requests.post(host, data=json.dumps({"query": sql}), headers=headers)
+    body = {"query": sql}
+    if timeout:
+        body["request_timeout"] = f"{timeout}s"
+    response = get_es_http_session(conf).post(host, data=json.dumps(body), headers=headers,
+                                              timeout=(conf.timeout, timeout) if timeout else None)
 
     # print(response.json())
     res = response.json()
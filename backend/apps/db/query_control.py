@@ -0,0 +1,131 @@
+import re
+import threading
+import time
+from typing import Callable, Optional
+
+import sqlparse
+from sqlparse.tokens import DML
+
+from common.error import SQLBotDBTimeoutError, SQLBotDBCancelledError
+from common.utils.utils import SQLBotLogUtil
+
+# driver messages raised when a statement timeout fires, lower case
+_TIMEOUT_PATTERNS = (
+    'statement timeout',  # pg, kingbase, redshift
+    'maximum statement execution time exceeded',  # mysql
+    'query timeout',  # doris
+    'timeout_exceeded',  # clickhouse
+    'timeout exceeded',
+    'dpi-1067',  # oracle call_timeout
+    'timed out',  # sqlServer, es http
+)
+
+
+class QueryCancelToken:
+    """
+    Shared by the request that may go away and the thread running its query.
+    The executing side binds a canceller for the statement in flight; cancel() fires it at most once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._canceller: Optional[Callable[[], None]] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def bind(self, canceller: Callable[[], None]):
+        with self._lock:
+            self._canceller = canceller
+            fire = self._cancelled
+        if fire:
+            self._fire(canceller)
+
+    def unbind(self):
+        with self._lock:
+            self._canceller = None
+
+    def cancel(self):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            canceller = self._canceller
+        if canceller is not None:
+            self._fire(canceller)
+
+    def raise_if_cancelled(self):
+        if self._cancelled:
+            raise SQLBotDBCancelledError('Query cancelled')
+
+    @staticmethod
+    def _fire(canceller: Callable[[], None]):
+        try:
+            canceller()
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Cancel query failed: {e}")
+
+
+def get_statement_timeout_sql(ds_type: str, timeout: int) -> Optional[str]:
+    """Session statement run right before the query, None when the dialect is bounded another way."""
+    if not timeout or timeout <= 0:
+        return None
+    if ds_type in ('pg', 'excel', 'kingbase', 'redshift'):
+        # LOCAL ends with the transaction, so a pooled connection does not keep it
+        return f'SET LOCAL statement_timeout = {timeout * 1000}'
+    # mysql and doris only have session scoped variables, which would stay on the pooled connection; their
+    # limit travels with the query as a hint, see apply_query_settings
+    return None
+
+
+def _add_select_hint(sql: str, hint: str) -> str:
+    # optimizer hints are only read right after the top level SELECT keyword
+    statements = [s for s in sqlparse.parse(sql) if str(s).strip()]
+    if len(statements) != 1:
+        return sql
+    tokens = statements[0].tokens
+    for i, token in enumerate(tokens):
+        if token.ttype is DML and token.normalized == 'SELECT':
+            head = ''.join(str(t) for t in tokens[:i + 1])
+            return f"{head} /*+ {hint} */{''.join(str(t) for t in tokens[i + 1:])}"
+    return sql
+
+
+def apply_query_settings(ds_type: str, sql: str, timeout: int) -> str:
+    """Limits carried by the statement itself, so nothing outlives the query on a pooled connection."""
+    if not timeout or timeout <= 0:
+        return sql
+    # clickhouse over http has no session, the limit travels with the query
+    if ds_type == 'ck' and not re.search(r'\bSETTINGS\b', sql, flags=re.IGNORECASE):
+        return f'{sql}\nSETTINGS max_execution_time = {timeout}'
+    if ds_type == 'mysql' and not re.search(r'\bMAX_EXECUTION_TIME\b', sql, flags=re.IGNORECASE):
+        return _add_select_hint(sql, f'MAX_EXECUTION_TIME({timeout * 1000})')
+    if ds_type == 'doris' and not re.search(r'\bquery_timeout\b', sql, flags=re.IGNORECASE):
+        return _add_select_hint(sql, f'SET_VAR(query_timeout = {timeout})')
+    return sql
+
+
+def cancel_connection(dbapi_conn):
+    # psycopg, oracledb and dmPython expose cancel() on the connection, pymssql on its _mssql handle
+    cancel = getattr(dbapi_conn, 'cancel', None)
+    if not callable(cancel):
+        cancel = getattr(getattr(dbapi_conn, '_conn', None), 'cancel', None)
+    if callable(cancel):
+        cancel()
+
+
+def is_timeout_error(ex: Exception) -> bool:
+    message = str(ex).lower()
+    return any(pattern in message for pattern in _TIMEOUT_PATTERNS)
+
+
+def classify_query_error(ex: Exception, timeout: Optional[int], started: float,
+                         cancel_token: Optional[QueryCancelToken]) -> Exception:
+    """Map a failed execution to SQLBotDBCancelledError / SQLBotDBTimeoutError, or return it unchanged."""
+    if cancel_token is not None and cancel_token.cancelled:
+        return SQLBotDBCancelledError('Query cancelled')
+    if timeout and timeout > 0 and (is_timeout_error(ex) or time.time() - started >= timeout):
+        return SQLBotDBTimeoutError(f'Query exceeded the {timeout}s statement timeout: {ex}')
+    return ex
@@ -0,0 +1,210 @@
+import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import orjson
+import sqlparse
+
+from apps.datasource.models.datasource import CoreDatasource
+from apps.db.result_set import ColumnarResult
+from apps.system.schemas.system_schema import AssistantOutDsSchema
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+_REDIS_PREFIX = 'sqlbot-cache:sql-result:'
+
+
+def normalize_sql(sql: str) -> str:
+    """Comments dropped, keywords upper cased and whitespace collapsed; string literals are kept as written."""
+    formatted = sqlparse.format(sql.strip().rstrip(';'), strip_comments=True, keyword_case='upper')
+    parts = []
+    for statement in sqlparse.parse(formatted):
+        for token in statement.flatten():
+            if token.is_whitespace:
+                if parts and parts[-1] != ' ':
+                    parts.append(' ')
+            else:
+                parts.append(token.value)
+    return ''.join(parts).strip()
+
+
+def _get_ds_key(ds: CoreDatasource | AssistantOutDsSchema) -> str:
+    return f"ds:{ds.id}" if isinstance(ds, CoreDatasource) else f"assistant:{ds.id}"
+
+
+def _get_ttl(ds: CoreDatasource | AssistantOutDsSchema) -> int:
+    if isinstance(ds, CoreDatasource):
+        return settings.SQL_RESULT_CACHE_DS_TTL.get(ds.id, settings.SQL_RESULT_CACHE_TTL)
+    return settings.SQL_RESULT_CACHE_TTL
+
+
+def _json_default(value: Any):
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('utf-8')
+    return str(value)
+
+
+def _dumps(result: ColumnarResult) -> bytes:
+    return orjson.dumps({"fields": result.fields, "columns": result.columns, "sql": result.sql,
+                         "truncated": result.truncated, "limit": result.limit}, default=_json_default)
+
+
+def _loads(value: bytes) -> ColumnarResult:
+    obj = orjson.loads(value)
+    return ColumnarResult(obj["fields"], obj["columns"], obj["sql"], obj["truncated"], obj["limit"])
+
+
+class _MemoryBackend:
+    """LRU bounded by the serialized size of the cached results."""
+
+    def __init__(self, max_bytes: int):
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[str, bytes, float]] = OrderedDict()  # key -> (ds_key, value, expire)
+        self._bytes = 0
+        self._max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.time():
+                if entry is not None:
+                    self._pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, ds_key: str, value: bytes, ttl: int):
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (ds_key, value, time.time() + ttl)
+            self._bytes += len(value)
+            while self._bytes > self._max_bytes and self._entries:
+                self._pop(next(iter(self._entries)))
+
+    def invalidate(self, ds_key: str):
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e[0] == ds_key]:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"type": "memory", "entries": len(self._entries), "bytes": self._bytes,
+                    "max_bytes": self._max_bytes, "hits": self.hits, "misses": self.misses}
+
+    def _pop(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry[1])
+
+
+class _RedisBackend:
+    def __init__(self, url: str):
+        # queries run on worker threads, so this uses the blocking client rather than the app's asyncio one
+        import redis
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._redis.get(f"{_REDIS_PREFIX}{key}")
+
+    def put(self, key: str, ds_key: str, value: bytes, ttl: int):
+        self._redis.setex(f"{_REDIS_PREFIX}{key}", ttl, value)
+
+    def invalidate(self, ds_key: str):
+        keys = list(self._redis.scan_iter(match=f"{_REDIS_PREFIX}{ds_key}:*", count=500))
+        if keys:
+            self._redis.delete(*keys)
+
+    def clear(self):
+        keys = list(self._redis.scan_iter(match=f"{_REDIS_PREFIX}*", count=500))
+        if keys:
+            self._redis.delete(*keys)
+
+    def stats(self) -> dict:
+        return {"type": "redis"}
+
+
+_backend_lock = threading.Lock()
+_backend: Optional[_MemoryBackend | _RedisBackend] = None
+
+
+def _get_backend() -> _MemoryBackend | _RedisBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if settings.CACHE_TYPE == "redis":
+                    _backend = _RedisBackend(settings.CACHE_REDIS_URL or "redis://localhost:6379/0")
+                else:
+                    _backend = _MemoryBackend(settings.SQL_RESULT_CACHE_MAX_BYTES)
+    return _backend
+
+
+class SqlResultCache:
+    """
+    Optional cache of executed chat SQL results, keyed by datasource, normalized SQL and the row permission
+    filter that was applied. Stored in process memory, or in Redis when CACHE_TYPE=redis.
+    """
+
+    @staticmethod
+    def enabled(ds: CoreDatasource | AssistantOutDsSchema) -> bool:
+        return settings.SQL_RESULT_CACHE_ENABLED and ds.id is not None and _get_ttl(ds) > 0
+
+    @staticmethod
+    def build_key(ds: CoreDatasource | AssistantOutDsSchema, sql: str, permission_filter: Optional[str] = None) -> str:
+        raw = f"{normalize_sql(sql)}|{permission_filter or ''}"
+        return f"{_get_ds_key(ds)}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+    @staticmethod
+    def get(ds: CoreDatasource | AssistantOutDsSchema, sql: str,
+            permission_filter: Optional[str] = None) -> Optional[ColumnarResult]:
+        if not SqlResultCache.enabled(ds):
+            return None
+        try:
+            value = _get_backend().get(SqlResultCache.build_key(ds, sql, permission_filter))
+            return _loads(value) if value is not None else None
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Read sql result cache failed: {e}")
+            return None
+
+    @staticmethod
+    def put(ds: CoreDatasource | AssistantOutDsSchema, sql: str, permission_filter: Optional[str],
+            result: ColumnarResult):
+        if not SqlResultCache.enabled(ds):
+            return
+        try:
+            value = _dumps(result)
+            if len(value) > settings.SQL_RESULT_CACHE_MAX_ENTRY_BYTES:
+                return
+            _get_backend().put(SqlResultCache.build_key(ds, sql, permission_filter), _get_ds_key(ds), value,
+                               _get_ttl(ds))
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Write sql result cache failed: {e}")
+
+    @staticmethod
+    def invalidate_ds(ds_id: Optional[int]):
+        if ds_id is None or not settings.SQL_RESULT_CACHE_ENABLED:
+            return
+        try:
+            _get_backend().invalidate(f"ds:{ds_id}")
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Invalidate sql result cache of datasource {ds_id} failed: {e}")
+
+    @staticmethod
+    def clear():
+        _get_backend().clear()
+
+    @staticmethod
+    def stats() -> dict:
+        return _get_backend().stats()
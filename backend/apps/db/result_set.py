@@ -0,0 +1,94 @@
+import base64
+from decimal import Decimal
+from itertools import islice
+from typing import Any, Callable, Iterable, List, Optional, Sequence
+
+import pandas as pd
+
+
+def _normalize_column(values: List[Any], for_json: bool = False) -> List[Any]:
+    # database columns are homogeneous, so the first non-null value decides the conversion for the whole column
+    sample = next((v for v in values if v is not None), None)
+    if isinstance(sample, Decimal):
+        return [float(v) if isinstance(v, Decimal) else v for v in values]
+    if for_json and isinstance(sample, bytes):
+        return [base64.b64encode(v).decode('utf-8') if isinstance(v, bytes) else v for v in values]
+    return values
+
+
+def columns_to_dataframe(columns: List[List[Any]], labels: List[str]) -> pd.DataFrame:
+    # build by position, labels may contain duplicates
+    df = pd.DataFrame({i: column for i, column in enumerate(columns)})
+    df.columns = labels
+    return df
+
+
+class ColumnarResult:
+    """
+    Query result kept as one list per column, capped at max_rows while fetching.
+    Row dicts are only built when a consumer really needs the legacy {"fields", "data"} shape.
+    """
+
+    def __init__(self, fields: List[str], columns: List[List[Any]], sql: str, truncated: bool = False,
+                 limit: Optional[int] = None):
+        self.fields = fields
+        self.columns = columns
+        self.sql = sql
+        self.truncated = truncated
+        self.limit = limit
+        self.types = [type(next((v for v in column if v is not None), None)).__name__ for column in columns]
+
+    @property
+    def row_count(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def to_rows(self, for_json: bool = False) -> List[dict]:
+        if not self.fields or not self.row_count:
+            return []
+        columns = [_normalize_column(column, for_json) for column in self.columns] if for_json else self.columns
+        fields = [str(field) for field in self.fields]
+        return [dict(zip(fields, row)) for row in zip(*columns)]
+
+    def to_dict(self, for_json: bool = False) -> dict:
+        obj = {"fields": self.fields, "data": self.to_rows(for_json),
+               "sql": bytes.decode(base64.b64encode(bytes(self.sql, 'utf-8')))}
+        if self.truncated:
+            obj["limit"] = self.limit
+            obj["truncated"] = True
+        return obj
+
+    def to_dataframe(self, labels: Optional[List[str]] = None) -> pd.DataFrame:
+        return columns_to_dataframe(self.columns, labels or self.fields)
+
+
+def fetch_columnar(fetch_batch: Callable[[int], Sequence], fields: List[str], sql: str,
+                   max_rows: Optional[int] = None, batch_size: int = 500) -> ColumnarResult:
+    """
+    Pull rows through fetch_batch (a cursor's fetchmany) and transpose each batch into columns.
+    One extra row is requested beyond max_rows so a capped result can be flagged as truncated.
+    """
+    columns: List[List[Any]] = [[] for _ in fields]
+    count = 0
+    truncated = False
+    batch_size = max(1, batch_size)
+    while True:
+        size = batch_size if max_rows is None else min(batch_size, max_rows + 1 - count)
+        rows = fetch_batch(size)
+        if not rows:
+            break
+        if max_rows is not None and count + len(rows) > max_rows:
+            rows = rows[:max_rows - count]
+            truncated = True
+        for i, values in enumerate(zip(*rows)):
+            columns[i].extend(values)
+        count += len(rows)
+        if truncated:
+            break
+    columns = [_normalize_column(column) for column in columns]
+    return ColumnarResult(fields, columns, sql, truncated, max_rows if truncated else None)
+
+
+def fetch_columnar_from_rows(rows: Iterable[Sequence], fields: List[str], sql: str,
+                             max_rows: Optional[int] = None, batch_size: int = 500) -> ColumnarResult:
+    it = iter(rows)
+    return fetch_columnar(lambda n: [tuple(row) for row in islice(it, n)], fields, sql, max_rows, batch_size)
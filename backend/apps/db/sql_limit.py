@@ -0,0 +1,182 @@
+import re
+from typing import Iterator, Optional
+
+import sqlparse
+from sqlparse.sql import Parenthesis, Statement, Token, TokenList
+from sqlparse.tokens import DML, Whitespace, Newline, Name, Number, Other
+
+from apps.db.constant import DB, LimitStyle
+
+_LOCKING = ('UPDATE', 'SHARE', 'NO', 'KEY')
+_TOP = re.compile(r'\s*(?:(?:DISTINCT|ALL)\s+)?TOP\b', re.IGNORECASE)
+_TOP_COUNT = re.compile(r'(\s*(?:(?:DISTINCT|ALL)\s+)?TOP\s*\(?\s*)(\d+)\b(?!\s*\)?\s*PERCENT)', re.IGNORECASE)
+
+
+def _top_level_tokens(token_list: TokenList) -> Iterator[tuple[TokenList, int]]:
+    # tokens outside of any parenthesis, so limits inside sub queries and CTE bodies are ignored
+    for i, token in enumerate(token_list.tokens):
+        if isinstance(token, Parenthesis):
+            continue
+        if token.is_group:
+            yield from _top_level_tokens(token)
+        else:
+            yield token_list, i
+
+
+def _top_level_keywords(statement: Statement) -> set[str]:
+    return {parent.tokens[i].normalized for parent, i in _top_level_tokens(statement) if parent.tokens[i].is_keyword}
+
+
+def _has_rownum(statement: Statement) -> bool:
+    # sqlparse tokenizes ROWNUM as a name, not a keyword
+    return any(parent.tokens[i].ttype in Name and parent.tokens[i].value.upper() == 'ROWNUM'
+               for parent, i in _top_level_tokens(statement))
+
+
+def _next_token(parent: TokenList, i: int) -> Optional[int]:
+    for j in range(i + 1, len(parent.tokens)):
+        if parent.tokens[j].ttype not in (Whitespace, Newline):
+            return j
+    return None
+
+
+def _cap_row_count(statement: Statement, keyword: str, limit: int) -> bool:
+    """
+    Lower the literal row count after the top level `keyword` (LIMIT n, LIMIT offset, n or FETCH FIRST/NEXT n)
+    to at most `limit`. False when the count is not a plain number, the caller then wraps the query.
+    """
+    for parent, i in _top_level_tokens(statement):
+        if not (parent.tokens[i].is_keyword and parent.tokens[i].normalized == keyword):
+            continue
+        j = _next_token(parent, i)
+        if j is not None and keyword == 'FETCH' and parent.tokens[j].normalized in ('FIRST', 'NEXT'):
+            j = _next_token(parent, j)
+        if j is None:
+            return False
+        count = parent.tokens[j]
+        if count.ttype in Number.Integer:
+            if int(count.value) > limit:
+                parent.tokens[j] = Token(Number.Integer, str(limit))
+            return True
+        # LIMIT offset, count (MySQL) is grouped as one identifier list
+        match = re.fullmatch(r'(\d+\s*,\s*)(\d+)', str(count)) if keyword == 'LIMIT' else None
+        if match is None:
+            return False
+        if int(match.group(2)) > limit:
+            parent.tokens[j] = Token(Other, f'{match.group(1)}{limit}')
+        return True
+    return False
+
+
+def _split_select(statement: Statement) -> Optional[tuple[str, str]]:
+    # the text up to and including the first top level SELECT, and the rest
+    tokens = statement.tokens
+    for i, token in enumerate(tokens):
+        if token.ttype is DML and token.normalized == 'SELECT':
+            return ''.join(str(t) for t in tokens[:i + 1]), ''.join(str(t) for t in tokens[i + 1:])
+    return None
+
+
+def _cap_top(head: str, tail: str, limit: int) -> Optional[str]:
+    # sqlparse does not tokenize TOP as a keyword, the count is read from the text
+    match = _TOP_COUNT.match(tail)
+    if match is None:
+        return None
+    count = min(int(match.group(2)), limit)
+    return f'{head}{match.group(1)}{count}{tail[match.end():]}'
+
+
+def _insert_top(statement: Statement, limit: int) -> str:
+    tokens = statement.tokens
+    for i, token in enumerate(tokens):
+        if token.ttype is DML and token.normalized == 'SELECT':
+            pos = i
+            for j in range(i + 1, len(tokens)):
+                if tokens[j].ttype in (Whitespace, Newline):
+                    continue
+                if tokens[j].is_keyword and tokens[j].normalized in ('DISTINCT', 'ALL'):
+                    pos = j
+                    continue
+                break
+            return ''.join(str(t) for t in tokens[:pos + 1]) + f' TOP {limit}' + ''.join(
+                str(t) for t in tokens[pos + 1:])
+    return str(statement)
+
+
+def _insert_before_locking(statement: Statement, clause: str) -> Optional[str]:
+    # LIMIT goes before FOR UPDATE / FOR SHARE, not after it
+    tokens = statement.tokens
+    for i, token in enumerate(tokens):
+        if token.is_keyword and token.normalized == 'FOR':
+            j = _next_token(statement, i)
+            if j is not None and tokens[j].normalized in _LOCKING:
+                head = ''.join(str(t) for t in tokens[:i]).rstrip()
+                return f"{head}\n{clause}\n{''.join(str(t) for t in tokens[i:])}"
+    return None
+
+
+def _oracle_major_version(version: Optional[str]) -> Optional[int]:
+    match = re.match(r'\s*(\d+)', version or '')
+    return int(match.group(1)) if match else None
+
+
+def wrap_limit(sql: str, ds_type: str, limit: int, version: Optional[str] = None) -> str:
+    """
+    Bound a generated SELECT to at most `limit` rows using the dialect's own syntax (see DB.limit_style).
+    A row count the SQL already has is lowered to `limit`, or the query is wrapped when the count is not a plain
+    number. SQL that is not a single SELECT is returned unchanged. `version` is the database version string,
+    only Oracle needs it: before 12c it has no FETCH FIRST.
+    """
+    if not sql or limit is None or limit <= 0:
+        return sql
+    sql = sql.strip().rstrip(';').rstrip()
+    statements = [s for s in sqlparse.parse(sql) if str(s).strip()]
+    if len(statements) != 1 or statements[0].get_type() != 'SELECT':
+        return sql
+    statement = statements[0]
+    keywords = _top_level_keywords(statement)
+
+    style = DB.get_db(ds_type).limit_style
+    if style == LimitStyle.limit:
+        # ClickHouse LIMIT n BY col bounds rows per group, not the result; a lone BY is only left by it
+        limit_by = 'BY' in keywords
+        if 'LIMIT' in keywords or 'FETCH' in keywords or limit_by:
+            if not limit_by and _cap_row_count(statement, 'LIMIT' if 'LIMIT' in keywords else 'FETCH', limit):
+                return str(statement)
+            return f'SELECT * FROM (\n{sql}\n) _sqlbot_limit\nLIMIT {limit}'
+        # newline keeps the clause out of a trailing line comment
+        return _insert_before_locking(statement, f'LIMIT {limit}') or f'{sql}\nLIMIT {limit}'
+    if style == LimitStyle.fetch_first:
+        if 'FOR' in keywords:
+            # Oracle rejects both FETCH FIRST and ROWNUM views with FOR UPDATE
+            return sql
+        major = _oracle_major_version(version)
+        if major is not None and major >= 12 and not _has_rownum(statement):
+            if 'FETCH' not in keywords:
+                return f'{sql}\nFETCH FIRST {limit} ROWS ONLY'
+            if _cap_row_count(statement, 'FETCH', limit):
+                return str(statement)
+        # unknown or pre 12c version, or SQL written against ROWNUM: a ROWNUM view works on every release
+        return f'SELECT * FROM (\n{sql}\n) WHERE ROWNUM <= {limit}'
+    if style == LimitStyle.top:
+        set_operation = bool(keywords & {'UNION', 'UNION ALL', 'EXCEPT', 'INTERSECT'})
+        split = _split_select(statement)
+        if 'FETCH' in keywords:
+            if _cap_row_count(statement, 'FETCH', limit):
+                return str(statement)
+        elif split is not None and _TOP.match(split[1]):
+            # TOP of the first SELECT does not bound the other branches of a UNION
+            capped = None if set_operation else _cap_top(*split, limit)
+            if capped is not None:
+                return capped
+        elif 'OFFSET' in keywords:
+            return f'{sql}\nFETCH NEXT {limit} ROWS ONLY'
+        elif 'ORDER BY' in keywords:
+            return f'{sql}\nOFFSET 0 ROWS FETCH NEXT {limit} ROWS ONLY'
+        elif not set_operation:
+            return _insert_top(statement, limit)
+        if statement.token_first(skip_cm=True).normalized == 'WITH':
+            # a CTE cannot be wrapped in a derived table
+            return sql
+        return f'SELECT TOP {limit} * FROM (\n{sql}\n) AS _sqlbot_limit'
+    return sql
@@ -0,0 +1,124 @@
+from typing import Optional
+
+import sqlparse
+from sqlparse.sql import Identifier, IdentifierList, Parenthesis, Statement, Token, TokenList
+from sqlparse.tokens import Comment, Keyword, Name, Other, String
+
+# no sub queries in FROM, these keep the LLM rewrite
+_UNSUPPORTED_TYPES = {'es'}
+
+
+def _unquote(name: Optional[str]) -> str:
+    return (name or '').strip('`"[]').lower()
+
+
+def _is_table_keyword(token: Token) -> bool:
+    return token.ttype in Keyword and (token.normalized == 'FROM' or token.normalized.endswith('JOIN'))
+
+
+def _split_alias(identifier: Identifier) -> tuple[str, Optional[str]]:
+    """The table reference and the alias of a FROM/JOIN item, both as written."""
+    if not identifier.get_alias():
+        return str(identifier).strip(), None
+    tokens = identifier.tokens
+    # the alias is the last non whitespace token, optionally preceded by AS
+    end = len(tokens) - 1
+    while tokens[end].is_whitespace:
+        end -= 1
+    start = end
+    while start > 0 and tokens[start - 1].is_whitespace:
+        start -= 1
+    if start > 0 and tokens[start - 1].ttype in Keyword and tokens[start - 1].normalized == 'AS':
+        start -= 1
+    return ''.join(str(t) for t in tokens[:start]).strip(), str(tokens[end]).strip()
+
+
+class _RowFilterRewriter:
+
+    def __init__(self, filters: dict[str, str]):
+        self.filters = filters
+        self.applied: dict[str, int] = {}
+        # filtered tables referenced without alias as schema.table, see apply_row_filters
+        self.qualified_refs: list[str] = []
+
+    def _rewrite_table(self, identifier: Identifier) -> Optional[str]:
+        if isinstance(identifier.token_first(skip_cm=True), Parenthesis):
+            # derived table, the FROM clauses inside are handled by the walk
+            self.walk(identifier)
+            return None
+        name = _unquote(identifier.get_real_name())
+        where = self.filters.get(name)
+        if where is None:
+            return None
+        table_ref, alias = _split_alias(identifier)
+        if not alias:
+            # the sub query takes the table's name as written, so table.column references keep working
+            alias = str([t for t in identifier.tokens if not t.is_whitespace][-1])
+            if identifier.get_parent_name():
+                self.qualified_refs.append(table_ref)
+        self.applied[name] = self.applied.get(name, 0) + 1
+        # no AS, Oracle does not accept it before a table alias
+        return f'(SELECT * FROM {table_ref} WHERE {where}) {alias}'
+
+    def _replace(self, token_list: TokenList, index: int):
+        replacement = self._rewrite_table(token_list.tokens[index])
+        if replacement is not None:
+            token_list.tokens[index] = Token(Other, replacement)
+
+    def walk(self, token_list: TokenList):
+        expect_table = False
+        for i, token in enumerate(token_list.tokens):
+            if token.is_whitespace or token.ttype in Comment:
+                continue
+            if _is_table_keyword(token):
+                expect_table = True
+                continue
+            if expect_table and isinstance(token, Identifier):
+                self._replace(token_list, i)
+            elif expect_table and isinstance(token, IdentifierList):
+                for j, item in enumerate(token.tokens):
+                    if isinstance(item, Identifier):
+                        self._replace(token, j)
+            elif token.is_group:
+                self.walk(token)
+            expect_table = False
+
+
+def apply_row_filters(sql: str, ds_type: str, filters: list[dict]) -> Optional[str]:
+    """
+    Apply row permission filters ([{"table": name, "filter": where}], as built by get_row_permission_filters)
+    by replacing every reference of a filtered table with `(SELECT * FROM table WHERE filter) alias`. The
+    filters use unqualified column names, which the sub query resolves against the table alone.
+    Returns None when the SQL cannot be rewritten with confidence, the caller then falls back to the LLM.
+    """
+    active = {_unquote(f.get('table')): f.get('filter') for f in filters or [] if f.get('filter') and
+              str(f.get('filter')).strip()}
+    if not active:
+        return sql
+    if ds_type in _UNSUPPORTED_TYPES or not sql:
+        return None
+    sql = sql.strip().rstrip(';').rstrip()
+    statements = [s for s in sqlparse.parse(sql) if str(s).strip()]
+    if len(statements) != 1 or statements[0].get_type() != 'SELECT':
+        return None
+    statement: Statement = statements[0]
+
+    rewriter = _RowFilterRewriter(active)
+    rewriter.walk(statement)
+    result = str(statement)
+    for table_ref in rewriter.qualified_refs:
+        if f'{table_ref}.' in result:
+            return None
+    # every mention of a filtered table, other than as a column qualifier, must have been rewritten; anything
+    # the walk does not understand must not slip through unfiltered
+    tokens = [t for t in sqlparse.parse(sql)[0].flatten() if not t.is_whitespace]
+    mentions: dict[str, int] = {}
+    for i, token in enumerate(tokens):
+        if token.ttype not in Name and token.ttype not in String.Symbol and token.ttype not in Keyword:
+            continue
+        name = _unquote(token.value)
+        if name in active and not (i + 1 < len(tokens) and tokens[i + 1].value == '.'):
+            mentions[name] = mentions.get(name, 0) + 1
+    if any(count != rewriter.applied.get(name, 0) for name, count in mentions.items()):
+        return None
+    return result
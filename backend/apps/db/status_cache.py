@@ -0,0 +1,130 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from apps.datasource.models.datasource import CoreDatasource
+from apps.db.db import check_connection, get_version
+from apps.db.engine_registry import build_fingerprint
+from apps.system.schemas.system_schema import AssistantOutDsSchema
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+
+class DatasourceStatus:
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.version: Optional[str] = None
+        self.version_time: float = 0
+        self.connected: Optional[bool] = None
+        self.connected_time: float = 0
+        self.refreshing = False
+
+
+_lock = threading.Lock()
+_status: dict[str, DatasourceStatus] = {}
+_refresher = ThreadPoolExecutor(max_workers=4, thread_name_prefix='ds-status')
+
+
+def _get_key(ds: CoreDatasource | AssistantOutDsSchema) -> tuple[str, str]:
+    if isinstance(ds, CoreDatasource):
+        return f"ds:{ds.id}", build_fingerprint(ds.type, ds.configuration)
+    return f"assistant:{ds.id}", build_fingerprint(ds.type, ds.host, ds.port, ds.user, ds.password, ds.dataBase,
+                                                    ds.db_schema)
+
+
+def _detach(ds: CoreDatasource | AssistantOutDsSchema):
+    # the refresher runs on another thread, never hand it an object bound to a request session
+    if isinstance(ds, CoreDatasource):
+        return CoreDatasource(**ds.model_dump())
+    return ds.model_copy()
+
+
+class DatasourceStatusCache:
+    """
+    In-memory cache of datasource version strings and liveness, so a chat turn does not pay two
+    extra round trips to the customer database. Entries older than half the TTL are refreshed in
+    the background while the cached value is still served; a failed query should call invalidate.
+    """
+
+    @staticmethod
+    def _get_status(ds: CoreDatasource | AssistantOutDsSchema) -> tuple[str, DatasourceStatus]:
+        key, fingerprint = _get_key(ds)
+        with _lock:
+            status = _status.get(key)
+            if status is None or status.fingerprint != fingerprint:
+                status = DatasourceStatus(fingerprint)
+                _status[key] = status
+            return key, status
+
+    @staticmethod
+    def get_version(ds: CoreDatasource | AssistantOutDsSchema) -> str:
+        if ds.id is None:
+            return get_version(ds)
+        key, status = DatasourceStatusCache._get_status(ds)
+        if status.version is not None:
+            # get_version returns '' when the query fails, that is only kept for the short failure ttl
+            ttl = settings.DS_STATUS_CACHE_TTL if status.version else settings.DS_STATUS_FAILED_TTL
+            age = time.time() - status.version_time
+            if age < ttl:
+                if status.version and age > ttl / 2:
+                    DatasourceStatusCache._refresh_async(ds, key, status)
+                return status.version
+        version = get_version(ds)
+        status.version = version
+        status.version_time = time.time()
+        return version
+
+    @staticmethod
+    def is_connected(ds: CoreDatasource | AssistantOutDsSchema) -> bool:
+        if ds.id is None:
+            return check_connection(trans=None, ds=ds)
+        key, status = DatasourceStatusCache._get_status(ds)
+        if status.connected is not None:
+            ttl = settings.DS_STATUS_CACHE_TTL if status.connected else settings.DS_STATUS_FAILED_TTL
+            age = time.time() - status.connected_time
+            if age < ttl:
+                if status.connected and age > ttl / 2:
+                    DatasourceStatusCache._refresh_async(ds, key, status)
+                return status.connected
+        connected = check_connection(trans=None, ds=ds)
+        status.connected = connected
+        status.connected_time = time.time()
+        return connected
+
+    @staticmethod
+    def invalidate(ds: CoreDatasource | AssistantOutDsSchema):
+        key, _ = _get_key(ds)
+        with _lock:
+            _status.pop(key, None)
+
+    @staticmethod
+    def invalidate_ds(ds_id: Optional[int]):
+        if ds_id is None:
+            return
+        with _lock:
+            _status.pop(f"ds:{ds_id}", None)
+
+    @staticmethod
+    def _refresh_async(ds: CoreDatasource | AssistantOutDsSchema, key: str, status: DatasourceStatus):
+        with _lock:
+            if status.refreshing:
+                return
+            status.refreshing = True
+        _refresher.submit(DatasourceStatusCache._refresh, _detach(ds), key, status)
+
+    @staticmethod
+    def _refresh(ds: CoreDatasource | AssistantOutDsSchema, key: str, status: DatasourceStatus):
+        try:
+            connected = check_connection(trans=None, ds=ds)
+            status.connected = connected
+            status.connected_time = time.time()
+            if connected:
+                version = get_version(ds)
+                if version:
+                    status.version = version
+                    status.version_time = time.time()
+        except Exception as e:
+            SQLBotLogUtil.error(f"Refresh datasource status of {key} failed: {e}")
+        finally:
+            status.refreshing = False
@@ -128,11 +128,10 @@ async def mcp_question(session: SessionDep, chat: McpQuestion):
                 status_code=500,
             )
     if chat.stream:
-        return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
+        return StreamingResponse(llm_service.async_await_result(), media_type="text/event-stream")
     else:
-        res = llm_service.await_result()
         raw_data = {}
-        for chunk in res:
+        async for chunk in llm_service.async_await_result():
             if chunk:
                 raw_data = chunk
         status_code = 200
@@ -184,11 +183,10 @@ async def mcp_assistant(session: SessionDep, chat: McpAssistant):
                 status_code=500,
             )
     if chat.stream:
-        return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
+        return StreamingResponse(llm_service.async_await_result(), media_type="text/event-stream")
     else:
-        res = llm_service.await_result()
         raw_data = {}
-        for chunk in res:
+        async for chunk in llm_service.async_await_result():
             if chunk:
                 raw_data = chunk
         status_code = 200
@@ -1,6 +1,8 @@
 from fastapi import APIRouter
 from fastapi.responses import JSONResponse
-from common.core.deps import SessionDep, Trans
+from apps.ai_model.embedding import EmbeddingModelCache
+from common.core.deps import CurrentUser, SessionDep, Trans
+from common.utils.embedding_threads import embedding_jobs
 
 router = APIRouter(tags=["system"], prefix="/system")
 
@@ -51,3 +53,29 @@ async def get_license_version(session: SessionDep, trans: Trans):
 async def update_license(session: SessionDep, trans: Trans, data: dict):
     """更新许可证 - 开源版本不支持"""
     return {"success": False, "message": "开源版本不支持许可证更新"}
+
+@router.get("/embedding/jobs")
+async def get_embedding_jobs(current_user: CurrentUser, trans: Trans):
+    """后台 Embedding 任务队列状态"""
+    if not current_user.isAdmin:
+        raise Exception(trans('i18n_permission.no_permission', url=" get[/system/embedding/jobs],",
+                              msg=trans('i18n_permission.only_admin')))
+    return embedding_jobs.status()
+
+
+@router.get("/embedding/health")
+async def get_embedding_health():
+    """Embedding 模型就绪状态（免登录，不含错误详情），未就绪时返回 503"""
+    health = EmbeddingModelCache.health()
+    if health['enabled'] and health['status'] in ('loading', 'failed'):
+        return JSONResponse(health, status_code=503)
+    return health
+
+
+@router.get("/embedding/status")
+async def get_embedding_status(current_user: CurrentUser, trans: Trans):
+    """Embedding 模型加载详情，含失败原因"""
+    if not current_user.isAdmin:
+        raise Exception(trans('i18n_permission.no_permission', url=" get[/system/embedding/status],",
+                              msg=trans('i18n_permission.only_admin')))
+    return EmbeddingModelCache.status()
@@ -216,21 +216,26 @@ def get_ds_engine(ds: AssistantOutDsSchema) -> Engine:
     )
     conf.extraJdbc = ''
     from apps.db.db import get_uri_from_config
+    from apps.db.engine_registry import DatasourceEngineCache, build_fingerprint, pool_kwargs
     uri = get_uri_from_config(ds.type, conf)
     # if ds.type == "pg" and ds.db_schema:
     #     connect_args.update({"options": f"-c search_path={ds.db_schema}"})
     # engine = create_engine(uri, connect_args=connect_args, pool_timeout=timeout, pool_size=20, max_overflow=10)
 
-    if ds.type == "pg" and ds.db_schema:
-        engine = create_engine(uri,
-                               connect_args={"options": f"-c search_path={urllib.parse.quote(ds.db_schema)}",
-                                             "connect_timeout": timeout},
-                               pool_timeout=timeout)
-    elif ds.type == 'sqlServer':
-        engine = create_engine(uri, pool_timeout=timeout)
-    elif ds.type == 'oracle':
-        engine = create_engine(uri,
-                               pool_timeout=timeout)
-    else:
-        engine = create_engine(uri, connect_args={"connect_timeout": timeout}, pool_timeout=timeout)
-    return engine
+    def _create():
+        if ds.type == "pg" and ds.db_schema:
+            return create_engine(uri,
+                                 connect_args={"options": f"-c search_path={urllib.parse.quote(ds.db_schema)}",
+                                               "connect_timeout": timeout},
+                                 pool_timeout=timeout, **pool_kwargs())
+        elif ds.type == 'sqlServer':
+            return create_engine(uri, pool_timeout=timeout, **pool_kwargs())
+        elif ds.type == 'oracle':
+            return create_engine(uri,
+                                 pool_timeout=timeout, **pool_kwargs())
+        else:
+            return create_engine(uri, connect_args={"connect_timeout": timeout}, pool_timeout=timeout,
+                                 **pool_kwargs())
+
+    fingerprint = build_fingerprint(ds.type, uri, ds.db_schema)
+    return DatasourceEngineCache.get_engine(f"assistant:{ds.id}", fingerprint, _create)
@@ -4,3 +4,8 @@ from apps.template.template import get_base_template
 def get_sql_template():
     template = get_base_template()
     return template['template']['sql']
+
+
+def get_sql_chart_template():
+    template = get_base_template()
+    return template['template']['sql_chart']
@@ -9,13 +9,15 @@ from sqlalchemy import and_, or_, select, func, delete, update, union, text, Big
 from sqlalchemy.orm import aliased
 from sqlalchemy.orm.session import Session
 
-from apps.ai_model.embedding import EmbeddingModelCache
+from apps.ai_model.embedding import EmbeddingNotReadyError, QueryEmbeddingCache, save_embeddings_in_batches
+from apps.ai_model.vector_index import VectorIndexCache
 from apps.datasource.models.datasource import CoreDatasource
 from apps.template.generate_chart.generator import get_base_terminology_template
 from apps.terminology.models.terminology_model import Terminology, TerminologyInfo
 from common.core.config import settings
 from common.core.deps import SessionDep, Trans
 from common.utils.embedding_threads import run_save_terminology_embeddings
+from common.utils.utils import SQLBotLogUtil
 
 
 def page_terminology(session: SessionDep, current_page: int = 1, page_size: int = 10, name: Optional[str] = None,
@@ -399,6 +401,7 @@ def delete_terminology(session: SessionDep, ids: list[int]):
     stmt = delete(Terminology).where(or_(Terminology.id.in_(ids), Terminology.pid.in_(ids)))
     session.execute(stmt)
     session.commit()
+    VectorIndexCache.remove_where('terminology', None, lambda _id, payload: _id in ids or payload.get('pid') in ids)
 
 
 # def run_save_embeddings(ids: List[int]):
@@ -426,23 +429,52 @@ def save_embeddings(session: Session, ids: List[int]):
     if not ids or len(ids) == 0:
         return
     try:
+        _list = session.query(Terminology.id, Terminology.pid, Terminology.word, Terminology.oid,
+                              Terminology.specific_ds, Terminology.datasource_ids).filter(
+            or_(Terminology.id.in_(ids), Terminology.pid.in_(ids))).all()
+        rows_by_id = {row.id: row for row in _list}
 
-        _list = session.query(Terminology).filter(or_(Terminology.id.in_(ids), Terminology.pid.in_(ids))).all()
+        def update_index(saved: list[tuple[int, list[float]]]):
+            for oid in {rows_by_id[_id].oid for _id, _ in saved}:
+                VectorIndexCache.upsert('terminology', oid,
+                                        [(_id, vector, get_terminology_index_payload(rows_by_id[_id]))
+                                         for _id, vector in saved if rows_by_id[_id].oid == oid])
 
-        _words_list = [item.word for item in _list]
+        if VectorIndexCache.enabled():
+            # words dropped by an update are gone from the table, drop them from the index as well
+            VectorIndexCache.remove_where('terminology', None,
+                                          lambda _id, payload: _id in ids or payload.get('pid') in ids)
 
-        model = EmbeddingModelCache.get_model()
+        save_embeddings_in_batches(session, Terminology, [(row.id, row.word) for row in _list], 'terminology',
+                                   update_index if VectorIndexCache.enabled() else None)
 
-        results = model.embed_documents(_words_list)
+    except Exception:
+        session.rollback()
+        # the embedding job service logs and retries it
+        raise
 
-        for index in range(len(results)):
-            item = results[index]
-            stmt = update(Terminology).where(and_(Terminology.id == _list[index].id)).values(embedding=item)
-            session.execute(stmt)
-            session.commit()
 
-    except Exception:
-        traceback.print_exc()
+def get_terminology_index_payload(row) -> dict:
+    return {'pid': row.pid, 'word': row.word, 'specific_ds': row.specific_ds, 'datasource_ids': row.datasource_ids}
+
+
+def load_terminology_index_items(session: Session, oid: int):
+    rows = session.query(Terminology.id, Terminology.pid, Terminology.word, Terminology.specific_ds,
+                         Terminology.datasource_ids, Terminology.embedding).filter(
+        and_(Terminology.oid == oid, Terminology.embedding.isnot(None))).all()
+    return [(row.id, row.embedding, get_terminology_index_payload(row)) for row in rows]
+
+
+def search_terminology_index(session: Session, embedding: List[float], oid: int, datasource: int = None):
+    # same filter as embedding_sql/embedding_sql_with_datasource, evaluated on the index payloads
+    def visible(_id: int, payload: dict) -> bool:
+        if not payload.get('specific_ds'):
+            return True
+        return datasource is not None and datasource in (payload.get('datasource_ids') or [])
+
+    index = VectorIndexCache.get('terminology', oid, lambda: load_terminology_index_items(session, oid))
+    return index.search(embedding, settings.EMBEDDING_TERMINOLOGY_TOP_COUNT,
+                        min_score=settings.EMBEDDING_TERMINOLOGY_SIMILARITY, predicate=visible)
 
 
 embedding_sql = f"""
@@ -520,11 +552,13 @@ def select_terminology_by_word(session: SessionDep, word: str, oid: int, datasou
     if settings.EMBEDDING_ENABLED:
         with session.begin_nested():
             try:
-                model = EmbeddingModelCache.get_model()
-
-                embedding = model.embed_query(word)
+                embedding = QueryEmbeddingCache.embed(word)
 
-                if datasource is not None:
+                if VectorIndexCache.enabled():
+                    results = [Terminology(id=_id, word=payload['word'], pid=payload['pid'])
+                               for _id, _score, payload in search_terminology_index(session, embedding, oid,
+                                                                                    datasource)]
+                elif datasource is not None:
                     results = session.execute(text(embedding_sql_with_datasource),
                                               {'embedding_array': str(embedding), 'oid': oid,
                                                'datasource': datasource}).fetchall()
@@ -535,6 +569,8 @@ def select_terminology_by_word(session: SessionDep, word: str, oid: int, datasou
                 for row in results:
                     _list.append(Terminology(id=row.id, word=row.word, pid=row.pid))
 
+            except EmbeddingNotReadyError as e:
+                SQLBotLogUtil.info(f"Terminology embedding search skipped: {e}")
             except Exception:
                 traceback.print_exc()
                 session.rollback()
@@ -89,12 +89,30 @@ class Settings(BaseSettings):
     LOCAL_MODEL_PATH: str = '/opt/sqlbot/models'
     DEFAULT_EMBEDDING_MODEL: str = 'shibing624/text2vec-base-chinese'
     EMBEDDING_ENABLED: bool = True
+    # 'torch' or 'onnx' (ONNX Runtime, needs sentence-transformers[onnx]); int8 dynamic quantization of the
+    # ONNX model for the given instruction set: '' (off), 'avx512_vnni', 'avx512', 'avx2' or 'arm64'
+    EMBEDDING_BACKEND: Literal['torch', 'onnx'] = 'torch'
+    EMBEDDING_ONNX_QUANTIZATION: str = ''
+    # load and warm the embedding model in the background at startup; until it is ready request paths wait at
+    # most EMBEDDING_NOT_READY_WAIT seconds, then skip embedding retrieval instead of blocking
+    EMBEDDING_PRELOAD: bool = True
+    EMBEDDING_NOT_READY_WAIT: float = 0.5
+    EMBEDDING_WARM_UP_RETRY_DELAY: int = 60  # seconds between background reloads after a failed warm-up
     EMBEDDING_DEFAULT_SIMILARITY: float = 0.4
     EMBEDDING_TERMINOLOGY_SIMILARITY: float = EMBEDDING_DEFAULT_SIMILARITY
     EMBEDDING_DATA_TRAINING_SIMILARITY: float = EMBEDDING_DEFAULT_SIMILARITY
     EMBEDDING_DEFAULT_TOP_COUNT: int = 5
     EMBEDDING_TERMINOLOGY_TOP_COUNT: int = EMBEDDING_DEFAULT_TOP_COUNT
     EMBEDDING_DATA_TRAINING_TOP_COUNT: int = EMBEDDING_DEFAULT_TOP_COUNT
+    # distinct texts per embed call, bulk UPDATE and commit when saving terminology/training embeddings
+    EMBEDDING_BATCH_SIZE: int = 256
+    # question embeddings kept in memory, shared by all retrieval steps; 0 disables (the per turn memo stays)
+    QUERY_EMBEDDING_CACHE_SIZE: int = 1000
+    # background embedding jobs, 0 workers derives the pool size from the CPU count
+    EMBEDDING_JOB_WORKERS: int = 0
+    EMBEDDING_JOB_QUEUE_SIZE: int = 100
+    EMBEDDING_JOB_MAX_RETRIES: int = 3
+    EMBEDDING_JOB_RETRY_DELAY: int = 5  # seconds, doubled on every retry
 
     PARSE_REASONING_BLOCK_ENABLED: bool = True
     DEFAULT_REASONING_CONTENT_START: str = '<think>'
@@ -105,9 +123,70 @@ class Settings(BaseSettings):
     PG_POOL_RECYCLE: int = 3600
     PG_POOL_PRE_PING: bool = True
 
+    # pooled engines for user datasources, one engine per datasource
+    DS_POOL_SIZE: int = 5
+    DS_MAX_OVERFLOW: int = 10
+    DS_POOL_RECYCLE: int = 3600
+    DS_POOL_PRE_PING: bool = True
+    DS_ENGINE_IDLE_TIMEOUT: int = 1800  # seconds, dispose engines unused for longer than this
+    DS_ENGINE_MAX_COUNT: int = 100
+    # raw connection pools for py_driver datasources (dm, doris, redshift, kingbase)
+    DS_DRIVER_POOL_MAX_SIZE: int = 10
+    DS_DRIVER_IDLE_TIMEOUT: int = 300
+    # cached datasource version/liveness, refreshed in background after half of the ttl
+    DS_STATUS_CACHE_TTL: int = 600
+    DS_STATUS_FAILED_TTL: int = 30
+    # rendered schema prompt per datasource, rebuilt when its tables/fields/relations change; the ttl bounds
+    # staleness across worker processes
+    SCHEMA_CACHE_TTL: int = 600
+    # rows fetched per round trip and rows kept for a chat query result
+    SQL_FETCH_BATCH_SIZE: int = 500
+    SQL_RESULT_MAX_ROWS: int = 1000
+    # push the row cap into the generated SQL (LIMIT/TOP/FETCH FIRST) before execution
+    SQL_LIMIT_WRAP_ENABLED: bool = True
+    SQL_STATEMENT_TIMEOUT: int = 60  # seconds, applied per dialect to chat queries, 0 disables
+    # cache of executed chat sql results, in memory or redis depending on CACHE_TYPE
+    SQL_RESULT_CACHE_ENABLED: bool = False
+    SQL_RESULT_CACHE_TTL: int = 300
+    SQL_RESULT_CACHE_DS_TTL: dict[int, int] = {}  # per datasource ttl override, e.g. {"3": 3600, "5": 0}
+    SQL_RESULT_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    SQL_RESULT_CACHE_MAX_ENTRY_BYTES: int = 16 * 1024 * 1024
+    # replay the llm sql/chart answer for a repeated question, optionally matched by embedding similarity
+    ANSWER_CACHE_ENABLED: bool = False
+    ANSWER_CACHE_TTL: int = 24 * 3600
+    ANSWER_CACHE_MAX_ENTRIES: int = 5000
+    ANSWER_CACHE_EMBEDDING_ENABLED: bool = False
+    ANSWER_CACHE_SIMILARITY: float = 0.95
+    # streamed chat tasks run on the event loop with LangChain astream, blocking steps go to the executor
+    LLM_ASYNC_STREAM_ENABLED: bool = True
+    # terminology/data training/custom prompt retrieval run concurrently, a stage slower than this is skipped
+    RETRIEVAL_STAGE_TIMEOUT: float = 5  # seconds, 0 disables
+    # start the chart llm call once the sql is validated, concurrently with its execution (streamed chats only)
+    CHART_PIPELINE_ENABLED: bool = True
+    # ask for the sql and the chart config in one llm call, the separate chart call remains the fallback
+    SQL_CHART_SINGLE_CALL_ENABLED: bool = False
+    # apply row permission filters by wrapping the filtered tables in the generated sql, the llm rewrite remains
+    # the fallback for sql the rewriter cannot handle
+    ROW_FILTER_REWRITE_ENABLED: bool = True
+    # conversation history replayed to the llm: the most recent whole turns within this many tokens, 0 disables
+    # the budget; the answers of older turns can be kept as a short block in the system prompt
+    CHAT_HISTORY_TOKEN_BUDGET: int = 4000
+    CHAT_HISTORY_TOKENIZER: str = 'cl100k_base'  # tiktoken encoding, estimated when tiktoken is unavailable
+    CHAT_HISTORY_SUMMARY_ENABLED: bool = False
+    CHAT_HISTORY_SUMMARY_TOKENS: int = 500
+    CHAT_HISTORY_SUMMARY_ANSWER_CHARS: int = 300
+
     TABLE_EMBEDDING_COUNT: int = 10
     # Datasource embedding selection threshold: if score < threshold, fallback to LLM
     DATASOURCE_EMBEDDING_THRESHOLD: float = 0.5
+    # candidates returned by the persisted datasource embedding query
+    DATASOURCE_EMBEDDING_TOP_COUNT: int = 5
+    # embedding retrieval backend: pgvector queries, or an in-process index ('exact' NumPy, 'hnsw' needs the hnsw extra)
+    VECTOR_INDEX_BACKEND: Literal['pgvector', 'exact', 'hnsw'] = 'pgvector'
+    VECTOR_INDEX_TTL: int = 600
+    VECTOR_INDEX_HNSW_M: int = 16
+    VECTOR_INDEX_HNSW_EF: int = 200
+    VECTOR_INDEX_HNSW_OVERFETCH: int = 10
 
 
 # TABLE_EMBEDDING_ENABLED 硬编码在代码中，不从环境变量读取
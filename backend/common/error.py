@@ -15,5 +15,13 @@ class SQLBotDBError(Exception):
     pass
 
 
+class SQLBotDBTimeoutError(SQLBotDBError):
+    pass
+
+
+class SQLBotDBCancelledError(SQLBotDBError):
+    pass
+
+
 class ParseSQLResultError(Exception):
     pass
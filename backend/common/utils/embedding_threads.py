@@ -1,33 +1,228 @@
-from concurrent.futures import ThreadPoolExecutor
-from typing import List
+import os
+import queue
+import threading
+import time
+import traceback
+from typing import Callable, List, Optional
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlmodel import Session
 
 from common.core.config import settings
+from common.core.db import engine
+from common.utils.utils import SQLBotLogUtil
 
-executor = ThreadPoolExecutor(max_workers=200)
 
-engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
-session_maker = sessionmaker(bind=engine)
-session = session_maker()
+def _save_terminology(session: Session, ids: List[int]):
+    from apps.terminology.curd.terminology import save_embeddings
+    save_embeddings(session, ids)
+
+
+def _fill_terminology(session: Session, _ids):
+    from apps.terminology.curd.terminology import run_fill_empty_embeddings
+    run_fill_empty_embeddings(session)
+
+
+def _save_data_training(session: Session, ids: List[int]):
+    from apps.data_training.curd.data_training import save_embeddings
+    save_embeddings(session, ids)
+
+
+def _fill_data_training(session: Session, _ids):
+    from apps.data_training.curd.data_training import run_fill_empty_embeddings
+    run_fill_empty_embeddings(session)
+
+
+def _save_table(session: Session, ds_ids: List[int]):
+    from apps.datasource.embedding.table_embedding import save_table_embeddings
+    save_table_embeddings(session, ds_ids)
+
+
+def _fill_table(session: Session, _ids):
+    from apps.datasource.embedding.table_embedding import run_fill_empty_table_embeddings
+    run_fill_empty_table_embeddings(session)
+
+
+def _save_ds(session: Session, ds_ids: List[int]):
+    from apps.datasource.embedding.ds_embedding import save_ds_embeddings
+    save_ds_embeddings(session, ds_ids)
+
+
+def _fill_ds(session: Session, _ids):
+    from apps.datasource.embedding.ds_embedding import run_fill_empty_ds_embeddings
+    run_fill_empty_ds_embeddings(session)
+
+
+_handlers: dict[str, Callable[[Session, Optional[List[int]]], None]] = {
+    'terminology': _save_terminology,
+    'terminology_fill': _fill_terminology,
+    'data_training': _save_data_training,
+    'data_training_fill': _fill_data_training,
+    'table': _save_table,
+    'table_fill': _fill_table,
+    'datasource': _save_ds,
+    'datasource_fill': _fill_ds,
+}
+
+
+class EmbeddingJob:
+    def __init__(self, kind: str, ids: Optional[set[int]]):
+        self.kind = kind
+        # None for fill jobs, which scan for empty embeddings themselves
+        self.ids = ids
+        self.attempts = 0
+        self.submit_time = time.time()
+
+
+class EmbeddingJobService:
+    """
+    Runs embedding jobs on a small fixed pool, the model is CPU bound and more threads only oversubscribe
+    the torch runtime. Jobs of the same kind that are still queued are coalesced into one, each job gets
+    its own session, and a failed job is retried with backoff up to EMBEDDING_JOB_MAX_RETRIES times.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self._queue: queue.Queue[EmbeddingJob] = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._pending: dict[str, EmbeddingJob] = {}
+        self._running: dict[str, EmbeddingJob] = {}
+        self._threads: list[threading.Thread] = []
+        self._counters = {'submitted': 0, 'coalesced': 0, 'succeeded': 0, 'retried': 0, 'failed': 0,
+                          'rejected': 0}
+        self._last_error: Optional[dict] = None
+
+    def submit(self, kind: str, ids: Optional[List[int]] = None) -> bool:
+        with self._lock:
+            self._counters['submitted'] += 1
+            return self._enqueue(kind, set(ids) if ids is not None else None)
+
+    def _enqueue(self, kind: str, ids: Optional[set[int]], attempts: int = 0) -> bool:
+        # called with self._lock held
+        self._start()
+        job = self._pending.get(kind)
+        if job is not None:
+            if ids is not None:
+                job.ids.update(ids)
+            job.attempts = max(job.attempts, attempts)
+            self._counters['coalesced'] += 1
+            return True
+        job = EmbeddingJob(kind, ids)
+        job.attempts = attempts
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._counters['rejected'] += 1
+            SQLBotLogUtil.warning(f"Embedding job queue is full, dropped {kind} job for {len(ids or [])} ids")
+            return False
+        self._pending[kind] = job
+        return True
+
+    def _start(self):
+        # called with self._lock held; threads start on first use, not at import
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"embedding-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        name = threading.current_thread().name
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                # from here on new ids of this kind start a new job instead of joining this one
+                if self._pending.get(job.kind) is job:
+                    self._pending.pop(job.kind)
+                self._running[name] = job
+            start_time = time.time()
+            try:
+                with Session(engine) as session:
+                    _handlers[job.kind](session, sorted(job.ids) if job.ids is not None else None)
+                with self._lock:
+                    self._counters['succeeded'] += 1
+                SQLBotLogUtil.info(f"Embedding job {job.kind} done in {time.time() - start_time:.3f}s, "
+                                   f"waited {start_time - job.submit_time:.3f}s")
+            except Exception as e:
+                traceback.print_exc()
+                self._retry(job, e)
+            finally:
+                with self._lock:
+                    self._running.pop(name, None)
+                self._queue.task_done()
+
+    def _retry(self, job: EmbeddingJob, error: Exception):
+        job.attempts += 1
+        with self._lock:
+            self._last_error = {'kind': job.kind, 'error': str(error), 'time': int(time.time())}
+            if job.attempts > settings.EMBEDDING_JOB_MAX_RETRIES:
+                self._counters['failed'] += 1
+                SQLBotLogUtil.error(f"Embedding job {job.kind} failed after {job.attempts} attempts: {error}")
+                return
+            self._counters['retried'] += 1
+        delay = settings.EMBEDDING_JOB_RETRY_DELAY * (2 ** (job.attempts - 1))
+        SQLBotLogUtil.warning(f"Embedding job {job.kind} failed, retry {job.attempts} in {delay}s: {error}")
+        timer = threading.Timer(delay, self._resubmit, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def _resubmit(self, job: EmbeddingJob):
+        with self._lock:
+            self._enqueue(job.kind, job.ids, job.attempts)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_size': self._queue.qsize(),
+                'queue_max_size': self._queue.maxsize,
+                'pending': [{'kind': job.kind, 'ids': len(job.ids) if job.ids is not None else None,
+                             'attempts': job.attempts, 'age': int(time.time() - job.submit_time)}
+                            for job in self._pending.values()],
+                'running': [{'worker': name, 'kind': job.kind, 'attempts': job.attempts}
+                            for name, job in self._running.items()],
+                **self._counters,
+                'last_error': self._last_error,
+            }
+
+
+def _default_workers() -> int:
+    if settings.EMBEDDING_JOB_WORKERS > 0:
+        return settings.EMBEDDING_JOB_WORKERS
+    # each encode call already uses several torch threads
+    return max(1, min(4, (os.cpu_count() or 1) // 4))
+
+
+embedding_jobs = EmbeddingJobService(_default_workers(), settings.EMBEDDING_JOB_QUEUE_SIZE)
 
 
 def run_save_terminology_embeddings(ids: List[int]):
-    from apps.terminology.curd.terminology import save_embeddings
-    executor.submit(save_embeddings, session, ids)
+    embedding_jobs.submit('terminology', ids)
 
 
 def fill_empty_terminology_embeddings():
-    from apps.terminology.curd.terminology import run_fill_empty_embeddings
-    executor.submit(run_fill_empty_embeddings, session)
+    embedding_jobs.submit('terminology_fill')
 
 
 def run_save_data_training_embeddings(ids: List[int]):
-    from apps.data_training.curd.data_training import save_embeddings
-    executor.submit(save_embeddings, session, ids)
+    embedding_jobs.submit('data_training', ids)
 
 
 def fill_empty_data_training_embeddings():
-    from apps.data_training.curd.data_training import run_fill_empty_embeddings
-    executor.submit(run_fill_empty_embeddings, session)
+    embedding_jobs.submit('data_training_fill')
+
+
+def run_save_table_embeddings(ds_ids: List[int]):
+    embedding_jobs.submit('table', ds_ids)
+
+
+def fill_empty_table_embeddings():
+    embedding_jobs.submit('table_fill')
+
+
+def run_save_ds_embeddings(ds_ids: List[int]):
+    embedding_jobs.submit('datasource', ds_ids)
+
+
+def fill_empty_ds_embeddings():
+    embedding_jobs.submit('datasource_fill')
@@ -28,6 +28,7 @@ wlist = [
     "/images/*",
     "/sse",
     "/system/appearance/ui",
+    "/system/embedding/health",
     "/system/appearance/picture/*",
     "/system/assistant/validator*",
     "/system/assistant/info/*",
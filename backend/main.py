@@ -27,14 +27,17 @@ from starlette.exceptions import HTTPException as StarletteHTTPException
 from starlette.middleware.cors import CORSMiddleware
 
 from alembic import command
+from apps.ai_model.embedding import EmbeddingModelCache
 from apps.api import api_router
+from apps.chat.task.history import start_tokenizer_load
 from apps.system.crud.aimodel_manage import async_model_info
 from apps.system.crud.assistant import init_dynamic_cors
 from apps.system.middleware.auth import TokenMiddleware
 from common.core.config import settings
 from common.core.response_middleware import ResponseMiddleware, exception_handler
 from common.core.sqlbot_cache import init_sqlbot_cache
-from common.utils.embedding_threads import fill_empty_terminology_embeddings, fill_empty_data_training_embeddings
+from common.utils.embedding_threads import fill_empty_terminology_embeddings, fill_empty_data_training_embeddings, \
+    fill_empty_table_embeddings, fill_empty_ds_embeddings
 from common.utils.utils import SQLBotLogUtil
 
 
@@ -43,6 +46,15 @@ def run_migrations():
     command.upgrade(alembic_cfg, "head")
 
 
+def init_embedding_model():
+    if settings.EMBEDDING_PRELOAD:
+        EmbeddingModelCache.start_warm_up()
+
+
+def init_chat_history_tokenizer():
+    start_tokenizer_load()
+
+
 def init_terminology_embedding_data():
     fill_empty_terminology_embeddings()
 
@@ -51,13 +63,21 @@ def init_data_training_embedding_data():
     fill_empty_data_training_embeddings()
 
 
+def init_table_embedding_data():
+    fill_empty_table_embeddings()
+    fill_empty_ds_embeddings()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     run_migrations()
     init_sqlbot_cache()
     init_dynamic_cors(app)
+    init_embedding_model()
+    init_chat_history_tokenizer()
     init_terminology_embedding_data()
     init_data_training_embedding_data()
+    init_table_embedding_data()
     SQLBotLogUtil.info("✅ SQLBot 初始化完成")
     await sqlbot_xpack.core.clean_xpack_cache()
     await async_model_info()  # 异步加密已有模型的密钥和地址
@@ -0,0 +1,91 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+pytest.importorskip("pydantic_settings")
+
+from apps.chat.task import history  # noqa: E402
+from apps.chat.task.history import build_history  # noqa: E402
+from common.core.config import settings  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def one_token_per_char(monkeypatch):
+    monkeypatch.setattr(history, 'count_tokens', lambda text: len(text))
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_SUMMARY_ENABLED', False)
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_SUMMARY_ANSWER_CHARS', 300)
+
+
+def _log(turns: int) -> list[dict]:
+    # as stored in the operation log: the system prompt, then question/answer pairs
+    messages = [{'type': 'system', 'content': 'old system prompt'}]
+    for i in range(turns):
+        messages.append({'type': 'human', 'content': f'question {i}'})
+        messages.append({'type': 'ai', 'content': f'answer {i}'})
+    return messages
+
+
+def _contents(messages) -> list[str]:
+    return [msg.content for msg in messages]
+
+
+def test_keeps_recent_whole_turns_within_budget(monkeypatch):
+    # each turn is len('question n') + len('answer n') = 18 tokens
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_TOKEN_BUDGET', 40)
+    messages = build_history('system', _log(5))
+    assert messages[0].type == 'system'
+    assert messages[0].content == 'system'
+    assert _contents(messages[1:]) == ['question 3', 'answer 3', 'question 4', 'answer 4']
+
+
+def test_never_splits_a_turn(monkeypatch):
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_TOKEN_BUDGET', 30)
+    messages = build_history('system', _log(3))
+    assert _contents(messages[1:]) == ['question 2', 'answer 2']
+    assert [msg.type for msg in messages] == ['system', 'human', 'ai']
+
+
+def test_max_messages_cap(monkeypatch):
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_TOKEN_BUDGET', 10000)
+    messages = build_history('system', _log(5), max_messages=5)
+    assert _contents(messages[1:]) == ['question 3', 'answer 3', 'question 4', 'answer 4']
+
+
+def test_budget_zero_disables_the_budget(monkeypatch):
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_TOKEN_BUDGET', 0)
+    assert len(build_history('system', _log(5))) == 11
+    assert len(build_history('system', _log(5), max_messages=6)) == 7
+
+
+def test_oversized_latest_turn_drops_all_history(monkeypatch):
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_TOKEN_BUDGET', 10)
+    assert _contents(build_history('system', _log(2))) == ['system']
+
+
+def test_empty_history():
+    assert _contents(build_history('system', [])) == ['system']
+    assert _contents(build_history('system', None)) == ['system']
+
+
+def test_summary_of_dropped_turns(monkeypatch):
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_TOKEN_BUDGET', 20)
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_SUMMARY_ENABLED', True)
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_SUMMARY_TOKENS', 1000)
+    messages = build_history('system', _log(3))
+    assert messages[0].content == 'system\n\n<earlier-answers>\nanswer 0\nanswer 1\n</earlier-answers>'
+    assert _contents(messages[1:]) == ['question 2', 'answer 2']
+
+
+def test_summary_keeps_the_newest_answers_within_its_budget(monkeypatch):
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_TOKEN_BUDGET', 20)
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_SUMMARY_ENABLED', True)
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_SUMMARY_TOKENS', 10)
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_SUMMARY_ANSWER_CHARS', 6)
+    messages = build_history('system', _log(4))
+    # answers cut to 6 chars ('answer'), 10 tokens hold one of them
+    assert messages[0].content == 'system\n\n<earlier-answers>\nanswer\n</earlier-answers>'
+
+
+def test_no_summary_when_nothing_is_dropped(monkeypatch):
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_TOKEN_BUDGET', 1000)
+    monkeypatch.setattr(settings, 'CHAT_HISTORY_SUMMARY_ENABLED', True)
+    assert build_history('system', _log(2))[0].content == 'system'
@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("langchain_huggingface")
+
+from apps.ai_model.embedding import local_embedding_model  # noqa: E402
+from apps.ai_model.embedding_parity import SAMPLE_TEXTS, check_parity  # noqa: E402
+from common.core.config import settings  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not os.path.isdir(local_embedding_model.name),
+                                reason=f"local embedding model not found at {local_embedding_model.name}")
+
+
+def _assert_parity(result: dict):
+    assert result["min_cosine"] >= 0.99
+    assert result["neighbour_agreement"] == 1.0
+
+
+def test_onnx_matches_torch():
+    _assert_parity(check_parity(SAMPLE_TEXTS))
+
+
+@pytest.mark.skipif(not settings.EMBEDDING_ONNX_QUANTIZATION, reason="EMBEDDING_ONNX_QUANTIZATION not set")
+def test_quantized_onnx_matches_torch():
+    _assert_parity(check_parity(SAMPLE_TEXTS, settings.EMBEDDING_ONNX_QUANTIZATION))
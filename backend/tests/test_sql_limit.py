@@ -0,0 +1,84 @@
+from apps.db.sql_limit import wrap_limit
+
+
+def test_appends_limit():
+    assert wrap_limit('SELECT a FROM t;', 'pg', 100) == 'SELECT a FROM t\nLIMIT 100'
+
+
+def test_caps_larger_existing_limit():
+    assert wrap_limit('SELECT a FROM t ORDER BY a LIMIT 1000000', 'pg', 100) == 'SELECT a FROM t ORDER BY a LIMIT 100'
+    assert wrap_limit('SELECT a FROM t LIMIT 5, 1000000', 'mysql', 100) == 'SELECT a FROM t LIMIT 5, 100'
+    assert wrap_limit('SELECT a FROM t LIMIT 1000000 OFFSET 5', 'pg', 100) == 'SELECT a FROM t LIMIT 100 OFFSET 5'
+
+
+def test_keeps_smaller_existing_limit():
+    assert wrap_limit('SELECT a FROM t LIMIT 10', 'pg', 100) == 'SELECT a FROM t LIMIT 10'
+
+
+def test_wraps_non_literal_limit():
+    assert wrap_limit('SELECT a FROM t LIMIT ALL', 'pg', 100) == \
+           'SELECT * FROM (\nSELECT a FROM t LIMIT ALL\n) _sqlbot_limit\nLIMIT 100'
+
+
+def test_ignores_limit_in_sub_query():
+    assert wrap_limit('SELECT * FROM (SELECT a FROM t LIMIT 10) x', 'pg', 100) == \
+           'SELECT * FROM (SELECT a FROM t LIMIT 10) x\nLIMIT 100'
+
+
+def test_limit_before_locking_clause():
+    assert wrap_limit('SELECT a FROM t FOR UPDATE', 'pg', 100) == 'SELECT a FROM t\nLIMIT 100\nFOR UPDATE'
+    assert wrap_limit('SELECT a FROM t FOR SHARE', 'pg', 100) == 'SELECT a FROM t\nLIMIT 100\nFOR SHARE'
+
+
+def test_oracle_12c_fetch_first():
+    assert wrap_limit('SELECT a FROM t', 'oracle', 100, '19.0.0.0.0') == 'SELECT a FROM t\nFETCH FIRST 100 ROWS ONLY'
+    assert wrap_limit('SELECT a FROM t FETCH FIRST 5000 ROWS ONLY', 'oracle', 100, '19.0.0.0.0') == \
+           'SELECT a FROM t FETCH FIRST 100 ROWS ONLY'
+
+
+def test_oracle_11g_rownum():
+    assert wrap_limit('SELECT a FROM t ORDER BY a', 'oracle', 100, '11.2.0.4.0') == \
+           'SELECT * FROM (\nSELECT a FROM t ORDER BY a\n) WHERE ROWNUM <= 100'
+    # version unknown
+    assert wrap_limit('SELECT a FROM t', 'oracle', 100) == 'SELECT * FROM (\nSELECT a FROM t\n) WHERE ROWNUM <= 100'
+
+
+def test_oracle_existing_rownum():
+    assert wrap_limit('SELECT a FROM t WHERE rownum <= 10', 'oracle', 100, '19.0.0.0.0') == \
+           'SELECT * FROM (\nSELECT a FROM t WHERE rownum <= 10\n) WHERE ROWNUM <= 100'
+
+
+def test_sql_server_top():
+    assert wrap_limit('SELECT a FROM t', 'sqlServer', 100) == 'SELECT TOP 100 a FROM t'
+    assert wrap_limit('SELECT DISTINCT TOP 5000 a FROM t', 'sqlServer', 100) == 'SELECT DISTINCT TOP 100 a FROM t'
+    assert wrap_limit('SELECT TOP (10) a FROM t', 'sqlServer', 100) == 'SELECT TOP (10) a FROM t'
+    assert wrap_limit('SELECT a FROM t ORDER BY a', 'sqlServer', 100) == \
+           'SELECT a FROM t ORDER BY a\nOFFSET 0 ROWS FETCH NEXT 100 ROWS ONLY'
+    assert wrap_limit('SELECT a FROM t ORDER BY a OFFSET 0 ROWS FETCH NEXT 5000 ROWS ONLY', 'sqlServer', 100) == \
+           'SELECT a FROM t ORDER BY a OFFSET 0 ROWS FETCH NEXT 100 ROWS ONLY'
+    assert wrap_limit('SELECT TOP 50 PERCENT a FROM t', 'sqlServer', 100) == \
+           'SELECT TOP 100 * FROM (\nSELECT TOP 50 PERCENT a FROM t\n) AS _sqlbot_limit'
+
+
+def test_sql_server_union():
+    assert wrap_limit('SELECT a FROM t UNION SELECT b FROM u', 'sqlServer', 100) == \
+           'SELECT TOP 100 * FROM (\nSELECT a FROM t UNION SELECT b FROM u\n) AS _sqlbot_limit'
+
+
+def test_not_a_select():
+    assert wrap_limit('UPDATE t SET a = 1', 'pg', 100) == 'UPDATE t SET a = 1'
+    assert wrap_limit('SELECT 1; SELECT 2', 'pg', 100) == 'SELECT 1; SELECT 2'
+
+
+def test_caps_fetch_first_in_limit_dialect():
+    assert wrap_limit('select * from t fetch first 5000 rows only', 'pg', 1001) == \
+           'select * from t fetch first 1001 rows only'
+    assert wrap_limit('select * from t fetch first row only', 'pg', 1001) == \
+           'SELECT * FROM (\nselect * from t fetch first row only\n) _sqlbot_limit\nLIMIT 1001'
+
+
+def test_wraps_clickhouse_limit_by():
+    assert wrap_limit('SELECT a, b FROM t ORDER BY b LIMIT 5 BY a', 'ck', 100) == \
+           'SELECT * FROM (\nSELECT a, b FROM t ORDER BY b LIMIT 5 BY a\n) _sqlbot_limit\nLIMIT 100'
+    assert wrap_limit('SELECT a FROM t LIMIT 5 BY a LIMIT 1000', 'ck', 100) == \
+           'SELECT * FROM (\nSELECT a FROM t LIMIT 5 BY a LIMIT 1000\n) _sqlbot_limit\nLIMIT 100'
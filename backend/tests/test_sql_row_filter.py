@@ -0,0 +1,85 @@
+import pytest
+
+from apps.db.sql_row_filter import apply_row_filters
+
+FILTERS = [{"table": "orders", "filter": "region = 'east'"}, {"table": "users", "filter": ""}]
+ORDERS = "(SELECT * FROM orders WHERE region = 'east')"
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ('SELECT o.id FROM orders o', f'SELECT o.id FROM {ORDERS} o'),
+    ('SELECT o.id FROM orders AS o', f'SELECT o.id FROM {ORDERS} o'),
+    ('SELECT id FROM orders', f'SELECT id FROM {ORDERS} orders'),
+    ('SELECT a.id FROM orders a, items b WHERE a.id = b.oid',
+     f'SELECT a.id FROM {ORDERS} a, items b WHERE a.id = b.oid'),
+    ('SELECT o.id FROM items i JOIN orders o ON o.id = i.oid',
+     f'SELECT o.id FROM items i JOIN {ORDERS} o ON o.id = i.oid'),
+    ('SELECT o.id FROM items i LEFT JOIN orders o ON o.id = i.oid',
+     f'SELECT o.id FROM items i LEFT JOIN {ORDERS} o ON o.id = i.oid'),
+    ('SELECT id FROM items JOIN orders USING (id)', f'SELECT id FROM items JOIN {ORDERS} orders USING (id)'),
+    ('SELECT id FROM items i WHERE EXISTS (SELECT 1 FROM orders o WHERE o.id = i.oid)',
+     f'SELECT id FROM items i WHERE EXISTS (SELECT 1 FROM {ORDERS} o WHERE o.id = i.oid)'),
+    ('SELECT id FROM items WHERE oid IN (SELECT id FROM orders)',
+     f'SELECT id FROM items WHERE oid IN (SELECT id FROM {ORDERS} orders)'),
+    ('WITH x AS (SELECT id FROM orders) SELECT * FROM x', f'WITH x AS (SELECT id FROM {ORDERS} orders) SELECT * FROM x'),
+    ('SELECT id FROM items UNION ALL SELECT id FROM orders',
+     f'SELECT id FROM items UNION ALL SELECT id FROM {ORDERS} orders'),
+    ('SELECT i.id, o.id FROM items i, LATERAL (SELECT id FROM orders WHERE orders.uid = i.uid) o',
+     f'SELECT i.id, o.id FROM items i, LATERAL (SELECT id FROM {ORDERS} orders WHERE orders.uid = i.uid) o'),
+    ('SELECT * FROM ((items i JOIN orders o ON o.id = i.oid) JOIN x ON x.id = i.id)',
+     f'SELECT * FROM ((items i JOIN {ORDERS} o ON o.id = i.oid) JOIN x ON x.id = i.id)'),
+    ('SELECT * FROM items;', 'SELECT * FROM items'),
+])
+def test_rewrites_every_reference(sql, expected):
+    assert apply_row_filters(sql, 'pg', FILTERS) == expected
+
+
+def test_keeps_quoting_and_schema():
+    assert apply_row_filters('SELECT "o"."id" FROM "public"."orders" "o"', 'pg', FILTERS) == \
+           'SELECT "o"."id" FROM (SELECT * FROM "public"."orders" WHERE region = \'east\') "o"'
+    assert apply_row_filters('SELECT "id" FROM "public"."orders"', 'pg', FILTERS) == \
+           'SELECT "id" FROM (SELECT * FROM "public"."orders" WHERE region = \'east\') "orders"'
+    assert apply_row_filters('SELECT `o`.`id` FROM `orders` AS `o`', 'mysql', FILTERS) == \
+           "SELECT `o`.`id` FROM (SELECT * FROM `orders` WHERE region = 'east') `o`"
+    assert apply_row_filters('SELECT TOP 10 [o].[id] FROM [dbo].[orders] [o]', 'sqlServer', FILTERS) == \
+           "SELECT TOP 10 [o].[id] FROM (SELECT * FROM [dbo].[orders] WHERE region = 'east') [o]"
+    assert apply_row_filters('SELECT "O"."ID" FROM "ORDERS" "O"', 'oracle', FILTERS) == \
+           'SELECT "O"."ID" FROM (SELECT * FROM "ORDERS" WHERE region = \'east\') "O"'
+
+
+@pytest.mark.parametrize('sql', [
+    # schema.table.column needs the original table reference
+    'SELECT "public"."orders"."id" FROM "public"."orders"',
+    # parenthesized joins
+    'SELECT * FROM (orders o JOIN items i ON o.id = i.oid)',
+    'SELECT * FROM items i JOIN (orders o JOIN z ON z.id = o.id) ON o.id = i.oid',
+    # a column named like a filtered table
+    'SELECT orders FROM items',
+    # not a single SELECT
+    'UPDATE orders SET region = 1',
+    'DELETE FROM orders',
+    'SELECT 1 FROM orders; SELECT 2 FROM orders',
+    '',
+])
+def test_falls_back_when_unsure(sql):
+    assert apply_row_filters(sql, 'pg', FILTERS) is None
+
+
+@pytest.mark.parametrize('table', ['user', 'order', 'table', 'group', 'year'])
+def test_falls_back_for_keyword_table_names(table):
+    filters = [{"table": table, "filter": "a = 1"}]
+    assert apply_row_filters(f'SELECT * FROM {table} WHERE x = 1', 'pg', filters) is None
+    assert apply_row_filters(f'SELECT t.x FROM {table} t', 'pg', filters) is None
+
+
+def test_unsupported_datasource():
+    assert apply_row_filters('SELECT * FROM orders', 'es', FILTERS) is None
+
+
+def test_no_active_filters_returns_sql_unchanged():
+    sql = 'SELECT * FROM orders;'
+    assert apply_row_filters(sql, 'pg', []) == sql
+    assert apply_row_filters(sql, 'pg', None) == sql
+    assert apply_row_filters(sql, 'pg', [{"table": "orders", "filter": ""}, {"table": "users", "filter": None},
+                                         {"table": "items", "filter": "  "}]) == sql
+    assert apply_row_filters(sql, 'es', [{"table": "orders", "filter": ""}]) == sql